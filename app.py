@@ -8,16 +8,20 @@ from dash.exceptions import PreventUpdate
 from pymatgen import __version__ as pmg_version
 
 from pymatgen import MPRester
+from pymatgen.core.composition import Composition
+from flask import jsonify, request
 from flask_caching import Cache
 
 from crystal_toolkit.components.core import MPComponent
 from crystal_toolkit.helpers.layouts import *
+from crystal_toolkit.helpers.stability import batch_stability_analysis
 import crystal_toolkit.components as ctc
 
 from synthesis_app.components.search import ChemsysSearchComponent
 
 import os
 import logging
+import numpy as np
 from urllib import parse
 from random import choice
 from uuid import uuid4
@@ -106,6 +110,18 @@ xas_component = ctc.XASPanelComponent(origin_component=search_component)
 pd_component = ctc.PhaseDiagramComponent()
 pd_component.attach_from(chemsys_search_component, this_store_name="chemsys-external")
 
+# pre-compute phase diagrams for the default and most frequently requested
+# chemical systems in the background, so that they load from the cache (every
+# worker process starts a warmer, but only one of them runs at a time)
+if not DEBUG_MODE:
+    pd_component.start_cache_warmer(
+        chemsys_list=os.environ.get(
+            "PD_PREWARM_CHEMSYS", ",".join(DEFAULT_CHEMSYS)
+        ).split(","),
+        num_popular=int(os.environ.get("PD_PREWARM_NUM_POPULAR", 10)),
+        interval=int(os.environ.get("PD_PREWARM_INTERVAL", 60 * 60 * 24)),
+    )
+
 panels = [
     xrd_component,
     xas_component,
@@ -361,5 +377,89 @@ def update_structure(search_mpid):
 
 # endregion
 
+################################################################################
+# region SET UP API ROUTES
+################################################################################
+
+
+def _to_json_number(value):
+    return None if value is None or np.isnan(value) else float(value)
+
+
+@server.route("/genesis/api/stability", methods=["POST"])
+def stability_analysis():
+    """
+    Batch stability analysis of many compositions in one chemical system,
+    for scripted clients. Expects a JSON body such as:
+
+        {"chemsys": "Y-Mn-O", "compositions": ["YMnO3", "Y2Mn2O7"],
+         "energies_per_atom": [-7.9, -7.8]}
+
+    where energies_per_atom (on the Materials Project energy scale) is
+    optional. Returns a list with the decomposition products, hull energy,
+    energy above hull and chemical potential range (relative to the elemental
+    references) of each composition.
+    """
+
+    body = request.get_json(silent=True) or {}
+
+    try:
+        chemsys = body["chemsys"]
+        compositions = [Composition(formula) for formula in body["compositions"]]
+        energies_per_atom = body.get("energies_per_atom")
+        if energies_per_atom is not None and len(energies_per_atom) != len(
+            compositions
+        ):
+            raise ValueError("Expected one energy per composition.")
+    except Exception as exception:
+        return jsonify({"error": f"Invalid request: {exception}"}), 400
+
+    try:
+        ctc.PhaseDiagramComponent.record_chemsys_request(chemsys)
+        pd = ctc.PhaseDiagramComponent.get_phase_diagram(chemsys)
+        results = batch_stability_analysis(pd, compositions, energies_per_atom)
+    except Exception as exception:
+        logger.error(f"Stability analysis failed for {chemsys}: {exception}")
+        return jsonify({"error": str(exception)}), 500
+
+    elements = [str(el) for el in pd.elements]
+    e_above_hull = results["e_above_hull"]
+
+    response = []
+    for idx, composition in enumerate(compositions):
+        decomposition = results["decompositions"][idx]
+        response.append(
+            {
+                "composition": composition.reduced_formula,
+                "decomposition": None
+                if decomposition is None
+                else [
+                    {
+                        "formula": entry.composition.reduced_formula,
+                        "entry_id": getattr(entry, "entry_id", None),
+                        "amount": amount,
+                    }
+                    for entry, amount in decomposition.items()
+                ],
+                "hull_energy_per_atom": _to_json_number(
+                    results["hull_energies"][idx]
+                ),
+                "e_above_hull": None
+                if e_above_hull is None
+                else _to_json_number(e_above_hull[idx]),
+                "chempot_ranges": {
+                    el: [_to_json_number(value) for value in chempot_range]
+                    for el, chempot_range in zip(
+                        elements, results["chempot_ranges"][idx]
+                    )
+                },
+            }
+        )
+
+    return jsonify({"chemsys": "-".join(elements), "results": response})
+
+
+# endregion
+
 if __name__ == "__main__":
     app.run_server(debug=DEBUG_MODE, port=8060)
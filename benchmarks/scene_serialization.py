@@ -0,0 +1,100 @@
+"""
+Benchmark Scene.to_json() and Scene.to_packed_json() on scenes of 1k, 10k and
+100k primitives, against the previous implementation of to_json() which
+deep-copied the scene with dataclasses.asdict before removing None values.
+
+Run from the repository root:
+
+    python benchmarks/scene_serialization.py
+"""
+
+import json
+import random
+from dataclasses import asdict
+from timeit import repeat
+
+from crystal_toolkit.helpers.scene import Cylinders, Scene, Spheres
+
+SIZES = (1000, 10000, 100000)
+
+
+def build_scene(num_primitives, num_sub_scenes=20, num_colors=20, seed=0):
+    """
+    Build a Scene resembling a structure: sub-scenes of alternating atoms and
+    bonds, drawn from a small palette of colors.
+    """
+    random.seed(seed)
+    colors = ["#%06x" % random.randrange(1 << 24) for _ in range(num_colors)]
+    per_sub_scene = num_primitives // num_sub_scenes
+    sub_scenes = []
+    for idx in range(num_sub_scenes):
+        primitives = []
+        for _ in range(per_sub_scene // 2):
+            position = [random.random() for _ in range(3)]
+            primitives.append(
+                Spheres(
+                    positions=[position], color=random.choice(colors), radius=0.5
+                )
+            )
+            primitives.append(
+                Cylinders(
+                    positionPairs=[[position, [0, 0, 0]]],
+                    color=random.choice(colors),
+                    radius=0.1,
+                )
+            )
+        sub_scenes.append(Scene(name=f"site{idx}", contents=primitives))
+    return Scene(name="root", contents=sub_scenes)
+
+
+def legacy_to_json(scene):
+    """
+    The previous implementation of Scene.to_json(), for comparison.
+    """
+
+    merged_scene = Scene(
+        name=scene.name, contents=scene.merge_primitives(scene.contents)
+    )
+
+    def remove_defaults(scene_dict):
+        trimmed_dict = {}
+        for k, v in scene_dict.items():
+            if isinstance(v, dict):
+                v = remove_defaults(v)
+            elif isinstance(v, list):
+                trimmed_dict[k] = [
+                    remove_defaults(item) if isinstance(item, dict) else item
+                    for item in v
+                ]
+            elif v is not None:
+                trimmed_dict[k] = v
+        return trimmed_dict
+
+    return remove_defaults(asdict(merged_scene))
+
+
+def best_of(func, number):
+    return min(repeat(func, number=1, repeat=number))
+
+
+def main():
+    print(f"{'primitives':>10} {'legacy':>10} {'to_json':>10} {'packed':>10}")
+    for size in SIZES:
+        scene = build_scene(size)
+        number = 3 if size >= 100000 else 5
+
+        assert json.dumps(legacy_to_json(scene), sort_keys=True) == json.dumps(
+            scene.to_json(), sort_keys=True
+        ), f"to_json() output differs from legacy output for {size} primitives"
+
+        legacy = best_of(lambda: legacy_to_json(scene), number)
+        current = best_of(scene.to_json, number)
+        packed = best_of(scene.to_packed_json, number)
+        print(
+            f"{size:>10} {legacy * 1e3:>8.1f}ms {current * 1e3:>8.1f}ms "
+            f"{packed * 1e3:>8.1f}ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
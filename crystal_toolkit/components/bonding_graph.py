@@ -9,6 +9,7 @@ from crystal_toolkit import GraphComponent
 from crystal_toolkit.components.core import MPComponent, PanelComponent
 from crystal_toolkit.helpers.layouts import *
 from crystal_toolkit.components.structure import StructureMoleculeComponent
+from crystal_toolkit.helpers.neighbors import NeighborList
 
 from pymatgen.core.structure import Structure, Molecule
 from pymatgen.analysis.graphs import StructureGraph, MoleculeGraph
@@ -57,28 +58,32 @@ class BondingGraphComponent(PanelComponent):
             color_scale=color_scale,
         )
 
+        # coordination numbers and bond lengths are shared with the
+        # structure viewer
+        neighbor_list = NeighborList.from_graph(graph)
+        coordination = neighbor_list.coordination.tolist()
+
         for idx, node in enumerate(graph.graph.nodes()):
 
             nodes.append(
                 {
                     "id": node,
                     "title": f"{struct_or_mol[node].species_string} site "
-                    f"({graph.get_coordination_of_site(idx)} neighbors)",
+                    f"({coordination[idx]} neighbors)",
                     "color": colors[node][0],
                 }
             )
 
-        for u, v, d in graph.graph.edges(data=True):
+        for u, v, to_jimage, dist in zip(
+            neighbor_list.edge_from.tolist(),
+            neighbor_list.edge_to.tolist(),
+            map(tuple, neighbor_list.edge_jimages.tolist()),
+            neighbor_list.bond_lengths.tolist(),
+        ):
 
             edge = {"from": u, "to": v, "arrows": ""}
 
-            to_jimage = d.get("to_jimage", (0, 0, 0))
-
             # TODO: check these edge weights
-            if isinstance(struct_or_mol, Structure):
-                dist = struct_or_mol.get_distance(u, v, jimage=to_jimage)
-            else:
-                dist = struct_or_mol.get_distance(u, v)
             edge["length"] = 50 * dist
 
             if to_jimage != (0, 0, 0):
@@ -26,27 +26,101 @@ import latexcodec
 
 import os
 
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+
 CROSSREF_MAILTO = os.environ.get("CROSSREF_MAILTO", None)
 
 class LiteratureComponent(PanelComponent):
+
+    # Crossref results rarely change, so are cached for a long time
+    crossref_cache_timeout = 60 * 60 * 24 * 30
+    # maximum number of concurrent requests to Crossref
+    max_crossref_workers = 8
+    # maximum number of concurrent requests to the Materials Project
+    max_mprester_workers = 4
+
+    # Literature is cached in layers: matching mpids by structure and
+    # references by mpid (from MP), Crossref items by normalized reference
+    # text and citations by DOI. Formatting is cheap given these, and is not
+    # cached separately so that a failed Crossref lookup is retried next
+    # time. For each layer, the number of lookups and of cache misses (i.e.
+    # external requests) are counted since the process started.
+    cache_stats = Counter()
+    _cache_stats_lock = Lock()
+
     def __init__(self, *args, use_crossref=True, use_crossref_formatting=True, **kwargs):
         self.use_crossref = use_crossref
         self.use_crossref_formatting = use_crossref_formatting
         super().__init__(*args, **kwargs)
 
+        # the body of each memoized function only runs on a cache miss
+
+        @MPComponent.cache.memoize(timeout=self.mprester_cache_timeout)
+        def find_structure(struct):
+            self._record_cache_stat("mpids", "misses")
+            struct = self.from_data(struct)
+            with MPRester() as mpr:
+                mpids = mpr.find_structure(struct)
+            return mpids
+        self.find_structure = self._count_lookups("mpids", find_structure)
+
         @MPComponent.cache.memoize(timeout=self.mprester_cache_timeout)
         def get_materials_id_references(mpid):
+            self._record_cache_stat("references", "misses")
             with MPRester() as mpr:
                 references = mpr.get_materials_id_references(mpid)
             return references
-        self.get_materials_id_references = get_materials_id_references
+        self.get_materials_id_references = self._count_lookups(
+            "references", get_materials_id_references
+        )
+
+        @MPComponent.cache.memoize(timeout=self.crossref_cache_timeout)
+        def get_crossref_item(reference):
+            self._record_cache_stat("crossref_items", "misses")
+            works = Crossref(mailto=CROSSREF_MAILTO).works(query=reference, limit=1)
+            items = works["message"]["items"]
+            return items[0] if items else None
+        self.get_crossref_item = self._count_lookups("crossref_items", get_crossref_item)
+
+        @MPComponent.cache.memoize(timeout=self.crossref_cache_timeout)
+        def get_crossref_citation(doi, format="text"):
+            self._record_cache_stat("citations", "misses")
+            if format == "text":
+                return content_negotiation(ids=doi, format=format, style="science")
+            return content_negotiation(ids=doi, format=format)
+        self.get_crossref_citation = self._count_lookups(
+            "citations", get_crossref_citation
+        )
+
+    @classmethod
+    def _record_cache_stat(cls, layer, kind):
+        with cls._cache_stats_lock:
+            cls.cache_stats[f"{layer}_{kind}"] += 1
+
+    def _count_lookups(self, layer, func):
+        def counted(*args, **kwargs):
+            self._record_cache_stat(layer, "lookups")
+            return func(*args, **kwargs)
+        return counted
+
+    def _log_cache_stats(self):
+        stats = []
+        for layer in ("mpids", "references", "crossref_items", "citations"):
+            lookups = self.cache_stats[f"{layer}_lookups"]
+            if lookups:
+                hits = lookups - self.cache_stats[f"{layer}_misses"]
+                stats.append(f"{layer} {hits}/{lookups} ({hits / lookups:.0%})")
+        self.logger.info(f"Literature cache hits: {', '.join(stats)}.")
 
-        @MPComponent.cache.memoize(timeout=0)
-        def format_bibtex_references(references, use_crossref=True, custom_formatting=True):
-            self._format_bibtex_references(references, use_crossref=use_crossref,
-                                           custom_formatting=custom_formatting)
-        self.format_bibtex_references = format_bibtex_references
-        self.format_bibtex_references = format_bibtex_references
+    @staticmethod
+    def _normalize_reference(reference):
+        """
+        Normalize whitespace in a reference so that the same reference from
+        different materials has the same cache key.
+        """
+        return " ".join(reference.split())
 
     @property
     def title(self):
@@ -62,7 +136,34 @@ class LiteratureComponent(PanelComponent):
 
     @property
     def loading_text(self):
-        return "Looking up journal entries. This is not currently pre-cached so may take up to a minute"
+        return "Looking up journal entries. This may take a few seconds the first time a material is viewed"
+
+    def _map_crossref(self, func, args):
+        """
+        Call a Crossref lookup for every argument concurrently, with at most
+        max_crossref_workers requests at once. Failed lookups are logged and
+        return None, so that one bad reference does not prevent the others
+        from being shown (failures are not cached).
+
+        :param func: function making a single request
+        :param args: list of arguments for func
+        :return: list of results, in the same order as args
+        """
+
+        def call(arg):
+            try:
+                return func(arg)
+            except Exception:
+                self.logger.warning(f"Crossref lookup failed for {arg}.", exc_info=True)
+                return None
+
+        if not args:
+            return []
+
+        with ThreadPoolExecutor(
+            max_workers=min(self.max_crossref_workers, len(args))
+        ) as executor:
+            return list(executor.map(call, args))
 
     @staticmethod
     def _pybtex_entries_to_markdown(entries):
@@ -152,46 +253,26 @@ class LiteratureComponent(PanelComponent):
     def _get_references_for_mpid(self, use_crossref=True, custom_formatting=True):
         return ...
 
-    def update_contents(self, new_store_contents):
+    def format_bibtex_references(self, all_references, use_crossref=True, custom_formatting=True):
         """
-        Structure -> mpid -> BibTeX references from MP -> (optional doi lookup
-        via Crossref) -> formatting.
-        Formatting is very messy right now.
-        DOI lookup and (possibly) formatting should be cached in a builder.
+        :param all_references: BibTeX references for each matching mpid
+        :param use_crossref: if True, look up each reference with Crossref to
+        retrieve its DOI and citation count
+        :param custom_formatting: if True (and use_crossref), format
+        references from their BibTeX entries, otherwise use citations
+        formatted by Crossref
+        :return: tuple of the number of references and the formatted
+        references (a Dash component)
         """
 
-        struct = self.from_data(new_store_contents)
-
-        if not isinstance(struct, Structure):
-            raise PreventUpdate(
-                "Literature mentions can only be retrieved for crystallographic "
-                "structures at present and not molecules. Please make a feature "
-                "request if this would be useful for you, and it will be "
-                "prioritized."
-            )
+        if use_crossref:
 
-        with MPRester() as mpr:
-            mpids = mpr.find_structure(struct)
-
-            if len(mpids) == 0:
-                raise PreventUpdate(
-                    "No structures in the Materials Project database match this "
-                    "crystal structure, so literature mentions cannot be retrieved. "
-                    "Please submit this structure to Materials Project if you'd "
-                    "like it to be added to the Materials Project database."
-                )
-
-            all_references = []
-            for mpid in mpids:
-                all_references.append(mpr.get_materials_id_references(mpid))
-                self.logger.debug(f"Retrieved references for {mpid}.")
-
-        if self.use_crossref:
-
-            cr = Crossref(mailto=CROSSREF_MAILTO)
             individual_references = set()
             for references in all_references:
-                individual_references.update(set(references.split("\n\n")))
+                individual_references.update(
+                    self._normalize_reference(ref) for ref in references.split("\n\n")
+                )
+            individual_references.discard("")
 
             # exclude Materials Proect references (these are intended to be
             # references for the structure specifically)
@@ -201,14 +282,11 @@ class LiteratureComponent(PanelComponent):
                     refs_to_remove.add(ref)
             individual_references -= refs_to_remove
 
-            works = [cr.works(query=ref, limit=1) for ref in individual_references]
-            self.logger.debug(f"Retrieved {len(works)} works from Crossref.")
-
-            items = [
-                work["message"]["items"][0]
-                for work in works
-                if len(work["message"]["items"]) > 0
-            ]
+            items = self._map_crossref(
+                self.get_crossref_item, sorted(individual_references)
+            )
+            items = [item for item in items if item is not None]
+            self.logger.debug(f"Retrieved {len(items)} works from Crossref.")
 
             dois_to_item = {
                 item["DOI"]: {
@@ -232,15 +310,15 @@ class LiteratureComponent(PanelComponent):
                 key=lambda doi: -dois_to_item[doi]["cited-by"],
             )
 
-            if self.use_crossref_formatting:
+            if not custom_formatting:
                 # use Crossref to retrieve pre-formatted text
 
                 # remove leading "1. " from Science CSL style
+                citations = self._map_crossref(self.get_crossref_citation, sorted_dois)
                 refs = {
-                    doi: content_negotiation(ids=doi, format="text", style="science")[
-                        3:
-                    ]
-                    for doi in dois_to_item.keys()
+                    doi: citation[3:]
+                    for doi, citation in zip(sorted_dois, citations)
+                    if citation is not None
                 }
                 self.logger.debug(
                     f"Retrieved {len(refs)} formatted references from Crossref."
@@ -249,6 +327,7 @@ class LiteratureComponent(PanelComponent):
                     f"> [{refs[doi]}](https://dx.doi.org/{doi}) "
                     f"Cited by {dois_to_item[doi]['cited-by']}."
                     for doi in sorted_dois
+                    if doi in refs
                 )
                 formatted_references = dcc.Markdown(
                     md, className="mpc-markdown"
@@ -258,9 +337,14 @@ class LiteratureComponent(PanelComponent):
                 # else retrieve BibTeX entries to extract a nice author list
                 # and perform our own formatting
 
+                bibtex_entries = self._map_crossref(
+                    lambda doi: self.get_crossref_citation(doi, format="bibtex"),
+                    sorted_dois,
+                )
                 entries = {
-                    doi: content_negotiation(ids=doi, format="bibtex")
-                    for doi in sorted_dois
+                    doi: entry
+                    for doi, entry in zip(sorted_dois, bibtex_entries)
+                    if entry is not None
                 }
 
                 formatted_entries = []
@@ -314,6 +398,51 @@ class LiteratureComponent(PanelComponent):
             formatted_references = dcc.Markdown(md, className="mpc-markdown")
             num_refs = len(all_entries)
 
+        return num_refs, formatted_references
+
+    def update_contents(self, new_store_contents):
+        """
+        Structure -> mpid -> BibTeX references from MP -> (optional doi lookup
+        via Crossref) -> formatting.
+        Formatting is very messy right now.
+        DOI lookup and (possibly) formatting should be cached in a builder.
+        """
+
+        struct = self.from_data(new_store_contents)
+
+        if not isinstance(struct, Structure):
+            raise PreventUpdate(
+                "Literature mentions can only be retrieved for crystallographic "
+                "structures at present and not molecules. Please make a feature "
+                "request if this would be useful for you, and it will be "
+                "prioritized."
+            )
+
+        mpids = self.find_structure(new_store_contents)
+
+        if len(mpids) == 0:
+            raise PreventUpdate(
+                "No structures in the Materials Project database match this "
+                "crystal structure, so literature mentions cannot be retrieved. "
+                "Please submit this structure to Materials Project if you'd "
+                "like it to be added to the Materials Project database."
+            )
+
+        with ThreadPoolExecutor(
+            max_workers=min(self.max_mprester_workers, len(mpids))
+        ) as executor:
+            all_references = list(
+                executor.map(self.get_materials_id_references, mpids)
+            )
+        self.logger.debug(f"Retrieved references for {', '.join(mpids)}.")
+
+        num_refs, formatted_references = self.format_bibtex_references(
+            all_references,
+            use_crossref=self.use_crossref,
+            custom_formatting=not self.use_crossref_formatting,
+        )
+        self._log_cache_stats()
+
         return html.Div(
             [
                 Label(f"{num_refs} references found{':' if num_refs>0 else '.'}"),
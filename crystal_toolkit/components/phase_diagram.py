@@ -1,7 +1,19 @@
+import os
+import re
+
+from collections import namedtuple
+from functools import lru_cache
+from hashlib import md5
+from itertools import combinations
+from json import loads
+from threading import Thread
+from time import sleep
+
 import dash
 import dash_core_components as dcc
 import dash_html_components as html
 import dash_table
+import numpy as np
 import plotly.graph_objs as go
 from dash.dependencies import Input, Output, State
 from dash.exceptions import PreventUpdate
@@ -12,6 +24,36 @@ from pymatgen.analysis.phase_diagram import PhaseDiagram, PDPlotter, PDEntry
 
 from crystal_toolkit.helpers.layouts import *  # layout helpers like `Columns` etc. (most subclass html.Div)
 from crystal_toolkit.components.core import MPComponent, PanelComponent
+from crystal_toolkit.helpers.utils import LRUCache
+from crystal_toolkit.helpers.stability import (
+    get_fractions,
+    get_stability_data,
+    update_phase_diagram,
+)
+
+
+# stands in for PDPlotter when plotting a projection of a phase diagram, see
+# PhaseDiagramComponent.get_pseudo_ternary_plot_data
+ProjectedPlotter = namedtuple("ProjectedPlotter", ["pd_plot_data"])
+
+SUBSCRIPT_REGEX = re.compile(r"(\d+)")
+
+# formula -> HTML formula, shared between figures
+@lru_cache(maxsize=4096)
+def _get_formula_html(formula):
+    return SUBSCRIPT_REGEX.sub(r"<sub>\1</sub>", formula)
+
+
+def get_formula_html(formulas):
+    """
+    Format formulas for display in plots, e.g. Li2O becomes Li<sub>2</sub>O.
+    Each formula is only formatted once, and re-used by the hover text and
+    labels of every figure it appears in.
+
+    :param formulas: list of formula strings
+    :return: list of HTML formula strings
+    """
+    return [_get_formula_html(formula) for formula in formulas]
 
 
 class PhaseDiagramComponent(MPComponent):
@@ -24,6 +66,225 @@ class PhaseDiagramComponent(MPComponent):
         self.create_store("figure")
         self.create_store("entries")
 
+    # decoding a PhaseDiagram re-computes its convex hull, and the same phase
+    # diagram is decoded by several callbacks, so decoded phase diagrams are
+    # cached by a hash of their serialized data
+    _pd_cache = LRUCache(16)
+
+    @staticmethod
+    def _get_pd_revision(data):
+        return md5(data.encode("utf-8")).hexdigest()
+
+    @classmethod
+    def _add_pd_to_cache(cls, data, pd):
+        cls._pd_cache.set(cls._get_pd_revision(data), pd)
+
+    # phase diagrams of all Materials Project entries, by chemical system
+    _chemsys_pd_cache = LRUCache(16)
+
+    @staticmethod
+    def _get_chemsys_key(chemsys):
+        """
+        :param chemsys: chemical system as a list of elements, or a string
+        such as "Y-Mn-O"
+        :return: normalized chemical system string, e.g. "Mn-O-Y"
+        """
+        if isinstance(chemsys, str):
+            chemsys = chemsys.split("-")
+        return "-".join(sorted(str(el) for el in chemsys))
+
+    @classmethod
+    def _add_chemsys_pd_to_cache(cls, key, pd):
+        cls._chemsys_pd_cache.set(key, pd)
+
+    @classmethod
+    def get_phase_diagram(cls, chemsys):
+        """
+        Retrieve the phase diagram of a chemical system, only querying the
+        Materials Project and constructing the phase diagram if it is not
+        cached already.
+
+        :param chemsys: chemical system as a list of elements, or a string
+        such as "Y-Mn-O"
+        :return: PhaseDiagram
+        """
+        key = cls._get_chemsys_key(chemsys)
+
+        def get_pd():
+            # entries of popular systems are fetched in advance, see warm_cache
+            entries = cls._get_from_warm_cache("entries", key)
+            if entries is None:
+                with MPRester() as mpr:
+                    entries = mpr.get_entries_in_chemsys(key.split("-"))
+            else:
+                entries = cls.from_data(entries)
+            return PhaseDiagram(entries)
+
+        return cls._chemsys_pd_cache.get_or_compute(key, get_pd)
+
+    # Results for popular chemical systems are pre-computed in the background
+    # and stored in the app cache (shared between worker processes), keyed by
+    # chemical system or by a hash of the callback input they were computed
+    # from. The number of requests for each chemical system is also recorded
+    # in the app cache to decide which systems to pre-compute: every count is
+    # a separate key, incremented atomically (for backends that support it,
+    # e.g. Redis), and the set of requested systems is kept under
+    # chemsys_counts_key.
+    warm_cache_timeout = 60 * 60 * 24 * 7
+    chemsys_counts_key = "PhaseDiagramComponent_chemsys_counts"
+    # only one worker process pre-computes results per interval, whichever
+    # takes this key first
+    warm_cache_lock_key = "PhaseDiagramComponent_warm_cache_lock"
+
+    @classmethod
+    def _get_from_warm_cache(cls, kind, key):
+        # DummyCache (no cache configured) only supports memoize
+        if not hasattr(cls.cache, "get"):
+            return None
+        return cls.cache.get(f"PhaseDiagramComponent_{kind}_{key}")
+
+    @classmethod
+    def _add_to_warm_cache(cls, kind, key, value):
+        if hasattr(cls.cache, "set"):
+            cls.cache.set(
+                f"PhaseDiagramComponent_{kind}_{key}",
+                value,
+                timeout=cls.warm_cache_timeout,
+            )
+
+    @classmethod
+    def _get_chemsys_count_key(cls, key):
+        return f"{cls.chemsys_counts_key}_{key}"
+
+    @classmethod
+    def record_chemsys_request(cls, chemsys):
+        """
+        Count a request for the phase diagram of a chemical system.
+
+        :param chemsys: chemical system as a list of elements, or a string
+        """
+        if not hasattr(cls.cache, "get"):
+            return
+        key = cls._get_chemsys_key(chemsys)
+        # Flask-Caching does not proxy inc() to the cache backend in all
+        # versions
+        backend = cls.cache if hasattr(cls.cache, "inc") else cls.cache.cache
+        backend.inc(cls._get_chemsys_count_key(key))
+        # concurrent updates of the set of systems can drop a new system, but
+        # it is added back by its next request, and no counts are lost
+        requested = cls.cache.get(cls.chemsys_counts_key) or []
+        if key not in requested:
+            cls.cache.set(cls.chemsys_counts_key, requested + [key], timeout=0)
+
+    @classmethod
+    def get_popular_chemsys(cls, num_chemsys=10):
+        """
+        :param num_chemsys: maximum number of chemical systems to return
+        :return: the most frequently requested chemical systems, most popular
+        first
+        """
+        if not hasattr(cls.cache, "get"):
+            return []
+        requested = cls.cache.get(cls.chemsys_counts_key) or []
+        counts = {
+            key: cls.cache.get(cls._get_chemsys_count_key(key)) or 0
+            for key in requested
+        }
+        return sorted(counts, key=counts.get, reverse=True)[:num_chemsys]
+
+    def warm_cache(self, chemsys):
+        """
+        Pre-compute everything needed to display the phase diagram of a
+        chemical system, as the callbacks would compute it when the system is
+        searched for: the Materials Project entries, the entry table, the
+        phase diagram of the table entries and its figure. Entries are always
+        re-fetched, so this also refreshes stale results.
+
+        :param chemsys: chemical system as a list of elements, or a string
+        """
+
+        key = self._get_chemsys_key(chemsys)
+
+        with MPRester() as mpr:
+            entries = mpr.get_entries_in_chemsys(key.split("-"))
+        pd = PhaseDiagram(entries)
+        self._add_chemsys_pd_to_cache(key, pd)
+        self._add_to_warm_cache("entries", key, self.to_data(entries))
+
+        rows = self.create_table_content(pd)
+        self._add_to_warm_cache("table", key, rows)
+
+        # the table is turned back into entries by update_entries_store
+        entries_data = self.to_data(self.get_entries_from_rows(rows))
+        table_pd = PhaseDiagram(self.from_data(entries_data))
+        pd_data = self.to_data(table_pd)
+        self._add_pd_to_cache(pd_data, table_pd)
+        self._add_to_warm_cache("pd", self._get_pd_revision(entries_data), pd_data)
+
+        figure = self.create_figure(table_pd).to_dict()
+        self._add_to_warm_cache("figure", self._get_pd_revision(pd_data), figure)
+
+    def start_cache_warmer(self, chemsys_list=(), num_popular=10, interval=60 * 60 * 24):
+        """
+        Start a background thread that pre-computes phase diagrams (see
+        warm_cache) immediately and then every interval seconds. This can be
+        called in every worker process of the app: the app cache is used as a
+        lock so that only one of them pre-computes results per interval.
+
+        :param chemsys_list: chemical systems to always pre-compute
+        :param num_popular: number of the most frequently requested chemical
+        systems to pre-compute in addition
+        :param interval: time between refreshes in seconds
+        :return: the Thread, or None if no app cache is configured
+        """
+
+        if not hasattr(self.cache, "set"):
+            self.logger.warning(
+                "No cache is configured, phase diagrams will not be pre-computed."
+            )
+            return None
+
+        def warm_periodically():
+            while True:
+                if not self.cache.add(
+                    self.warm_cache_lock_key, os.getpid(), timeout=interval
+                ):
+                    # another worker process is pre-computing results
+                    sleep(interval)
+                    continue
+                chemsys_keys = [self._get_chemsys_key(c) for c in chemsys_list]
+                chemsys_keys += self.get_popular_chemsys(num_popular)
+                for key in dict.fromkeys(chemsys_keys):
+                    try:
+                        self.warm_cache(key)
+                        self.logger.info(f"Pre-computed phase diagram for {key}.")
+                    except Exception:
+                        self.logger.warning(
+                            f"Could not pre-compute phase diagram for {key}.",
+                            exc_info=True,
+                        )
+                sleep(interval)
+
+        thread = Thread(
+            target=warm_periodically, name="PhaseDiagramCacheWarmer", daemon=True
+        )
+        thread.start()
+
+        return thread
+
+    @classmethod
+    def pd_from_data(cls, data):
+        """
+        Equivalent to from_data for a PhaseDiagram, but only decodes the
+        phase diagram if it is not cached already.
+
+        :param data: contents of a dcc.Store created by to_data
+        :return: PhaseDiagram
+        """
+        return cls._pd_cache.get_or_compute(
+            cls._get_pd_revision(data), lambda: cls.from_data(data)
+        )
+
     # Default plot layouts for Binary (2), Ternary (3), Quaternary (4) phase diagrams
     default_binary_plot_style = dict(
         xaxis={
@@ -149,250 +410,446 @@ class PhaseDiagramComponent(MPComponent):
                  "Predicted Stable": None
                  }
 
-    def figure_layout(self, plotter, pd):
+    # Templates for the labels of stable entries, the position and text are
+    # added per entry
+    default_binary_annotation_style = {
+        "align": "center",
+        "font": {"color": "#000000", "size": 20.0},
+        "opacity": 1,
+        "showarrow": False,
+        "xanchor": "right",
+        "yanchor": "auto",
+        "xref": "x",
+        "yref": "y",
+    }
 
-        dim = pd.dim
+    default_ternary_annotation_style = {
+        "align": "center",
+        "font": {"color": "#000000", "size": 18.0},
+        "opacity": 1,
+        "showarrow": False,
+        "xanchor": "right",
+        "yanchor": "top",
+        "xref": "x",
+        "yref": "y",
+    }
 
-        if dim == 2:
-            annotations_list = []
+    default_quaternary_annotation_style = {
+        "align": "center",
+        "font": {"color": "#000000", "size": 18.0},
+        "opacity": 1,
+        "showarrow": False,
+        "xshift": 25,
+        "yshift": 10,
+    }
 
-            for entry in plotter.pd_plot_data[1]:
-                x, y = entry[0], entry[1]
+    default_quaternary_axis_style = dict(
+        title=None,
+        visible=False,
+        autorange=True,
+        showgrid=False,
+        zeroline=False,
+        showline=False,
+        ticks="",
+        showaxeslabels=False,
+        showticklabels=False,
+        showspikes=False,
+    )
 
-                formula = list(
-                    plotter.pd_plot_data[1][entry].composition.reduced_formula
-                )
-                text = []
-                for char in formula:
-                    if char.isdigit():
-                        text.append("<sub>" + char + "</sub>")
-                    else:
-                        text.append(char)
-                clean_formula = ""
-                clean_formula = clean_formula.join(text)
-
-                new_annotation = {
-                    "align": "center",
-                    "font": {"color": "#000000", "size": 20.0},
-                    "opacity": 1,
-                    "showarrow": False,
-                    "text": clean_formula + "  ",
-                    "x": x,
-                    "xanchor": "right",
-                    "yanchor": "auto",
-                    "xref": "x",
-                    "y": y,
-                    "yref": "y",
-                }
+    default_quaternary_scene_style = dict(
+        xaxis=default_quaternary_axis_style,
+        yaxis=default_quaternary_axis_style,
+        zaxis=default_quaternary_axis_style,
+    )
 
-                annotations_list.append(new_annotation)
+    def figure_layout(self, plotter, pd, dim=None):
+        """
+        Build the layout for a phase diagram figure. The class-level default
+        styles are treated as read-only templates: a new layout dict is
+        composed for every figure, sharing the nested template dicts, so that
+        figures can be generated concurrently.
 
-                layout = self.default_binary_plot_style
-                layout["annotations"] = annotations_list
-            return layout
+        :param plotter: PDPlotter
+        :param pd: PhaseDiagram
+        :param dim: dimension of the plot, defaults to pd.dim
+        :return: layout dict
+        """
 
-        elif dim == 3:
-            annotations_list = []
+        dim = dim or pd.dim
 
-            for entry in plotter.pd_plot_data[1]:
-                x, y = entry[0], entry[1]
+        stable_plot_data = plotter.pd_plot_data[1]
+        formulas = get_formula_html(
+            [entry.composition.reduced_formula for entry in stable_plot_data.values()]
+        )
 
-                formula = list(
-                    plotter.pd_plot_data[1][entry].composition.reduced_formula
-                )
-                text = []
-                for char in formula:
-                    if char.isdigit():
-                        text.append("<sub>" + char + "</sub>")
-                    else:
-                        text.append(char)
-                clean_formula = ""
-                clean_formula = clean_formula.join(text)
-
-                new_annotation = {
-                    "align": "center",
-                    "font": {"color": "#000000", "size": 18.0},
-                    "opacity": 1,
-                    "showarrow": False,
-                    "text": clean_formula + "  ",
-                    "x": x,
-                    "xanchor": "right",
-                    "yanchor": "top",
-                    "xref": "x",
-                    "y": y,
-                    "yref": "y",
+        if dim == 2:
+            annotations = [
+                {
+                    **self.default_binary_annotation_style,
+                    "text": formula + "  ",
+                    "x": coords[0],
+                    "y": coords[1],
                 }
+                for coords, formula in zip(stable_plot_data.keys(), formulas)
+            ]
+            return {**self.default_binary_plot_style, "annotations": annotations}
 
-                annotations_list.append(new_annotation)
-
-                layout = self.default_ternary_plot_style
-                layout["annotations"] = annotations_list
-            return layout
+        elif dim == 3:
+            annotations = [
+                {
+                    **self.default_ternary_annotation_style,
+                    "text": formula + "  ",
+                    "x": coords[0],
+                    "y": coords[1],
+                }
+                for coords, formula in zip(stable_plot_data.keys(), formulas)
+            ]
+            return {**self.default_ternary_plot_style, "annotations": annotations}
 
         elif dim == 4:
-            annotations_list = []
-
-            for entry in plotter.pd_plot_data[1]:
-                x, y, z = entry[0], entry[1], entry[2]
-
-                formula = list(
-                    plotter.pd_plot_data[1][entry].composition.reduced_formula
-                )
-                text = []
-                for char in formula:
-                    if char.isdigit():
-                        text.append("<sub>" + char + "</sub>")
-                    else:
-                        text.append(char)
-                clean_formula = ""
-                clean_formula = clean_formula.join(text)
-
-                new_annotation = {
-                    "align": "center",
-                    "font": {"color": "#000000", "size": 18.0},
-                    "opacity": 1,
-                    "showarrow": False,
-                    "text": clean_formula,
-                    "x": x,
-                    "y": y,
-                    "z": z,
-                    "xshift": 25,
-                    "yshift": 10,
+            annotations = [
+                {
+                    **self.default_quaternary_annotation_style,
+                    "text": formula,
+                    "x": coords[0],
+                    "y": coords[1],
+                    "z": coords[2],
                 }
-
-                annotations_list.append(new_annotation)
-
-                layout = self.default_quaternary_plot_style
-                layout["scene"] = dict(
-                    annotations=annotations_list,
-                    xaxis=dict(
-                        title=None,
-                        visible=False,
-                        autorange=True,
-                        showgrid=False,
-                        zeroline=False,
-                        showline=False,
-                        ticks="",
-                        showaxeslabels=False,
-                        showticklabels=False,
-                        showspikes=False,
-                    ),
-                    yaxis=dict(
-                        title=None,
-                        visible=False,
-                        autorange=True,
-                        showgrid=False,
-                        zeroline=False,
-                        showline=False,
-                        showaxeslabels=False,
-                        ticks="",
-                        showticklabels=False,
-                        showspikes=False,
-                    ),
-                    zaxis=dict(
-                        title=None,
-                        visible=False,
-                        autorange=True,
-                        showgrid=False,
-                        zeroline=False,
-                        showline=False,
-                        showaxeslabels=False,
-                        ticks="",
-                        showticklabels=False,
-                        showspikes=False,
-                    ),
-                )
-            return layout
+                for coords, formula in zip(stable_plot_data.keys(), formulas)
+            ]
+            return {
+                **self.default_quaternary_plot_style,
+                "scene": {
+                    **self.default_quaternary_scene_style,
+                    "annotations": annotations,
+                },
+            }
 
         else:
             raise ValueError("Dimension of phase diagram must be 2, 3, or 4")
 
-    def create_markers(self, plotter, pd):
-        x_list = []
-        y_list = []
-        z_list = []
-        text = []
-        dim = pd.dim
+    @staticmethod
+    def get_marker_data(plotter, pd, dim=None):
+        """
+        Hover text for the stable and unstable entries of a phase diagram,
+        grouped by position in the plot, from a single pass over the plot data.
+        Unstable entries that share a position are listed in one hover label.
+
+        :param plotter: PDPlotter
+        :param pd: PhaseDiagram
+        :param dim: dimension of the plot, defaults to pd.dim
+        :return: tuple of dicts for stable and unstable entries, each of
+        {coordinates: list of hover text lines}, in plotting order
+        """
+
+        dim = dim or pd.dim
+        stable_plot_data, unstable_plot_data = plotter.pd_plot_data[1:]
+        num_stable = len(stable_plot_data)
+
+        entries = list(stable_plot_data.values()) + list(unstable_plot_data.keys())
+        coords = list(stable_plot_data.keys()) + list(unstable_plot_data.values())
+
+        energies, e_above_hulls = get_stability_data(pd, entries)
+        energies = np.round(energies, 3).tolist()
+        e_above_hulls = np.round(e_above_hulls, 3).tolist()
+        formulas = get_formula_html(
+            [entry.composition.reduced_formula for entry in entries]
+        )
 
-        for entry in plotter.pd_plot_data[1]:
-            energy = round(
-                pd.get_form_energy_per_atom(plotter.pd_plot_data[1][entry]), 3
-            )
-            mpid = "" #plotter.pd_plot_data[1][entry].attribute
-            formula = plotter.pd_plot_data[1][entry].composition.reduced_formula
-            s = []
-            for char in formula:
-                if char.isdigit():
-                    s.append("<sub>" + char + "</sub>")
-                else:
-                    s.append(char)
-            clean_formula = "".join(s)
-
-            x_list.append(entry[0])
-            y_list.append(entry[1])
-            if dim == 4:
-                z_list.append(entry[2])
-            text.append(
-                clean_formula + " (" + mpid + ")" + "<br>" + str(energy) + " eV"
-            )
+        stable_markers = {}
+        unstable_markers = {}
+
+        for idx, (entry, coord, formula, energy, e_above_hull) in enumerate(
+            zip(entries, coords, formulas, energies, e_above_hulls)
+        ):
+            coord = tuple(coord)
+
+            if idx < num_stable:
+                mpid = ""
+                stable_markers[coord] = [f"{formula} ({mpid})<br>{energy} eV"]
+                continue
+
+            hover_text = unstable_markers.get(coord)
+            if hover_text is None:
+                mpid = entry.attribute if dim == 2 else ""
+                unstable_markers[coord] = [
+                    f"{formula} ({mpid})<br>{energy} eV ({e_above_hull} eV)"
+                ]
+            else:
+                hover_text.append(f"{formula}<br>{energy} eV ({e_above_hull} eV)")
+
+        return stable_markers, unstable_markers
+
+    @staticmethod
+    def _get_marker_trace(markers, dim, **kwargs):
+        """
+        :param markers: dict of {coordinates: list of hover text lines}
+        :param dim: dimension of the phase diagram
+        :param kwargs: passed to go.Scatter or go.Scatter3d
+        :return: a single trace with a marker at every position
+        """
+
+        coords = list(zip(*markers.keys())) or [(), (), ()]
+        hovertext = ["<br>".join(hover_text) for hover_text in markers.values()]
 
-        if dim == 2 or dim == 3:
-            marker_plot = go.Scatter(
-                x=x_list,
-                y=y_list,
+        if dim == 4:
+            return go.Scatter3d(
+                x=coords[0],
+                y=coords[1],
+                z=coords[2],
                 mode="markers",
-                name="Stable",
-                marker=dict(color="#0562AB", size=11),
                 hoverinfo="text",
-                hoverlabel=dict(font=dict(size=14)),
-                showlegend=True,
-                hovertext=text,
+                hovertext=hovertext,
+                **kwargs,
             )
+
+        return go.Scatter(
+            x=coords[0],
+            y=coords[1],
+            mode="markers",
+            hoverinfo="text",
+            hovertext=hovertext,
+            **kwargs,
+        )
+
+    def create_markers(self, plotter, pd, dim=None):
+        """
+        :param plotter: PDPlotter
+        :param pd: PhaseDiagram
+        :param dim: dimension of the plot, defaults to pd.dim
+        :return: list of the unstable and stable marker traces
+        """
+
+        dim = dim or pd.dim
+        stable_markers, unstable_markers = self.get_marker_data(plotter, pd, dim=dim)
+
+        unstable_plot = self._get_marker_trace(
+            unstable_markers,
+            dim,
+            visible="legendonly",
+            name="Unstable",
+            marker=dict(color="#ff0000", size=4 if dim == 4 else 12, symbol="x"),
+        )
+
         if dim == 4:
-            marker_plot = go.Scatter3d(
-                x=x_list,
-                y=y_list,
-                z=z_list,
-                mode="markers",
+            marker_plot = self._get_marker_trace(
+                stable_markers,
+                dim,
                 name="Stable",
                 marker=dict(color="#0562AB", size=8),
-                hoverinfo="text",
                 hoverlabel=dict(font=dict(size=14)),
-                hovertext=text,
             )
-        return marker_plot
+        else:
+            marker_plot = self._get_marker_trace(
+                stable_markers,
+                dim,
+                name="Stable",
+                marker=dict(color="#0562AB", size=11),
+                hoverlabel=dict(font=dict(size=14)),
+                showlegend=True,
+            )
+
+        return [unstable_plot, marker_plot]
+
+    default_line_style = {
+        "color": "rgba (0, 0, 0, 1)",
+        "dash": "solid",
+        "width": 3.0,
+    }
+
+    @classmethod
+    def _get_line_trace(cls, lines, dim):
+        """
+        :param lines: line segments in the same format as
+        PDPlotter.pd_plot_data[0], i.e. a list of [x, y] or [x, y, z] where
+        each contains the co-ordinates of both ends of the line
+        :param dim: dimension of the phase diagram
+        :return: a single trace containing every line, separated by NaNs
+        """
+
+        num_coords = 3 if dim == 4 else 2
+        segments = np.array(lines, dtype=float).reshape(-1, num_coords, 2)
+        separators = np.full((len(segments), num_coords, 1), np.nan)
+        # (coordinate, start/end/separator of every line)
+        coords = (
+            np.concatenate([segments, separators], axis=2)
+            .transpose(1, 0, 2)
+            .reshape(num_coords, -1)
+        )
+
+        if dim == 4:
+            return go.Scatter3d(
+                x=coords[0],
+                y=coords[1],
+                z=coords[2],
+                mode="lines",
+                hoverinfo="none",
+                line=cls.default_line_style,
+                showlegend=False,
+            )
+
+        return go.Scatter(
+            x=coords[0],
+            y=coords[1],
+            mode="lines",
+            hoverinfo="none",
+            line=cls.default_line_style,
+            showlegend=False,
+        )
+
+    @staticmethod
+    def get_projection_elements(pd, elements=None):
+        """
+        :param pd: PhaseDiagram
+        :param elements: list of three element symbols, or None
+        :return: elements if they are three distinct elements of the phase
+        diagram, otherwise its first three elements
+        """
+        pd_elements = [str(el) for el in pd.elements]
+        if elements and len(set(elements)) == 3 and set(elements) <= set(pd_elements):
+            return [el for el in pd_elements if el in elements]
+        return pd_elements[:3]
+
+    @staticmethod
+    def get_pseudo_ternary_plot_data(pd, elements):
+        """
+        Plot data for the ternary section of a phase diagram with any number
+        of elements, between three of its elements, in the same format as
+        PDPlotter.pd_plot_data. The section is taken from the existing convex
+        hull rather than by constructing a new PhaseDiagram: its stable phases
+        are the stable phases containing only these elements, joined by the
+        edges of the hull facets between them.
+
+        :param pd: PhaseDiagram
+        :param elements: list of three element symbols (corners of the plot)
+        :return: tuple of lines, dict of {coordinates: stable entry} and dict
+        of {unstable entry: coordinates}
+        """
+
+        pd_elements = [str(el) for el in pd.elements]
+        corners = [pd_elements.index(str(el)) for el in elements]
+        others = [idx for idx in range(pd.dim) if idx not in corners]
+
+        def get_coords(fractions):
+            in_section = fractions[:, others].sum(axis=1) < PhaseDiagram.numerical_tol
+            # same projection as used by PDPlotter for ternary phase diagrams
+            b, c = fractions[:, corners[1]], fractions[:, corners[2]]
+            return in_section, b + c / 2, c * np.sqrt(3) / 2
+
+        qhull_entries = pd.qhull_entries
+        in_section, x, y = get_coords(
+            get_fractions(pd, [entry.composition for entry in qhull_entries])
+        )
+
+        facets = np.array(pd.facets, dtype=int).reshape(-1, pd.dim)
+        edges = facets[:, list(combinations(range(pd.dim), 2))].reshape(-1, 2)
+        edges = edges[in_section[edges].all(axis=1)]
+        edges = np.unique(np.sort(edges, axis=1), axis=0)
+
+        lines = [[x[edge], y[edge]] for edge in edges]
+        stable = {(x[idx], y[idx]): qhull_entries[idx] for idx in np.unique(edges)}
+
+        stable_entries = pd.stable_entries
+        all_in_section, all_x, all_y = get_coords(
+            get_fractions(pd, [entry.composition for entry in pd.all_entries])
+        )
+        unstable = {
+            entry: (all_x[idx], all_y[idx])
+            for idx, entry in enumerate(pd.all_entries)
+            if all_in_section[idx] and entry not in stable_entries
+        }
+
+        return lines, stable, unstable
+
+    def create_figure(self, pd, projection_elements=None):
+        """
+        :param pd: PhaseDiagram
+        :param projection_elements: for phase diagrams of five or more
+        elements, the three elements of the pseudo-ternary section to plot,
+        see get_projection_elements
+        :return: plotly Figure of the phase diagram
+        """
+
+        dim = pd.dim
+
+        if dim < 2:
+            raise ValueError(
+                "Structure contains {} components."
+                " Phase diagrams can only be created with 2 or more components".format(
+                    str(dim)
+                )
+            )
+
+        if dim >= 5:
+            elements = self.get_projection_elements(pd, projection_elements)
+            plotter = ProjectedPlotter(
+                self.get_pseudo_ternary_plot_data(pd, elements)
+            )
+            plot_dim = 3
+        else:
+            plotter = PDPlotter(pd)  # create plotter object using pymatgen
+            plot_dim = dim
+
+        # all hull edges in a single trace, then unstable and stable markers
+        data = [self._get_line_trace(plotter.pd_plot_data[0], plot_dim)]
+        data += self.create_markers(plotter, pd, dim=plot_dim)
+        fig = go.Figure(data=data)
+        fig.layout = self.figure_layout(plotter, pd, dim=plot_dim)
+        return fig
 
     @staticmethod
     def create_table_content(pd):
 
         data = []
 
-        for entry in pd.all_entries:
+        # formation energies and energies above hull for all entries at once
+        formation_energies, e_above_hulls = get_stability_data(pd)
+
+        for entry, formation_energy, e_above_hull in zip(
+            pd.all_entries, formation_energies.tolist(), e_above_hulls.tolist()
+        ):
             try:
                 mpid = entry.entry_id
             except:
                 mpid = entry.attribute
 
-            try:
-                data.append({
-                    "Material ID": mpid,
-                    "Formula": entry.name,
-                    "Formation Energy (eV/atom)": round(
-                        pd.get_form_energy_per_atom(entry), 3
-                    ),
-                    "Energy Above Hull (eV/atom)": round(
-                        pd.get_e_above_hull(entry), 3
-                    ),
-                    "Predicted Stable?": (
-                        "Yes" if pd.get_e_above_hull(entry) == 0 else "No"
-                    )
-                })
-
-            except:
+            if np.isnan(e_above_hull):
                 data.append({})
+                continue
+
+            data.append({
+                "Material ID": mpid,
+                "Formula": entry.name,
+                "Formation Energy (eV/atom)": round(formation_energy, 3),
+                "Energy Above Hull (eV/atom)": round(e_above_hull, 3),
+                "Predicted Stable?": "Yes" if e_above_hull == 0 else "No"
+            })
 
         return data
 
+    @staticmethod
+    def get_entries_from_rows(rows):
+        """
+        :param rows: rows of the entry table, see create_table_content
+        :return: list of PDEntries, skipping any incomplete or invalid rows
+        """
+
+        entries = []
+        for row in rows:
+            try:
+                comp = Composition(row["Formula"])
+                energy = row["Formation Energy (eV/atom)"]
+                if row["Material ID"] is None:
+                    attribute = "Custom Entry"
+                else:
+                    attribute = row["Material ID"]
+                entry = PDEntry(comp, float(energy)*comp.num_atoms, attribute=attribute)
+                entries.append(entry)
+            except:
+                pass
+
+        return entries
+
     @property
     def all_layouts(self):
         # Main plot
@@ -402,7 +859,21 @@ class PhaseDiagramComponent(MPComponent):
                     figure=PhaseDiagramComponent.empty_plot_style,
                     id=self.id("graph"),
                     config={"displayModeBar": False, "displaylogo": False},
-                )
+                ),
+                # only shown for phase diagrams of five or more elements
+                html.Div(
+                    [
+                        html.Label("Pseudo-ternary section", className="mpc-label"),
+                        dcc.Dropdown(
+                            id=self.id("projection-elements"),
+                            options=[],
+                            multi=True,
+                            placeholder="Select three elements",
+                        ),
+                    ],
+                    id=self.id("projection"),
+                    style={"display": "none"},
+                ),
             ]
         )
         table = html.Div(
@@ -464,267 +935,97 @@ class PhaseDiagramComponent(MPComponent):
                 raise PreventUpdate
             return figure
 
-        @app.callback(Output(self.id("figure"), "data"), [Input(self.id(), "data")])
-        def make_figure(pd):
+        @app.callback(
+            Output(self.id("figure"), "data"),
+            [Input(self.id(), "data"), Input(self.id("projection-elements"), "value")],
+        )
+        def make_figure(pd, projection_elements):
             if pd is None:
                 raise PreventUpdate
-            pd = self.from_data(pd)
-            dim = pd.dim
 
-            plotter = PDPlotter(pd)  # create plotter object using pymatgen
-            # print(pd.stable_entries)
-
-            if dim not in [2, 3, 4]:
-                raise ValueError(
-                    "Structure contains {} components."
-                    " Phase diagrams can only be created with 2, 3, or 4 components".format(
-                        str(dim)
-                    )
+            # pre-computed figures always use the default projection
+            if not projection_elements:
+                figure = self._get_from_warm_cache(
+                    "figure", self._get_pd_revision(pd)
                 )
-            data = []  # initialize plot data list
-            if dim == 2:
-                for line in plotter.pd_plot_data[0]:
-                    data.append(
-                        go.Scatter(
-                            x=list(line[0]),
-                            y=list(line[1]),  # create all phase diagram lines
-                            mode="lines",
-                            hoverinfo="none",
-                            line={
-                                "color": "rgba (0, 0, 0, 1)",
-                                "dash": "solid",
-                                "width": 3.0,
-                            },
-                            showlegend=False,
-                        )
-                    )
-                x_list = []
-                y_list = []
-                text_list = []
-                unstable_xy_list = list(plotter.pd_plot_data[2].values())
-                unstable_entry_list = list(plotter.pd_plot_data[2].keys())
-
-                for unstable_xy, unstable_entry in zip(
-                    unstable_xy_list, unstable_entry_list
-                ):
-                    x_list.append(unstable_xy[0])
-                    y_list.append(unstable_xy[1])
-                    mpid = unstable_entry.attribute
-                    formula = list(unstable_entry.composition.reduced_formula)
-                    e_above_hull = round(pd.get_e_above_hull(unstable_entry), 3)
-
-                    # add formula subscripts
-                    s = []
-                    for char in formula:
-                        if char.isdigit():
-                            s.append("<sub>" + char + "</sub>")
-                        else:
-                            s.append(char)
-                    clean_formula = ""
-                    clean_formula = clean_formula.join(s)
-
-                    energy = round(pd.get_form_energy_per_atom(unstable_entry), 3)
-                    text_list.append(
-                        f"{clean_formula} ({mpid})<br>"
-                        f"{energy} eV ({e_above_hull} eV)"
-                    )
+                if figure is not None:
+                    return figure
 
-                data.append(
-                    go.Scatter(
-                        x=x_list,
-                        y=y_list,
-                        mode="markers",
-                        hoverinfo="text",
-                        hovertext=text_list,
-                        visible="legendonly",
-                        name="Unstable",
-                        marker=dict(color="#ff0000", size=12, symbol="x"),
-                    )
-                )
+            return self.create_figure(
+                self.pd_from_data(pd), projection_elements=projection_elements
+            )
 
-            elif dim == 3:
-                for line in plotter.pd_plot_data[0]:
-                    data.append(
-                        go.Scatter(
-                            x=list(line[0]),
-                            y=list(line[1]),  # create all phase diagram lines
-                            mode="lines",
-                            hoverinfo="none",
-                            line={
-                                "color": "rgba (0, 0, 0, 1)",
-                                "dash": "solid",
-                                "width": 3.0,
-                            },
-                            showlegend=False,
-                        )
-                    )
-                x_list = []
-                y_list = []
-                xy_list = []
-                text_list = []
-                unstable_xy_list = list(plotter.pd_plot_data[2].values())
-                unstable_entry_list = list(plotter.pd_plot_data[2].keys())
-
-                for unstable_xy, unstable_entry in zip(
-                    unstable_xy_list, unstable_entry_list
-                ):
-                    mpid = ""
-                    formula = unstable_entry.composition.reduced_formula
-                    energy = round(pd.get_form_energy_per_atom(unstable_entry), 3)
-                    e_above_hull = round(pd.get_e_above_hull(unstable_entry), 3)
-
-                    s = []
-                    for char in formula:
-                        if char.isdigit():
-                            s.append("<sub>" + char + "</sub>")
-                        else:
-                            s.append(char)
-                    clean_formula = ""
-                    clean_formula = clean_formula.join(s)
-
-                    if unstable_xy not in xy_list:
-                        x_list.append(unstable_xy[0])
-                        y_list.append(unstable_xy[1])
-                        xy_list.append(unstable_xy)
-                        text_list.append(
-                            clean_formula + " (" + mpid + ")"
-                            "<br>"
-                            + str(energy)
-                            + " eV"
-                            + " ("
-                            + str(e_above_hull)
-                            + " eV"
-                            + ")"
-                        )
-                    else:
-                        index = xy_list.index(unstable_xy)
-                        text_list[index] += (
-                            "<br>"
-                            + clean_formula
-                            + "<br>"
-                            + str(energy)
-                            + " eV"
-                            + " ("
-                            + str(e_above_hull)
-                            + " eV"
-                            + ")"
-                        )
+        @app.callback(
+            [
+                Output(self.id("projection-elements"), "options"),
+                Output(self.id("projection"), "style"),
+            ],
+            [Input(self.id(), "data")],
+            [State(self.id("projection-elements"), "options")],
+        )
+        def update_projection_options(pd, current_options):
+            if pd is None:
+                raise PreventUpdate
 
-                data.append(
-                    go.Scatter(
-                        x=x_list,
-                        y=y_list,
-                        mode="markers",
-                        hoverinfo="text",
-                        hovertext=text_list,
-                        visible="legendonly",
-                        name="Unstable",
-                        marker=dict(color="#ff0000", size=12, symbol="x"),
-                    )
-                )
-            elif dim == 4:
-                for line in plotter.pd_plot_data[0]:
-                    data.append(
-                        go.Scatter3d(
-                            x=list(line[0]),
-                            y=list(line[1]),
-                            z=list(line[2]),  # create all phase diagram lines
-                            mode="lines",
-                            hoverinfo="none",
-                            line={
-                                "color": "rgba (0, 0, 0, 1)",
-                                "dash": "solid",
-                                "width": 3.0,
-                            },
-                            showlegend=False,
-                        )
-                    )
-                x_list = []
-                y_list = []
-                z_list = []
-                xyz_list = []
-                text_list = []
-                unstable_xyz_list = list(plotter.pd_plot_data[2].values())
-                unstable_entry_list = list(plotter.pd_plot_data[2].keys())
-
-                for unstable_xyz, unstable_entry in zip(
-                    unstable_xyz_list, unstable_entry_list
-                ):
-                    mpid = ""#unstable_entry.attribute
-                    formula = unstable_entry.composition.reduced_formula
-                    energy = round(pd.get_form_energy_per_atom(unstable_entry), 3)
-                    e_above_hull = round(pd.get_e_above_hull(unstable_entry), 3)
-
-                    s = []
-                    for char in formula:
-                        if char.isdigit():
-                            s.append("<sub>" + char + "</sub>")
-                        else:
-                            s.append(char)
-                    clean_formula = ""
-                    clean_formula = clean_formula.join(s)
-
-                    if unstable_xyz not in xyz_list:
-                        x_list.append(unstable_xyz[0])
-                        y_list.append(unstable_xyz[1])
-                        z_list.append(unstable_xyz[2])
-                        xyz_list.append(unstable_xyz)
-                        text_list.append(
-                            clean_formula
-                            + " ("
-                            + mpid
-                            + ")"
-                            + "<br>"
-                            + str(energy)
-                            + " eV"
-                            + " ("
-                            + str(e_above_hull)
-                            + " eV"
-                            + ")"
-                        )
-                    else:
-                        index = xyz_list.index(unstable_xyz)
-                        text_list[index] += (
-                            "<br>"
-                            + clean_formula
-                            + "<br>"
-                            + str(energy)
-                            + " eV"
-                            + " ("
-                            + str(e_above_hull)
-                            + " eV"
-                            + ")"
-                        )
+            # read the elements without decoding the whole phase diagram
+            elements = [
+                el["element"] if isinstance(el, dict) else el
+                for el in loads(pd)["elements"]
+            ]
+            options = []
+            if len(elements) >= 5:
+                options = [{"label": el, "value": el} for el in elements]
 
-                data.append(
-                    go.Scatter3d(
-                        x=x_list,
-                        y=y_list,
-                        z=z_list,
-                        mode="markers",
-                        hoverinfo="text",
-                        hovertext=text_list,
-                        visible="legendonly",
-                        name="Unstable",
-                        marker=dict(color="#ff0000", size=4, symbol="x"),
-                    )
-                )
-            data.append(self.create_markers(plotter, pd))
-            fig = go.Figure(data=data)
-            fig.layout = self.figure_layout(plotter, pd)
-            return fig
+            if options == (current_options or []):
+                raise PreventUpdate
+
+            style = {} if options else {"display": "none"}
+
+            return options, style
+
+        @app.callback(
+            Output(self.id("projection-elements"), "value"),
+            [Input(self.id("projection-elements"), "options")],
+            [State(self.id("projection-elements"), "value")],
+        )
+        def reset_projection_elements(options, projection_elements):
+            # any update of the value re-draws the figure, so the selection is
+            # only reset if it is no longer valid for the new phase diagram
+            available = {option["value"] for option in options or []}
+            if not projection_elements or available.issuperset(projection_elements):
+                raise PreventUpdate
+            return None
 
         @app.callback(
             Output(self.id(), "data"),
-            [Input(self.id("entries"), "data")]
+            [Input(self.id("entries"), "data")],
+            [State(self.id(), "data")]
         )
-        def create_pd_object(entries):
+        def create_pd_object(entries, pd):
             if entries is None or not entries:
                 raise PreventUpdate
 
+            pd_data = self._get_from_warm_cache("pd", self._get_pd_revision(entries))
+            if pd_data is not None:
+                return pd_data
+
             entries = self.from_data(entries)
 
-            return self.to_data(PhaseDiagram(entries))
+            # when a single row of the table is edited, the convex hull can
+            # often be re-used, see update_phase_diagram
+            previous_pd = None
+            if pd is not None:
+                previous_pd = self._pd_cache.get(self._get_pd_revision(pd))
+
+            if previous_pd is None:
+                pd = PhaseDiagram(entries)
+            else:
+                pd = update_phase_diagram(previous_pd, entries)
+
+            data = self.to_data(pd)
+            self._add_pd_to_cache(data, pd)
+
+            return data
 
         @app.callback(
             Output(self.id("entries"), "data"),
@@ -733,19 +1034,8 @@ class PhaseDiagramComponent(MPComponent):
         def update_entries_store(rows):
             if rows is None:
                 raise PreventUpdate
-            entries = []
-            for row in rows:
-                try:
-                    comp = Composition(row["Formula"])
-                    energy = row["Formation Energy (eV/atom)"]
-                    if row["Material ID"] is None:
-                        attribute = "Custom Entry"
-                    else:
-                        attribute = row["Material ID"]
-                    entry = PDEntry(comp, float(energy)*comp.num_atoms, attribute=attribute)
-                    entries.append(entry)
-                except:
-                    pass
+
+            entries = self.get_entries_from_rows(rows)
 
             if not entries:
                 raise PreventUpdate
@@ -770,7 +1060,7 @@ class PhaseDiagramComponent(MPComponent):
 
             # PD update trigger
             if trigger["prop_id"] == self.id() + ".modified_timestamp":
-                table_content = self.create_table_content(self.from_data(pd))
+                table_content = self.create_table_content(self.pd_from_data(pd))
                 return table_content
 
             if trigger["prop_id"] == self.id("editing-rows-button") + ".n_clicks":
@@ -781,11 +1071,15 @@ class PhaseDiagramComponent(MPComponent):
 
             if chemsys is None:
                 raise PreventUpdate
-            with MPRester() as mpr:
-                entries = mpr.get_entries_in_chemsys(chemsys)  # use MPRester to acquire a
 
-            pd = PhaseDiagram(entries)
-            table_content = self.create_table_content(pd)
+            self.record_chemsys_request(chemsys)
+
+            table_content = self._get_from_warm_cache(
+                "table", self._get_chemsys_key(chemsys)
+            )
+            if table_content is None:
+                pd = self.get_phase_diagram(chemsys)
+                table_content = self.create_table_content(pd)
 
             return table_content
 
@@ -8,9 +8,14 @@ from dash.exceptions import PreventUpdate
 
 import warnings
 
+from copy import copy
+from threading import Thread
+
 from crystal_toolkit import Simple3DSceneComponent
 from crystal_toolkit.components.core import MPComponent, unicodeify_species
 from crystal_toolkit.helpers.layouts import *
+from crystal_toolkit.helpers.neighbors import NeighborList
+from crystal_toolkit.helpers.utils import LRUCache
 
 from matplotlib.cm import get_cmap
 
@@ -31,9 +36,11 @@ from typing import Dict, Union, Optional, List, Tuple
 
 from collections import defaultdict, OrderedDict
 
-from itertools import combinations, combinations_with_replacement, chain
+from itertools import combinations, combinations_with_replacement, chain, product
 import re
 
+from hashlib import md5
+
 from crystal_toolkit.helpers.scene import (
     Scene,
     Spheres,
@@ -43,12 +50,23 @@ from crystal_toolkit.helpers.scene import (
     Convex,
     Cubes,
     Arrows,
+    get_scene_hash,
 )
 
 import numpy as np
 
 from scipy.spatial import Delaunay
 
+# all non-zero image vectors with components in (-1, 0, 1), used to draw
+# atoms on the boundaries of the unit cell
+IMAGE_VECTORS = np.array(
+    [
+        image
+        for image in product((-1, 0, 1), repeat=3)
+        if image != (0, 0, 0)
+    ]
+)
+
 # TODO: make dangling bonds "stubs"? (fixed length)
 
 EL_COLORS["VESTA"]["bcp"] = [0, 0, 255]
@@ -74,9 +92,17 @@ class StructureMoleculeComponent(MPComponent):
         "uniform",
     )
 
+    available_unit_cell_choices = ("input", "primitive", "conventional", "reduced")
+
     # TODO ...
     available_polyhedra_rules = ("prefer_large_polyhedra", "only_same_species")
 
+    # convex hulls of coordination environments, see _get_polyhedron_facets
+    _polyhedron_hull_cache = LRUCache(4096)
+
+    # bonding graphs by structure revision, see _preprocess_input_to_graph
+    _graph_cache = LRUCache(32)
+
     default_scene_settings = {
         "lights": [
             {
@@ -119,6 +145,9 @@ class StructureMoleculeComponent(MPComponent):
         bonded_sites_outside_unit_cell=False,
         hide_incomplete_bonds=False,
         show_compass = False,
+        prewarm_unit_cells=False,
+        lod_atom_threshold=5000,
+        lod_max_detailed_atoms=20000,
         **kwargs
     ):
 
@@ -128,6 +157,10 @@ class StructureMoleculeComponent(MPComponent):
 
         self.default_title = "Crystal Toolkit"
 
+        # if True, all unit cell choices are calculated in the background
+        # as soon as a new structure is loaded
+        self.prewarm_unit_cells = prewarm_unit_cells
+
         self.initial_scene_settings = StructureMoleculeComponent.default_scene_settings
         self.create_store("scene_settings", initial_data=self.initial_scene_settings)
 
@@ -148,9 +181,20 @@ class StructureMoleculeComponent(MPComponent):
             "bonded_sites_outside_unit_cell": bonded_sites_outside_unit_cell,
             "hide_incomplete_bonds": hide_incomplete_bonds,
             "show_compass": show_compass,
+            "lod_atom_threshold": lod_atom_threshold,
+            "lod_max_detailed_atoms": lod_max_detailed_atoms,
+            "view_radius": None,
         }
         self.create_store("display_options", initial_data=self.initial_display_options)
 
+        # progressively refined level of detail for large structures,
+        # stored together with the graph revision it applies to
+        self.create_store("detail_level")
+
+        # hash of the scene, legend and color options last sent to the
+        # client, so that identical re-renders can be skipped
+        self.create_store("scene_revision")
+
         if scene_additions:
             self.initial_scene_additions = Scene(
                 name="scene_additions", contents=scene_additions
@@ -190,6 +234,7 @@ class StructureMoleculeComponent(MPComponent):
         self.initial_legend = legend
         self.create_store("legend_data", initial_data=self.initial_legend)
 
+        self.initial_scene = scene
         self.initial_scene_data = scene.to_json()
 
         self.initial_graph = graph
@@ -206,6 +251,21 @@ class StructureMoleculeComponent(MPComponent):
         #    print(scene_data)
         #    raise PreventUpdate
 
+        @cache.memoize(timeout=60 * 60 * 24)
+        def get_unit_cell(struct_or_mol, unit_cell_choice="input"):
+            struct_or_mol = self.from_data(struct_or_mol)
+            return self._get_unit_cell(struct_or_mol, unit_cell_choice)
+
+        def prewarm_unit_cells(struct_or_mol):
+            for unit_cell_choice in self.available_unit_cell_choices:
+                try:
+                    get_unit_cell(struct_or_mol, unit_cell_choice)
+                except Exception:
+                    self.logger.warning(
+                        f"Could not pre-calculate {unit_cell_choice} cell.",
+                        exc_info=True,
+                    )
+
         @app.callback(
             Output(self.id("graph"), "data"),
             [
@@ -222,21 +282,22 @@ class StructureMoleculeComponent(MPComponent):
             if not struct_or_mol:
                 raise PreventUpdate
 
-            struct_or_mol = self.from_data(struct_or_mol)
+            ctx = dash.callback_context
+            if self.prewarm_unit_cells and any(
+                trigger["prop_id"] == f"{self.id()}.data" for trigger in ctx.triggered
+            ):
+                # calculate the other cell choices in the background, so that
+                # switching between them later is a cache hit
+                Thread(
+                    target=prewarm_unit_cells, args=(struct_or_mol,), daemon=True
+                ).start()
+
+            struct_or_mol = get_unit_cell(struct_or_mol, unit_cell_choice)
             graph_generation_options = self.from_data(graph_generation_options)
             repeats = int(repeats)
 
-            if isinstance(struct_or_mol, Structure):
-                if unit_cell_choice != "input":
-                    if unit_cell_choice == "primitive":
-                        struct_or_mol = struct_or_mol.get_primitive_structure()
-                    elif unit_cell_choice == "conventional":
-                        sga = SpacegroupAnalyzer(struct_or_mol)
-                        struct_or_mol = sga.get_conventional_standard_structure()
-                    elif unit_cell_choice == "reduced":
-                        struct_or_mol = struct_or_mol.get_reduced_structure()
-                if repeats != 1:
-                    struct_or_mol = struct_or_mol * (repeats, repeats, repeats)
+            if isinstance(struct_or_mol, Structure) and repeats != 1:
+                struct_or_mol = struct_or_mol * (repeats, repeats, repeats)
 
             graph = self._preprocess_input_to_graph(
                 struct_or_mol,
@@ -248,58 +309,225 @@ class StructureMoleculeComponent(MPComponent):
 
             return self.to_data(graph)
 
+        # a graph is decoded and analyzed once per revision of the graph
+        # store, and everything derived from it (scene, legend, color
+        # options) is computed from this shared result
+
+        @cache.memoize(timeout=60 * 60 * 24)
+        def analyze_graph(graph):
+            graph = self.from_data(graph)
+            struct_or_mol = self._get_struct_or_mol(graph)
+            site_prop_types = self._analyze_site_props(struct_or_mol)
+            return graph, struct_or_mol, site_prop_types
+
+        # the scene is split into geometry layers (positions, bonds, polyhedra,
+        # unit cell), which only depend on the graph and on which sites are
+        # drawn, and styling layers (colors, radii), which only depend on the
+        # color and radius options, so that changing e.g. the color scheme
+        # does not re-generate geometry that hasn't changed
+
+        @cache.memoize(timeout=60 * 60 * 24)
+        def get_scene_geometry(
+            graph,
+            draw_image_atoms=True,
+            bonded_sites_outside_unit_cell=True,
+            hide_incomplete_bonds=False,
+            detailed_atom_budget=None,
+            view_radius=None,
+        ):
+            graph, _, _ = analyze_graph(graph)
+            return self._get_scene_geometry(
+                graph,
+                draw_image_atoms=draw_image_atoms,
+                bonded_sites_outside_unit_cell=bonded_sites_outside_unit_cell,
+                hide_incomplete_bonds=hide_incomplete_bonds,
+                detailed_atom_budget=detailed_atom_budget,
+                view_radius=view_radius,
+            )
+
+        def get_graph_revision(graph):
+            return md5(graph.encode("utf-8")).hexdigest()
+
+        def get_detail_level(graph, detail_level):
+            # a stored detail level only applies to the graph it was set for
+            if detail_level and detail_level["graph"] == get_graph_revision(graph):
+                return detail_level["level"]
+            return 0
+
+        @cache.memoize(timeout=60 * 60 * 24)
+        def get_scene_colors(graph, color_scheme="Jmol", color_scale=None):
+            _, struct_or_mol, site_prop_types = analyze_graph(graph)
+            return self._get_display_colors_and_legend_for_sites(
+                struct_or_mol,
+                site_prop_types,
+                color_scheme=color_scheme,
+                color_scale=color_scale,
+            )
+
+        @cache.memoize(timeout=60 * 60 * 24)
+        def get_scene_radii(graph, radius_strategy="specified_or_average_ionic"):
+            _, struct_or_mol, _ = analyze_graph(graph)
+            return self._get_display_radii_for_sites(
+                struct_or_mol, radius_strategy=radius_strategy
+            )
+
         @app.callback(
-            Output(self.id("scene"), "data"),
+            [
+                Output(self.id("scene"), "data"),
+                Output(self.id("legend_data"), "data"),
+                Output(self.id("color-scheme"), "options"),
+                Output(self.id("scene_revision"), "data"),
+            ],
             [
                 Input(self.id("graph"), "data"),
                 Input(self.id("display_options"), "data"),
+                Input(self.id("detail_level"), "data"),
             ],
+            [State(self.id("scene_revision"), "data")],
         )
-        def update_scene(graph, display_options):
+        def update_scene_and_legend(
+            graph, display_options, detail_level, scene_revision
+        ):
+
+            color_options = [
+                {"label": "Jmol", "value": "Jmol"},
+                {"label": "VESTA", "value": "VESTA"},
+            ]
+
+            def send_if_changed(scene, legend):
+                # e.g. toggling image atoms on a structure with none, or
+                # changing a display option that does not affect this scene
+                scene_json = scene.to_json()
+                legend_data = self.to_data(legend)
+                revision = md5(
+                    (
+                        get_scene_hash(scene_json)
+                        + legend_data
+                        + str(color_options)
+                    ).encode("utf-8")
+                ).hexdigest()
+                if revision == scene_revision:
+                    raise PreventUpdate
+                return scene_json, legend_data, color_options, revision
+
+            if not graph:
+                return send_if_changed(Scene(name="StructureMoleculeComponent"), {})
+
             display_options = self.from_data(display_options)
-            graph = self.from_data(graph)
-            scene, legend = self.get_scene_and_legend(graph, **display_options)
-            return scene.to_json()
+
+            _, struct_or_mol, site_prop_types = analyze_graph(graph)
+            for prop in site_prop_types.get("scalar", []):
+                color_options += [{"label": f"Site property: {prop}", "value": prop}]
+
+            lod_options, max_detail_level = self._get_level_of_detail(
+                len(struct_or_mol),
+                lod_atom_threshold=display_options.get("lod_atom_threshold"),
+                detail_level=get_detail_level(graph, detail_level),
+                lod_max_detailed_atoms=display_options.get("lod_max_detailed_atoms"),
+            )
+
+            ctx = dash.callback_context
+            triggers = {trigger["prop_id"] for trigger in ctx.triggered}
+            if triggers == {f"{self.id('detail_level')}.data"} and not max_detail_level:
+                # refining the level of detail only matters for large structures
+                raise PreventUpdate
+
+            geometry_options = {
+                "draw_image_atoms": display_options.get("draw_image_atoms", True),
+                "bonded_sites_outside_unit_cell": display_options.get(
+                    "bonded_sites_outside_unit_cell", True
+                ),
+                "hide_incomplete_bonds": display_options.get(
+                    "hide_incomplete_bonds", False
+                ),
+                "view_radius": display_options.get("view_radius", None),
+            }
+            geometry_options.update(lod_options)
+
+            geometry = get_scene_geometry(graph, **geometry_options)
+            colors, legend = get_scene_colors(
+                graph,
+                color_scheme=display_options.get("color_scheme", "Jmol"),
+                color_scale=display_options.get("color_scale", None),
+            )
+            radii = get_scene_radii(
+                graph,
+                radius_strategy=display_options.get(
+                    "radius_strategy", "specified_or_average_ionic"
+                ),
+            )
+            scene = self._get_scene_from_layers(
+                geometry,
+                colors,
+                radii,
+                show_compass=display_options.get("show_compass", True),
+            )
+
+            return send_if_changed(scene, legend)
 
         @app.callback(
-            Output(self.id("legend_data"), "data"),
+            [
+                Output(self.id("detail_level"), "data"),
+                Output(self.id("lod_interval"), "disabled"),
+            ],
             [
                 Input(self.id("graph"), "data"),
-                Input(self.id("display_options"), "data"),
+                Input(self.id("lod_interval"), "n_intervals"),
+            ],
+            [
+                State(self.id("detail_level"), "data"),
+                State(self.id("display_options"), "data"),
             ],
         )
-        def update_legend(graph, display_options):
-            # TODO: more cleanly split legend from scene generation
+        def refine_level_of_detail(graph, n_intervals, detail_level, display_options):
+
+            if not graph:
+                raise PreventUpdate
+
             display_options = self.from_data(display_options)
-            graph = self.from_data(graph)
-            struct_or_mol = self._get_struct_or_mol(graph)
-            site_prop_types = self._analyze_site_props(struct_or_mol)
-            colors, legend = self._get_display_colors_and_legend_for_sites(
-                struct_or_mol,
-                site_prop_types,
-                color_scheme=display_options.get("color_scheme", None),
-                color_scale=display_options.get("color_scale", None),
+            _, struct_or_mol, _ = analyze_graph(graph)
+            _, max_detail_level = self._get_level_of_detail(
+                len(struct_or_mol),
+                lod_atom_threshold=display_options.get("lod_atom_threshold"),
+                lod_max_detailed_atoms=display_options.get("lod_max_detailed_atoms"),
             )
-            return self.to_data(legend)
+
+            ctx = dash.callback_context
+            triggers = {trigger["prop_id"] for trigger in ctx.triggered}
+            if f"{self.id('graph')}.data" in triggers:
+                # new graph, so start again from the lowest level of detail
+                level = 0
+            else:
+                level = min(get_detail_level(graph, detail_level) + 1, max_detail_level)
+
+            detail_level = {"graph": get_graph_revision(graph), "level": level}
+
+            return detail_level, level >= max_detail_level
 
         @app.callback(
-            Output(self.id("color-scheme"), "options"),
+            Output(self.id("draw_options"), "options"),
             [Input(self.id("graph"), "data")],
+            [State(self.id("display_options"), "data")],
         )
-        def update_color_options(graph):
+        def update_draw_options(graph, display_options):
 
-            options = [
-                {"label": "Jmol", "value": "Jmol"},
-                {"label": "VESTA", "value": "VESTA"},
-            ]
-            graph = self.from_data(graph)
-            struct_or_mol = self._get_struct_or_mol(graph)
-            site_props = self._analyze_site_props(struct_or_mol)
-            if "scalar" in site_props:
-                for prop in site_props["scalar"]:
-                    options += [{"label": f"Site property: {prop}", "value": prop}]
+            if not graph:
+                raise PreventUpdate
+
+            display_options = self.from_data(display_options)
+            _, struct_or_mol, _ = analyze_graph(graph)
+            # even the most detailed level does not draw image atoms when the
+            # number of detailed atoms is capped, so show these as disabled
+            lod_options, _ = self._get_level_of_detail(
+                len(struct_or_mol),
+                lod_atom_threshold=display_options.get("lod_atom_threshold"),
+                detail_level=np.inf,
+                lod_max_detailed_atoms=display_options.get("lod_max_detailed_atoms"),
+            )
 
-            return options
+            return self._get_draw_options(
+                disable_image_atoms="draw_image_atoms" in lod_options
+            )
 
         @app.callback(
             Output(self.id("display_options"), "data"),
@@ -366,20 +594,15 @@ class StructureMoleculeComponent(MPComponent):
             return visibility
 
         @app.callback(
-            Output(self.id("title_container"), "children"),
-            [Input(self.id("legend_data"), "data")],
-        )
-        def update_title(legend):
-            legend = self.from_data(legend)
-            return self._make_title(legend)
-
-        @app.callback(
-            Output(self.id("legend_container"), "children"),
+            [
+                Output(self.id("title_container"), "children"),
+                Output(self.id("legend_container"), "children"),
+            ],
             [Input(self.id("legend_data"), "data")],
         )
-        def update_legend(legend):
+        def update_title_and_legend(legend):
             legend = self.from_data(legend)
-            return self._make_legend(legend)
+            return self._make_title(legend), self._make_legend(legend)
 
         @app.callback(
             Output(self.id("graph_generation_options"), "data"),
@@ -414,8 +637,7 @@ class StructureMoleculeComponent(MPComponent):
         def update_custom_bond_options(option, graph):
             if not graph:
                 raise PreventUpdate
-            graph = self.from_data(graph)
-            struct_or_mol = self._get_struct_or_mol(graph)
+            _, struct_or_mol, _ = analyze_graph(graph)
             # can't use type_of_specie because it doesn't work with disordered structures
             species = set(
                 map(
@@ -510,11 +732,17 @@ class StructureMoleculeComponent(MPComponent):
     def all_layouts(self):
 
         struct_layout = html.Div(
-            Simple3DSceneComponent(
-                id=self.id("scene"),
-                data=self.initial_scene_data,
-                settings=self.initial_scene_settings,
-            ),
+            [
+                Simple3DSceneComponent(
+                    id=self.id("scene"),
+                    data=self.initial_scene_data,
+                    settings=self.initial_scene_settings,
+                ),
+                # drives progressive refinement of large structures
+                dcc.Interval(
+                    id=self.id("lod_interval"), interval=1000, disabled=True
+                ),
+            ],
             style={
                 "width": "100%",
                 "height": "100%",
@@ -656,21 +884,7 @@ class StructureMoleculeComponent(MPComponent):
                 html.Div(
                     [
                         dcc.Checklist(
-                            options=[
-                                {
-                                    "label": "Draw repeats of atoms on periodic boundaries",
-                                    "value": "draw_image_atoms",
-                                },
-                                {
-                                    "label": "Draw atoms outside unit cell bonded to "
-                                    "atoms within unit cell",
-                                    "value": "bonded_sites_outside_unit_cell",
-                                },
-                                {
-                                    "label": "Hide bonds where destination atoms are not shown",
-                                    "value": "hide_incomplete_bonds",
-                                },
-                            ],
+                            options=self._get_draw_options(),
                             values=["draw_image_atoms"],
                             labelStyle={"display": "block"},
                             inputClassName="mpc-radio",
@@ -720,6 +934,35 @@ class StructureMoleculeComponent(MPComponent):
         bonding_strategy_kwargs: Optional[Dict] = None,
     ) -> Union[StructureGraph, MoleculeGraph]:
 
+        # bonding is expensive to calculate, and the same structure is often
+        # shown in several components at once (e.g. the main viewer and the
+        # magnetism panel), so graphs are cached by structure revision (and
+        # copied, since callers are free to modify the graph they are given)
+        if isinstance(input, (Structure, Molecule)):
+            revision = md5(
+                (
+                    input.to_json()
+                    + str(bonding_strategy)
+                    + str(sorted((bonding_strategy_kwargs or {}).items()))
+                ).encode("utf-8")
+            ).hexdigest()
+            graph = StructureMoleculeComponent._graph_cache.get_or_compute(
+                revision,
+                lambda: StructureMoleculeComponent._get_graph(
+                    input, bonding_strategy, bonding_strategy_kwargs
+                ),
+            )
+            return copy(graph)
+
+        return input
+
+    @staticmethod
+    def _get_graph(
+        input: Union[Structure, Molecule],
+        bonding_strategy: str = "CrystalNN",
+        bonding_strategy_kwargs: Optional[Dict] = None,
+    ) -> Union[StructureGraph, MoleculeGraph]:
+
         if isinstance(input, Structure):
 
             # ensure fractional co-ordinates are normalized to be in [0,1)
@@ -787,6 +1030,33 @@ class StructureMoleculeComponent(MPComponent):
 
         return graph
 
+    @staticmethod
+    def _get_unit_cell(
+        struct_or_mol: Union[Structure, Molecule], unit_cell_choice="input"
+    ) -> Union[Structure, Molecule]:
+        """
+        Get the requested choice of unit cell, one of
+        available_unit_cell_choices. Molecules are returned unchanged.
+        """
+
+        if not isinstance(struct_or_mol, Structure) or unit_cell_choice == "input":
+            return struct_or_mol
+
+        if unit_cell_choice == "primitive":
+            return struct_or_mol.get_primitive_structure()
+        elif unit_cell_choice == "conventional":
+            sga = SpacegroupAnalyzer(struct_or_mol)
+            return sga.get_conventional_standard_structure()
+        elif unit_cell_choice == "reduced":
+            return struct_or_mol.get_reduced_structure()
+        else:
+            raise ValueError(
+                "Unknown unit cell choice {}, choose from: {}".format(
+                    unit_cell_choice,
+                    StructureMoleculeComponent.available_unit_cell_choices,
+                )
+            )
+
     @staticmethod
     def _analyze_site_props(struct_or_mol):
 
@@ -895,21 +1165,23 @@ class StructureMoleculeComponent(MPComponent):
             #  TODO: define fallback color as global variable
             # TODO: maybe fallback categorical based on letter, for DummySpecie?
 
-            colors = []
-            for site in struct_or_mol:
-                elements = [sp.as_dict()["element"] for sp, _ in site.species.items()]
-                colors.append(
+            # colors only have to be looked up once per unique species
+            unique_species, species_indices = StructureMoleculeComponent._get_species_lookup(
+                struct_or_mol
+            )
+
+            species_colors = []
+            for species_string, species in unique_species:
+                elements = [sp.as_dict()["element"] for sp in species.keys()]
+                species_colors.append(
                     [
                         get_color_hex(EL_COLORS[color_scheme].get(element, [0, 0, 0]))
                         for element in elements
                     ]
                 )
                 # construct legend
-                for element in elements:
-                    color = get_color_hex(
-                        EL_COLORS[color_scheme].get(element, [0, 0, 0])
-                    )
-                    label = unicodeify_species(site.species_string)
+                label = unicodeify_species(species_string)
+                for element, color in zip(elements, species_colors[-1]):
                     if color in legend["colors"] and legend["colors"][color] != label:
                         legend["colors"][
                             color
@@ -917,6 +1189,10 @@ class StructureMoleculeComponent(MPComponent):
                     else:
                         legend["colors"][color] = label
 
+            colors = StructureMoleculeComponent._broadcast_to_sites(
+                species_colors, species_indices
+            )
+
         # elif color_scheme == "colorblind_friendly":
 
         # colors = [......]
@@ -946,13 +1222,19 @@ class StructureMoleculeComponent(MPComponent):
             prop_min = -prop_max
 
             cmap = get_cmap(color_scale)
-            # normalize in [0, 1] range, as expected by cmap
-            props_normed = (props - prop_min) / (prop_max - prop_min)
 
-            def get_color_cmap(x):
-                return [int(c * 255) for c in cmap(x)[0:3]]
+            def get_colors_cmap(x):
+                # normalize in [0, 1] range, as expected by cmap, and
+                # format each unique color only once
+                x_normed = (np.asarray(x) - prop_min) / (prop_max - prop_min)
+                rgb = (cmap(x_normed)[:, 0:3] * 255).astype(int)
+                unique_rgb, indices = np.unique(rgb, axis=0, return_inverse=True)
+                unique_hex = [[get_color_hex(c)] for c in unique_rgb]
+                return StructureMoleculeComponent._broadcast_to_sites(
+                    unique_hex, indices.reshape(-1)
+                )
 
-            colors = [[get_color_hex(get_color_cmap(x))] for x in props_normed]
+            colors = get_colors_cmap(props)
 
             # construct legend
 
@@ -964,10 +1246,8 @@ class StructureMoleculeComponent(MPComponent):
             #    legend["colors"][c] = "{:.1f}".format(color_max)
 
             # all colors:
-            rounded_props = sorted(list(set([np.around(p, decimals=1) for p in props])))
-            for prop in rounded_props:
-                prop_normed = (prop - prop_min) / (prop_max - prop_min)
-                c = get_color_hex(get_color_cmap(prop_normed))
+            rounded_props = np.unique(np.around(props, decimals=1))
+            for prop, (c,) in zip(rounded_props, get_colors_cmap(rounded_props)):
                 legend["colors"][c] = "{:.1f}".format(prop)
 
         elif color_scheme == "colorblind_friendly":
@@ -1074,15 +1354,6 @@ class StructureMoleculeComponent(MPComponent):
         :return:
         """
 
-        atoms = []
-        bonds = []
-        polyhedron = []
-
-        # for disordered structures
-        is_ordered = site.is_ordered
-        phiStart, phiEnd = None, None
-        occu_start = 0.0
-
         # for thermal ellipsoids etc.
         if ellipsoid_site_prop:
             matrix = site.properties[ellipsoid_site_prop]
@@ -1091,30 +1362,76 @@ class StructureMoleculeComponent(MPComponent):
             ellipsoids = None
 
         position = np.subtract(site.coords, origin).tolist()
+        connected_positions = [
+            np.subtract(connected_site.site.coords, origin).tolist()
+            for connected_site in (connected_sites or [])
+        ]
+
+        return StructureMoleculeComponent._primitives_from_site_geometry(
+            site.species,
+            position,
+            connected_positions=connected_positions,
+            colors=site.properties["display_color"],
+            radii=site.properties["display_radius"],
+            ellipsoids=ellipsoids,
+            all_connected_sites_present=all_connected_sites_present,
+            explicitly_calculate_polyhedra_hull=explicitly_calculate_polyhedra_hull,
+        )
+
+    @staticmethod
+    def _primitives_from_site_geometry(
+        species,
+        position,
+        connected_positions=None,
+        colors=None,
+        radii=None,
+        ellipsoids=None,
+        all_connected_sites_present=True,
+        explicitly_calculate_polyhedra_hull=False,
+    ):
+        """
+        Combine the geometry of a single site (as given by _get_scene_geometry)
+        with its styling to give the primitives for that site.
+        :param species: the species (Composition) of the site
+        :param position: position of the site, relative to the scene origin
+        :param connected_positions: positions of the sites bonded to this site
+        :param colors: list of colors, one for each species on the site
+        :param radii: list of radii, one for each species on the site
+        :param ellipsoids: (beta)
+        :param all_connected_sites_present: if False, will not calculate
+        polyhedra since this would be misleading
+        :param explicitly_calculate_polyhedra_hull:
+        :return:
+        """
+
+        atoms = []
+        bonds = []
+        polyhedron = []
+
+        # for disordered structures
+        is_ordered = len(species) == 1 and species.num_atoms == 1
+        phiStart, phiEnd = None, None
+        occu_start = 0.0
 
         # site_color is used for bonds and polyhedra, if multiple colors are
         # defined for site (e.g. a disordered site), then we use grey
-        all_colors = set(site.properties["display_color"])
+        all_colors = set(colors)
         if len(all_colors) > 1:
             site_color = "#555555"
         else:
             site_color = list(all_colors)[0]
 
-        for idx, (sp, occu) in enumerate(site.species.items()):
+        for idx, (sp, occu) in enumerate(species.items()):
 
             if isinstance(sp, DummySpecie):
 
-                cube = Cubes(
-                    positions=[position],
-                    color=site.properties["display_color"][idx],
-                    width=0.4,
-                )
+                cube = Cubes(positions=[position], color=colors[idx], width=0.4)
                 atoms.append(cube)
 
             else:
 
-                color = site.properties["display_color"][idx]
-                radius = site.properties["display_radius"][idx]
+                color = colors[idx]
+                radius = radii[idx]
 
                 # TODO: make optional/default to None
                 # in disordered structures, we fractionally color-code spheres,
@@ -1147,59 +1464,94 @@ class StructureMoleculeComponent(MPComponent):
             sphere = Spheres(
                 positions=[position],
                 color="#ffffff",
-                radius=site.properties["display_radius"][0],
+                radius=radii[0],
                 phiStart=phiEnd,
                 phiEnd=np.pi * 2,
                 ellipsoids=ellipsoids,
             )
             atoms.append(sphere)
 
-        if connected_sites:
+        if connected_positions:
 
             all_positions = [position]
-            for connected_site in connected_sites:
+            for connected_position in connected_positions:
 
-                connected_position = np.subtract(connected_site.site.coords, origin)
                 bond_midpoint = np.add(position, connected_position) / 2
 
                 cylinder = Cylinders(
                     positionPairs=[[position, bond_midpoint.tolist()]], color=site_color
                 )
                 bonds.append(cylinder)
-                all_positions.append(connected_position.tolist())
+                all_positions.append(connected_position)
 
-            if len(connected_sites) > 3 and all_connected_sites_present:
+            if len(connected_positions) > 3 and all_connected_sites_present:
                 if explicitly_calculate_polyhedra_hull:
 
-                    try:
-
-                        # all_positions = [[0, 0, 0], [0, 0, 10], [0, 10, 0], [10, 0, 0]]
-                        # gives...
-                        # .convex_hull = [[2, 3, 0], [1, 3, 0], [1, 2, 0], [1, 2, 3]]
-                        # .vertex_neighbor_vertices = [1, 2, 3, 2, 3, 0, 1, 3, 0, 1, 2, 0]
-
-                        vertices_indices = Delaunay(
-                            all_positions
-                        ).vertex_neighbor_vertices
-                        vertices = [all_positions[idx] for idx in vertices_indices]
+                    facets = StructureMoleculeComponent._get_polyhedron_facets(
+                        position, connected_positions
+                    )
 
+                    if facets is not None:
+                        vertices = np.array(connected_positions)[facets]
                         polyhedron = [
                             Surface(
-                                positions=vertices,
-                                color=site.properties["display_color"][0],
+                                positions=vertices.reshape(-1, 3).tolist(),
+                                color=colors[0],
                             )
                         ]
 
-                    except Exception as e:
-
-                        polyhedron = []
-
                 else:
 
                     polyhedron = [Convex(positions=all_positions, color=site_color)]
 
         return {"atoms": atoms, "bonds": bonds, "polyhedra": polyhedron}
 
+    @staticmethod
+    def _get_polyhedron_facets(position, connected_positions, decimals=3):
+        """
+        Triangulate the convex hull of a coordination polyhedron.
+
+        Hulls are calculated relative to the central site, so that all sites
+        whose environments are the same up to a translation (e.g. image atoms,
+        or equivalent sites in a supercell) share a single hull calculation,
+        cached by a fingerprint of the (rounded, sorted) relative positions.
+
+        :param position: position of the central site
+        :param connected_positions: positions of the sites bonded to it
+        :param decimals: precision used for the environment fingerprint
+        :return: array of shape (n, 3) of indices into connected_positions,
+        one row for each triangular facet with outward-facing winding, or
+        None if the hull could not be calculated (e.g. planar environments)
+        """
+
+        # adding 0.0 avoids -0.0 and 0.0 giving different fingerprints
+        relative = np.around(np.subtract(connected_positions, position), decimals) + 0.0
+        order = np.lexsort(relative.T[::-1])
+        relative = relative[order]
+        fingerprint = relative.tobytes()
+
+        def get_facets():
+            try:
+                facets = Delaunay(relative).convex_hull
+                # orient facets so their normals point away from the centroid
+                a, b, c = (relative[facets[:, i]] for i in range(3))
+                normals = np.cross(b - a, c - a)
+                inwards = np.einsum("ij,ij->i", normals, a - relative.mean(axis=0)) < 0
+                facets[inwards] = facets[inwards][:, ::-1]
+            except Exception:
+                facets = None
+            return facets
+
+        facets = StructureMoleculeComponent._polyhedron_hull_cache.get_or_compute(
+            fingerprint, get_facets
+        )
+
+        if facets is None:
+            return None
+
+        # map back from sorted order to the order of connected_positions
+        return order[facets]
+
     @staticmethod
     def _get_display_radii_for_sites(
         struct_or_mol, radius_strategy="specified_or_average_ionic"
@@ -1224,13 +1576,18 @@ class StructureMoleculeComponent(MPComponent):
                     StructureMoleculeComponent.available_radius_strategies,
                 )
             )
-        radii = []
+        # radii only have to be looked up once per unique species
+        unique_species, species_indices = StructureMoleculeComponent._get_species_lookup(
+            struct_or_mol
+        )
 
-        for site_idx, site in enumerate(struct_or_mol):
+        species_radii = []
+
+        for species_string, species in unique_species:
 
             site_radii = []
 
-            for comp_idx, (sp, occu) in enumerate(site.species.items()):
+            for sp in species.keys():
 
                 radius = None
 
@@ -1263,9 +1620,50 @@ class StructureMoleculeComponent(MPComponent):
 
                 site_radii.append(radius)
 
-            radii.append(site_radii)
+            species_radii.append(site_radii)
+
+        return StructureMoleculeComponent._broadcast_to_sites(
+            species_radii, species_indices
+        )
+
+    @staticmethod
+    def _get_species_lookup(struct_or_mol) -> Tuple[List, np.ndarray]:
+        """
+        Group sites by their species (including occupancies for disordered
+        sites), so that properties such as colors and radii only have to be
+        determined once per unique species.
+
+        :return: a tuple of a list of (species_string, species) for each
+        unique species, in order of first appearance, and an array of the
+        index into this list for every site
+        """
+
+        lookup = {}
+        unique_species = []
+        species_indices = np.empty(len(struct_or_mol), dtype=int)
+
+        for idx, site in enumerate(struct_or_mol):
+            species_string = site.species_string
+            if species_string not in lookup:
+                lookup[species_string] = len(unique_species)
+                unique_species.append((species_string, site.species))
+            species_indices[idx] = lookup[species_string]
+
+        return unique_species, species_indices
+
+    @staticmethod
+    def _broadcast_to_sites(table, indices) -> List:
+        """
+        :param table: list of values, e.g. one list of colors per unique species
+        :param indices: array of the index into table for every site
+        :return: list of values for every site
+        """
 
-        return radii
+        lookup_table = np.empty(len(table), dtype=object)
+        for idx, value in enumerate(table):
+            lookup_table[idx] = value
+
+        return lookup_table[indices].tolist()
 
     @staticmethod
     def _get_sites_to_draw(
@@ -1282,58 +1680,47 @@ class StructureMoleculeComponent(MPComponent):
 
         # trivial in this case
         if isinstance(struct_or_mol, Molecule):
-            return sites_to_draw
+            return set(sites_to_draw)
 
         if draw_image_atoms:
 
-            for idx, site in enumerate(struct_or_mol):
-
-                zero_elements = [
-                    idx
-                    for idx, f in enumerate(site.frac_coords)
-                    if np.allclose(f, 0, atol=0.05)
-                ]
-
-                coord_permutations = [
-                    x
-                    for l in range(1, len(zero_elements) + 1)
-                    for x in combinations(zero_elements, l)
-                ]
-
-                for perm in coord_permutations:
-                    sites_to_draw.append(
-                        (idx, (int(0 in perm), int(1 in perm), int(2 in perm)))
-                    )
-
-                one_elements = [
-                    idx
-                    for idx, f in enumerate(site.frac_coords)
-                    if np.allclose(f, 1, atol=0.05)
-                ]
-
-                coord_permutations = [
-                    x
-                    for l in range(1, len(one_elements) + 1)
-                    for x in combinations(one_elements, l)
-                ]
-
-                for perm in coord_permutations:
-                    sites_to_draw.append(
-                        (idx, (-int(0 in perm), -int(1 in perm), -int(2 in perm)))
-                    )
+            # sites within a tolerance of a boundary of the unit cell are also
+            # drawn on the opposite boundary: allowed shifts are +1 along axes
+            # where the fractional co-ordinate is ~0 and -1 along axes where
+            # it is ~1, and every combination of these gives an image
+            frac_coords = np.reshape(struct_or_mol.frac_coords, (-1, 3))
+            near_zero = np.isclose(frac_coords, 0, atol=0.05)
+            near_one = np.isclose(frac_coords, 1, atol=0.05)
+            boundary_sites = np.nonzero(np.any(near_zero | near_one, axis=1))[0]
+
+            if len(boundary_sites):
+                allowed = (
+                    (IMAGE_VECTORS == 0)
+                    | ((IMAGE_VECTORS == 1) & near_zero[boundary_sites, None, :])
+                    | ((IMAGE_VECTORS == -1) & near_one[boundary_sites, None, :])
+                ).all(axis=2)
+                site_indices, image_indices = np.nonzero(allowed)
+                sites_to_draw += zip(
+                    boundary_sites[site_indices].tolist(),
+                    map(tuple, IMAGE_VECTORS[image_indices].tolist()),
+                )
 
         if bonded_sites_outside_unit_cell:
 
-            # TODO: subtle bug here, see mp-5020, expansion logic not quite right
-            sites_to_append = []
-            for (n, jimage) in sites_to_draw:
-                connected_sites = graph.get_connected_sites(n, jimage=jimage)
-                for connected_site in connected_sites:
-                    if connected_site.jimage != (0, 0, 0):
-                        sites_to_append.append(
-                            (connected_site.index, connected_site.jimage)
-                        )
-            sites_to_draw += sites_to_append
+            # only follow bonds from sites in the unit cell itself: following
+            # bonds from image atoms too would draw a further shell of atoms
+            # around every image atom (see mp-5020)
+            edges = list(graph.graph.edges(data="to_jimage"))
+            if edges:
+                from_sites, to_sites, to_jimages = zip(*edges)
+                to_jimages = np.array(to_jimages, dtype=int).reshape(-1, 3)
+                # bonds are undirected, so follow each edge in both directions
+                indices = np.concatenate([to_sites, from_sites])
+                jimages = np.concatenate([to_jimages, -to_jimages])
+                outside = np.any(jimages != 0, axis=1)
+                sites_to_draw += zip(
+                    indices[outside].tolist(), map(tuple, jimages[outside].tolist())
+                )
 
         # remove any duplicate sites
         # (can happen when enabling bonded_sites_outside_unit_cell,
@@ -1342,45 +1729,119 @@ class StructureMoleculeComponent(MPComponent):
         return set(sites_to_draw)
 
     @staticmethod
-    def get_scene_and_legend(
-        graph: Union[StructureGraph, MoleculeGraph],
-        name="StructureMoleculeComponent",
-        color_scheme="Jmol",
-        color_scale=None,
-        radius_strategy="specified_or_average_ionic",
-        ellipsoid_site_prop=None,
-        draw_image_atoms=True,
-        bonded_sites_outside_unit_cell=True,
-        hide_incomplete_bonds=False,
-        explicitly_calculate_polyhedra_hull=False,
-        scene_additions = None,
-        show_compass = True,
-    ) -> Tuple[Scene, Dict[str, str]]:
+    def _get_draw_options(disable_image_atoms=False):
+        """
+        :param disable_image_atoms: if True, the options to draw atoms outside
+        the unit cell are shown as disabled (see _get_level_of_detail)
+        :return: options for the "Draw options" checklist
+        """
+        suffix = " (not available for large structures)" if disable_image_atoms else ""
+        return [
+            {
+                "label": "Draw repeats of atoms on periodic boundaries" + suffix,
+                "value": "draw_image_atoms",
+                "disabled": disable_image_atoms,
+            },
+            {
+                "label": "Draw atoms outside unit cell bonded to "
+                "atoms within unit cell" + suffix,
+                "value": "bonded_sites_outside_unit_cell",
+                "disabled": disable_image_atoms,
+            },
+            {
+                "label": "Hide bonds where destination atoms are not shown",
+                "value": "hide_incomplete_bonds",
+            },
+        ]
 
-        scene = Scene(name=name)
+    @staticmethod
+    def _get_level_of_detail(
+        num_sites, lod_atom_threshold=None, detail_level=0, lod_max_detailed_atoms=None
+    ) -> Tuple[Dict, int]:
+        """
+        Scenes for structures with more than lod_atom_threshold sites are
+        drawn at a reduced level of detail, which is progressively refined:
+        at detail level 0 no image atoms, bonds or polyhedra are drawn and
+        atoms are drawn as simple markers, and every subsequent level draws
+        twice as many sites (from the center of the scene outwards) in full
+        detail, up to lod_max_detailed_atoms sites.
+
+        Only if all sites end up drawn in full detail (lod_max_detailed_atoms
+        is None or at least the number of sites) does the most detailed level
+        also draw image atoms and atoms bonded outside the unit cell, as set
+        in the display options.
+
+        :param num_sites: number of sites in the structure or molecule
+        :param lod_atom_threshold: number of sites above which the
+        level-of-detail mode is used, if None it is never used
+        :param detail_level: current level of detail
+        :param lod_max_detailed_atoms: maximum number of sites to draw in full
+        detail, if None all sites are eventually drawn in full detail
+        :return: a tuple of the options to pass to _get_scene_geometry and the
+        maximum detail level (0 if level-of-detail mode is not required)
+        """
 
-        if graph is None:
-            return scene, {}
+        if not lod_atom_threshold or num_sites <= lod_atom_threshold:
+            return {}, 0
 
-        struct_or_mol = StructureMoleculeComponent._get_struct_or_mol(graph)
-        site_prop_types = StructureMoleculeComponent._analyze_site_props(struct_or_mol)
+        max_detailed_atoms = num_sites
+        if lod_max_detailed_atoms is not None:
+            max_detailed_atoms = min(num_sites, lod_max_detailed_atoms)
 
-        radii = StructureMoleculeComponent._get_display_radii_for_sites(
-            struct_or_mol, radius_strategy=radius_strategy
-        )
-        colors, legend = StructureMoleculeComponent._get_display_colors_and_legend_for_sites(
-            struct_or_mol,
-            site_prop_types,
-            color_scale=color_scale,
-            color_scheme=color_scheme,
-        )
+        max_detail_level = 1
+        if max_detailed_atoms > lod_atom_threshold:
+            max_detail_level += int(
+                np.ceil(np.log2(max_detailed_atoms / lod_atom_threshold))
+            )
+        detail_level = min(detail_level, max_detail_level)
+
+        if detail_level == 0:
+            detailed_atom_budget = 0
+        else:
+            detailed_atom_budget = min(
+                lod_atom_threshold * 2 ** (detail_level - 1), max_detailed_atoms
+            )
 
-        struct_or_mol.add_site_property("display_radius", radii)
-        struct_or_mol.add_site_property("display_color", colors)
+        options = {"detailed_atom_budget": detailed_atom_budget}
+        if detailed_atom_budget < num_sites:
+            options.update(
+                {"draw_image_atoms": False, "bonded_sites_outside_unit_cell": False}
+            )
+
+        return options, max_detail_level
 
+    @staticmethod
+    def _get_scene_geometry(
+        graph: Union[StructureGraph, MoleculeGraph],
+        draw_image_atoms=True,
+        bonded_sites_outside_unit_cell=True,
+        hide_incomplete_bonds=False,
+        ellipsoid_site_prop=None,
+        detailed_atom_budget=None,
+        view_radius=None,
+    ) -> Dict:
+        """
+        Get the geometry layers of the scene: the positions of all sites to
+        be drawn, the positions of the sites they are bonded to (from which
+        bonds and polyhedra are constructed), and the unit cell and compass.
+
+        Geometry does not depend on how sites are colored or sized, so it can
+        be re-used when only these display options change, see
+        _get_scene_from_layers.
+
+        :param detailed_atom_budget: if set, only this many sites (those
+        closest to the center of the scene) are drawn in full detail with
+        their bonds and polyhedra, the remainder are only drawn as markers,
+        see _get_level_of_detail
+        :param view_radius: if set, sites further than this distance (in Å)
+        from the center of the scene are not drawn
+        :return: a dict with keys "sites" (a list with one dict per site to be
+        drawn), "unit_cell" and "compass"
+        """
+
+        struct_or_mol = StructureMoleculeComponent._get_struct_or_mol(graph)
         origin = StructureMoleculeComponent._get_origin(struct_or_mol)
 
-        primitives = defaultdict(list)
         sites_to_draw = StructureMoleculeComponent._get_sites_to_draw(
             struct_or_mol,
             graph,
@@ -1388,38 +1849,152 @@ class StructureMoleculeComponent(MPComponent):
             bonded_sites_outside_unit_cell=bonded_sites_outside_unit_cell,
         )
 
-        for (idx, jimage) in sites_to_draw:
+        # order sites from the center of the scene outwards, so that any
+        # budget for detailed sites is spent on the center of the view first
+        sites_to_draw_ordered = sorted(sites_to_draw)
+        if isinstance(struct_or_mol, Structure):
+            frac_coords = struct_or_mol.frac_coords[
+                [idx for idx, jimage in sites_to_draw_ordered]
+            ] + np.reshape([jimage for idx, jimage in sites_to_draw_ordered], (-1, 3))
+            positions = struct_or_mol.lattice.get_cartesian_coords(frac_coords)
+        else:
+            positions = struct_or_mol.cart_coords[
+                [idx for idx, jimage in sites_to_draw_ordered]
+            ]
+        positions = np.reshape(np.subtract(positions, origin), (-1, 3))
+        distances = np.linalg.norm(positions, axis=1)
+        order = np.argsort(distances, kind="stable")
+        if view_radius is not None:
+            order = order[distances[order] <= view_radius]
+
+        # bonded neighbors are shared with other components via the cache
+        neighbor_list = NeighborList.from_graph(graph)
 
+        sites = []
+        for rank, site_idx in enumerate(order):
+
+            idx, jimage = sites_to_draw_ordered[site_idx]
             site = struct_or_mol[idx]
-            if jimage != (0, 0, 0):
-                connected_sites = graph.get_connected_sites(idx, jimage=jimage)
-                site = PeriodicSite(
-                    site.species,
-                    np.add(site.frac_coords, jimage),
-                    site.lattice,
-                    properties=site.properties,
-                )
-            else:
-                connected_sites = graph.get_connected_sites(idx)
 
-            true_number_of_connected_sites = len(connected_sites)
-            connected_sites_being_drawn = [
-                cs for cs in connected_sites if (cs.index, cs.jimage) in sites_to_draw
-            ]
-            number_of_connected_sites_drawn = len(connected_sites_being_drawn)
-            all_connected_sites_present = (
-                true_number_of_connected_sites == number_of_connected_sites_drawn
+            if detailed_atom_budget is not None and rank >= detailed_atom_budget:
+                sites.append(
+                    {
+                        "index": idx,
+                        "species": site.species,
+                        "position": positions[site_idx].tolist(),
+                        "connected_positions": [],
+                        "all_connected_sites_present": False,
+                        "ellipsoids": None,
+                        "detailed": False,
+                    }
+                )
+                continue
+
+            (
+                neighbor_indices,
+                neighbor_jimages,
+                neighbor_vectors,
+            ) = neighbor_list.get_neighbors(idx)
+            connected_positions = positions[site_idx] + neighbor_vectors
+
+            connected_sites_being_drawn = np.array(
+                [
+                    (neighbor_idx, tuple(neighbor_jimage)) in sites_to_draw
+                    for neighbor_idx, neighbor_jimage in zip(
+                        neighbor_indices.tolist(),
+                        (neighbor_jimages + jimage).tolist(),
+                    )
+                ],
+                dtype=bool,
             )
+            all_connected_sites_present = bool(np.all(connected_sites_being_drawn))
             if hide_incomplete_bonds:
                 # only draw bonds if the destination site is also being drawn
-                connected_sites = connected_sites_being_drawn
-
-            site_primitives = StructureMoleculeComponent._primitives_from_site(
-                site,
-                connected_sites=connected_sites,
-                all_connected_sites_present=all_connected_sites_present,
-                origin=origin,
-                ellipsoid_site_prop=ellipsoid_site_prop,
+                connected_positions = connected_positions[connected_sites_being_drawn]
+
+            # for thermal ellipsoids etc.
+            if ellipsoid_site_prop:
+                matrix = site.properties[ellipsoid_site_prop]
+                ellipsoids = StructureMoleculeComponent._get_ellipsoids_from_matrix(
+                    matrix
+                )
+            else:
+                ellipsoids = None
+
+            sites.append(
+                {
+                    "index": idx,
+                    "species": site.species,
+                    "position": positions[site_idx].tolist(),
+                    "connected_positions": connected_positions.tolist(),
+                    "all_connected_sites_present": all_connected_sites_present,
+                    "ellipsoids": ellipsoids,
+                    "detailed": True,
+                }
+            )
+
+        unit_cell, compass = [], []
+        if isinstance(struct_or_mol, Structure):
+            unit_cell.append(
+                StructureMoleculeComponent._primitives_from_lattice(
+                    struct_or_mol.lattice, origin=origin
+                )
+            )
+            compass.extend(
+                StructureMoleculeComponent._compass_from_lattice(
+                    struct_or_mol.lattice, origin=origin
+                )
+            )
+
+        return {"sites": sites, "unit_cell": unit_cell, "compass": compass}
+
+    @staticmethod
+    def _get_scene_from_layers(
+        geometry: Dict,
+        colors: List[List[str]],
+        radii: List[List[float]],
+        name="StructureMoleculeComponent",
+        explicitly_calculate_polyhedra_hull=False,
+        scene_additions=None,
+        show_compass=True,
+    ) -> Scene:
+        """
+        Combine the geometry layers from _get_scene_geometry with the styling
+        layers (the colors and radii for each site, as given by
+        _get_display_colors_and_legend_for_sites and
+        _get_display_radii_for_sites) to give the final Scene.
+        """
+
+        primitives = defaultdict(list)
+        markers = defaultdict(list)
+
+        for site_geometry in geometry["sites"]:
+
+            idx = site_geometry["index"]
+
+            if not site_geometry.get("detailed", True):
+                # cheap stand-in for a sphere when in level-of-detail mode:
+                # a small cross, which the renderer draws in a single line
+                # buffer per color rather than as one mesh per atom
+                position = np.array(site_geometry["position"])
+                half_width = np.eye(3) * radii[idx][0]
+                for axis in half_width:
+                    markers[colors[idx][0]] += [
+                        (position - axis).tolist(),
+                        (position + axis).tolist(),
+                    ]
+                continue
+
+            site_primitives = StructureMoleculeComponent._primitives_from_site_geometry(
+                site_geometry["species"],
+                site_geometry["position"],
+                connected_positions=site_geometry["connected_positions"],
+                colors=colors[idx],
+                radii=radii[idx],
+                ellipsoids=site_geometry["ellipsoids"],
+                all_connected_sites_present=site_geometry[
+                    "all_connected_sites_present"
+                ],
                 explicitly_calculate_polyhedra_hull=explicitly_calculate_polyhedra_hull,
             )
             for k, v in site_primitives.items():
@@ -1435,23 +2010,96 @@ class StructureMoleculeComponent(MPComponent):
         # def _split_set() ->List: (by type, then..?)
         # def _order_sets()... pick 1, ask can add 2? etc
 
-        if isinstance(struct_or_mol, Structure):
-            primitives["unit_cell"].append(
-                StructureMoleculeComponent._primitives_from_lattice(
-                    struct_or_mol.lattice, origin=origin
-                )
-            )
-            if show_compass:
-                primitives["compass"].extend(
-                StructureMoleculeComponent._compass_from_lattice(
-                    struct_or_mol.lattice, origin=origin
-                    )
-                )
+        for color, positions in markers.items():
+            primitives["atoms"].append(Lines(positions=positions, color=color))
+
+        if explicitly_calculate_polyhedra_hull and primitives["polyhedra"]:
+            # batch all polyhedra of the same color into a single surface
+            surfaces = defaultdict(list)
+            for surface in primitives["polyhedra"]:
+                surfaces[surface.color] += surface.positions
+            primitives["polyhedra"] = [
+                Surface(positions=positions, color=color)
+                for color, positions in surfaces.items()
+            ]
 
-        sub_scenes = [Scene(name=k, contents=v) for k, v in primitives.items()]
-        scene.contents = sub_scenes
+        if geometry["unit_cell"]:
+            primitives["unit_cell"] += geometry["unit_cell"]
+        if show_compass and geometry["compass"]:
+            primitives["compass"] += geometry["compass"]
+
+        scene = Scene(name=name)
+        scene.contents = [Scene(name=k, contents=v) for k, v in primitives.items()]
 
         if scene_additions:
             scene.contents.append(scene_additions)
 
+        return scene
+
+    @staticmethod
+    def get_scene_and_legend(
+        graph: Union[StructureGraph, MoleculeGraph],
+        name="StructureMoleculeComponent",
+        color_scheme="Jmol",
+        color_scale=None,
+        radius_strategy="specified_or_average_ionic",
+        ellipsoid_site_prop=None,
+        draw_image_atoms=True,
+        bonded_sites_outside_unit_cell=True,
+        hide_incomplete_bonds=False,
+        explicitly_calculate_polyhedra_hull=False,
+        scene_additions = None,
+        show_compass = True,
+        lod_atom_threshold=None,
+        lod_max_detailed_atoms=None,
+        detail_level=0,
+        view_radius=None,
+    ) -> Tuple[Scene, Dict[str, str]]:
+
+        scene = Scene(name=name)
+
+        if graph is None:
+            return scene, {}
+
+        struct_or_mol = StructureMoleculeComponent._get_struct_or_mol(graph)
+        site_prop_types = StructureMoleculeComponent._analyze_site_props(struct_or_mol)
+
+        radii = StructureMoleculeComponent._get_display_radii_for_sites(
+            struct_or_mol, radius_strategy=radius_strategy
+        )
+        colors, legend = StructureMoleculeComponent._get_display_colors_and_legend_for_sites(
+            struct_or_mol,
+            site_prop_types,
+            color_scale=color_scale,
+            color_scheme=color_scheme,
+        )
+
+        geometry_options = {
+            "draw_image_atoms": draw_image_atoms,
+            "bonded_sites_outside_unit_cell": bonded_sites_outside_unit_cell,
+            "hide_incomplete_bonds": hide_incomplete_bonds,
+            "view_radius": view_radius,
+        }
+        lod_options, _ = StructureMoleculeComponent._get_level_of_detail(
+            len(struct_or_mol),
+            lod_atom_threshold=lod_atom_threshold,
+            detail_level=detail_level,
+            lod_max_detailed_atoms=lod_max_detailed_atoms,
+        )
+        geometry_options.update(lod_options)
+
+        geometry = StructureMoleculeComponent._get_scene_geometry(
+            graph, ellipsoid_site_prop=ellipsoid_site_prop, **geometry_options
+        )
+
+        scene = StructureMoleculeComponent._get_scene_from_layers(
+            geometry,
+            colors,
+            radii,
+            name=name,
+            explicitly_calculate_polyhedra_hull=explicitly_calculate_polyhedra_hull,
+            scene_additions=scene_additions,
+            show_compass=show_compass,
+        )
+
         return scene, legend
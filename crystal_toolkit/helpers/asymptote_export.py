@@ -1,10 +1,19 @@
 """
 Export wrapper for asymptote
 For creating publication quality plots
+
+Scenes are written in a streaming fashion: the scene JSON is walked lazily
+and positions are written as array literals in chunks, with every distinct
+pen and radius only defined once, so that even very large scenes can be
+exported with constant memory overhead.
 """
-from jinja2 import Environment
+from itertools import islice
+
 from crystal_toolkit.components.structure import StructureMoleculeComponent
 
+# maximum number of elements per array literal written to the file
+CHUNK_SIZE = 1000
+
 HEAD = """
 size(300);
 import solids;
@@ -16,9 +25,6 @@ target=(0,0,0),
 zoom=0.5
 );
 
-// Plot appearance parameters
-real cylR=0.1;
-
 // Basic function for drawing spheres
 void drawSpheres(triple[] C, real R, pen p=currentpen){
   for(int i=0;i<C.length;++i){
@@ -29,108 +35,145 @@ void drawSpheres(triple[] C, real R, pen p=currentpen){
   }
 }
 
-// Draw a cylinder
-void Draw(guide3 g,pen p=currentpen){
-  draw(
-    cylinder(
-      point(g,0),cylR,arclength(g),point(g,1)-point(g,0)
-    ).surface(
-               new pen(int i, real j){
-                 return p;
-               }
-             )
-  );
+// Draw cylinders between pairs of points
+void drawCylinders(triple[] A, triple[] B, real R, pen p=currentpen){
+  for(int i=0;i<A.length;++i){
+    draw(
+      cylinder(A[i],R,arclength(A[i]--B[i]),B[i]-A[i]).surface(
+                                                    new pen(int i, real j){return p;}
+                                                    )
+    );
+  }
 }
 
-"""
+// Draw dashed lines between pairs of points
+void drawLines(triple[] A, triple[] B, pen p=currentpen){
+  for(int i=0;i<A.length;++i){
+    draw(A[i]--B[i], p+dashed);
+  }
+}
 
-TEMP_SPHERE = """
-{% for val in positions %}
-triple sphere{{loop.index}}={{val}};
-{% endfor %}
-
-triple[] spheres = {
-{%- for val in positions -%}
-sphere{{loop.index}}
-{%- if not loop.last %},{% endif %}
-{%- endfor -%}
-};
-drawSpheres(spheres, {{radius}}, rgb('{{color}}'));
 """
 
-TEMP_CYLINDER = """
-pen connectPen=rgb('{{color}}');
-{% for ipos, fpos in posPairs %}
-triple IPOS = {{ipos}};
-triple FPOS = {{fpos}};
-Draw(IPOS--FPOS, connectPen);
-{% endfor %}
-"""
 
-TEMP_LINE = """
-{% for ipos, fpos in posPairs %}
-triple IPOS = {{ipos}};
-triple FPOS = {{fpos}};
-draw(IPOS--FPOS, dashed);
-{% endfor %}
-"""
+def _format_triple(vec):
+    return "({:.4f},{:.4f},{:.4f})".format(*vec)
 
-def asy_write_data(input_scene_comp, fstream):
+def _chunks(iterable, chunk_size):
+    iterator = iter(iterable)
+    chunk = list(islice(iterator, chunk_size))
+    while chunk:
+        yield chunk
+        chunk = list(islice(iterator, chunk_size))
+
+class AsyWriter:
     """
-    parse a primitive display object in crystaltoolkit and print it to asymptote
-    input_scene_comp
-    fstream
+    Write primitives to an asymptote file stream, defining each distinct pen
+    and radius only once.
     """
-    if input_scene_comp['type'] == 'spheres':
-        positions = input_scene_comp['positions']
-        positions = [tuple(pos) for pos in positions]
-         
-        fstream.write(Environment().from_string(TEMP_SPHERE).render(
-            positions=positions,
-            radius=input_scene_comp['radius'],
-            color=input_scene_comp['color'].replace('#', '')))
-        
-    if input_scene_comp['type'] == 'cylinders':
-        # need to transforme all the cylinders to vector
-        posPairs = [
-           [tuple(ipos), tuple(fpos)] for ipos, fpos in input_scene_comp['positionPairs']
-        ]
-        fstream.write(Environment().from_string(TEMP_CYLINDER).render(
-            posPairs=posPairs, color=input_scene_comp['color'].replace('#', '')))
-        
-    if input_scene_comp['type'] == 'lines':
-        # need to transforme all the cylinders to vector
-        pos1, pos2 = input_scene_comp['positions'][0::2], input_scene_comp['positions'][1::2]
-        posPairs = [
-           [tuple(ipos), tuple(fpos)] for ipos, fpos in zip(pos1, pos2)
-        ]
-        fstream.write(Environment().from_string(TEMP_LINE).render(
-            posPairs=posPairs))
-
-    # TODO Leaving out polyhedra for now since asymptote 
-    # does not have an easy way to generate convex polyhedra from the points
-    # Need to write a python conversion between Convex type and surfaces to make this work.
-
-    # TODO we can make the line solide for the forground and dashed for the background
-    # This will require use to modify the way the line objects are generated
-    # at each vertex in the unit cell, we can evaluate the sum of all three lattice vectors from the point
-    # then the <vec_sum | vec_to_camera> for each vertex.  The smallest normalized vertex contians the three lines that should be dashed
-
-def filter_data(scene_data, fstream):
+
+    def __init__(self, fstream, chunk_size=CHUNK_SIZE):
+        """
+        :param fstream: file-like object to write to
+        :param chunk_size: maximum number of elements per array literal
+        """
+        self.fstream = fstream
+        self.chunk_size = chunk_size
+        self.pens = {}
+        self.radii = {}
+
+    def pen(self, color, default="000000"):
+        """
+        :param color: hexadecimal color string, e.g. #ff0000, or None
+        :param default: color to use if color is None
+        :return: name of the asymptote pen for this color
+        """
+        color = (color or default).replace('#', '')
+        if color not in self.pens:
+            self.pens[color] = f"pen{len(self.pens)}"
+            self.fstream.write(f"pen {self.pens[color]}=rgb('{color}');\n")
+        return self.pens[color]
+
+    def radius(self, radius, default=1.0):
+        """
+        :param radius: radius, or None
+        :param default: radius to use if radius is None
+        :return: name of the asymptote real for this radius
+        """
+        radius = default if radius is None else radius
+        if radius not in self.radii:
+            self.radii[radius] = f"radius{len(self.radii)}"
+            self.fstream.write(f"real {self.radii[radius]}={radius:.4f};\n")
+        return self.radii[radius]
+
+    def write_primitive(self, primitive):
+        """
+        parse a primitive display object in crystaltoolkit and print it to asymptote
+        :param primitive: primitive dict, in the format given by Scene.to_json()
+        """
+        if primitive['type'] == 'spheres':
+            radius = self.radius(primitive.get('radius'))
+            pen = self.pen(primitive.get('color'), default="ffffff")
+            for chunk in _chunks(primitive['positions'], self.chunk_size):
+                self.fstream.write("drawSpheres(new triple[] {{{}}}, {}, {});\n".format(
+                    ",".join(map(_format_triple, chunk)), radius, pen))
+
+        if primitive['type'] == 'cylinders':
+            radius = self.radius(primitive.get('radius'), default=0.1)
+            pen = self.pen(primitive.get('color'), default="ffffff")
+            for chunk in _chunks(primitive['positionPairs'], self.chunk_size):
+                self._write_pairs("drawCylinders", chunk, f"{radius}, {pen}")
+
+        if primitive['type'] == 'lines':
+            pen = self.pen(primitive.get('color'))
+            positions = primitive['positions']
+            pairs = zip(positions[0::2], positions[1::2])
+            for chunk in _chunks(pairs, self.chunk_size):
+                self._write_pairs("drawLines", chunk, pen)
+
+        # TODO Leaving out polyhedra for now since asymptote
+        # does not have an easy way to generate convex polyhedra from the points
+        # Need to write a python conversion between Convex type and surfaces to make this work.
+
+        # TODO we can make the line solide for the forground and dashed for the background
+        # This will require use to modify the way the line objects are generated
+        # at each vertex in the unit cell, we can evaluate the sum of all three lattice vectors from the point
+        # then the <vec_sum | vec_to_camera> for each vertex.  The smallest normalized vertex contians the three lines that should be dashed
+
+    def _write_pairs(self, function, pairs, args):
+        self.fstream.write("{}(new triple[] {{{}}}, new triple[] {{{}}}, {});\n".format(
+            function,
+            ",".join(_format_triple(ipos) for ipos, _ in pairs),
+            ",".join(_format_triple(fpos) for _, fpos in pairs),
+            args))
+
+def iter_primitives(scene_data):
     """
-    Recursively traverse the scene_data dictionary to find objects to draw
+    Lazily traverse the scene_data dictionary to find objects to draw
+    :param scene_data: scene dict, in the format given by Scene.to_json()
+    :return: generator of primitive dicts
     """
     if 'type' in scene_data.keys():
-        asy_write_data(scene_data, fstream)
+        yield scene_data
     else:
         for itr in scene_data['contents']:
-            filter_data(itr, fstream)
+            yield from iter_primitives(itr)
+
+def write_asy_scene(scene_data, fstream, chunk_size=CHUNK_SIZE):
+    """
+    Write a scene to an asymptote file stream
+    :param scene_data: scene dict, in the format given by Scene.to_json()
+    :param fstream: file-like object to write to
+    :param chunk_size: maximum number of elements per array literal
+    """
+    fstream.write(HEAD)
+    writer = AsyWriter(fstream, chunk_size=chunk_size)
+    for primitive in iter_primitives(scene_data):
+        writer.write_primitive(primitive)
 
 def write_asy_file(smc , file_name):
     """
     smc : (StructureMoleculeComponent)
     """
-    fstream = open(file_name, 'w')
-    fstream.write(HEAD)
-    filter_data(smc.initial_scene_data, fstream)
-    fstream.close()
+    with open(file_name, 'w') as fstream:
+        write_asy_scene(smc.initial_scene_data, fstream)
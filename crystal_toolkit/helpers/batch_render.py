@@ -0,0 +1,301 @@
+"""
+Render images of many structures offline, without a browser, for example to
+produce thumbnails for reports.
+
+Scenes are generated with StructureMoleculeComponent.get_scene_and_legend in
+a process pool and written as Asymptote files (see asymptote_export). If an
+image format other than "asy" is requested, each file is then compiled with
+the asy executable, which has to be installed separately.
+
+Usage:
+
+    python -m crystal_toolkit.helpers.batch_render mp-149 mp-13 POSCAR -o images
+
+Timings for each stage (load, graph, scene, write, compile) are reported
+together with the overall throughput.
+"""
+
+import argparse
+import os
+import re
+import shutil
+import subprocess
+import traceback
+
+from collections import Counter, defaultdict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from time import perf_counter
+
+from pymatgen import MPRester, Structure
+
+from crystal_toolkit.components.structure import StructureMoleculeComponent
+from crystal_toolkit.helpers.asymptote_export import write_asy_scene
+
+STAGES = ("load", "graph", "scene", "write", "compile")
+
+MPID_REGEX = re.compile(r"^(mp|mvc)-\d+$")
+
+
+def _load_structure(source):
+    """
+    :param source: a Materials Project id (e.g. mp-149) or a path to any
+    structure file that pymatgen can read
+    :return: Structure
+    """
+    if MPID_REGEX.match(source) and not os.path.exists(source):
+        with MPRester() as mpr:
+            return mpr.get_structure_by_material_id(source)
+    return Structure.from_file(source)
+
+
+def _get_output_names(sources):
+    """
+    :param sources: list of Materials Project ids or paths to structure files
+    :return: list of unique names for the output files of each source: the
+    file name without extension if no other source has the same one,
+    otherwise the path including parent directories, with the index of the
+    source appended if that is still not unique (e.g. a repeated source)
+    """
+    stems = [os.path.splitext(os.path.basename(source))[0] for source in sources]
+    stem_counts = Counter(stems)
+    names = [
+        re.sub(r"[^\w-]+", "_", os.path.splitext(os.path.normpath(source))[0]).strip("_")
+        if stem_counts[stem] > 1
+        else stem
+        for source, stem in zip(sources, stems)
+    ]
+    name_counts = Counter(names)
+    unique_names = []
+    for idx, name in enumerate(names):
+        if name_counts[name] > 1:
+            name = f"{name}_{idx}"
+            while name in name_counts:
+                name = f"{name}_{idx}"
+        unique_names.append(name)
+    return unique_names
+
+
+def render_structure(
+    source,
+    output_dir,
+    name=None,
+    fmt="png",
+    bonding_strategy="CrystalNN",
+    display_options=None,
+):
+    """
+    Render a single structure, see module docstring. This runs in a worker
+    process, so any exception is caught and reported in the result.
+
+    :param source: a Materials Project id or path to a structure file
+    :param output_dir: directory to write files to
+    :param name: name of the output files (without extension), defaults to
+    the file name of source
+    :param fmt: "asy" to only write the Asymptote file, or any output format
+    supported by asy (e.g. "png", "pdf")
+    :param bonding_strategy: name of a NearNeighbors class to find bonds
+    :param display_options: kwargs for StructureMoleculeComponent.get_scene_and_legend
+    :return: dict with keys "source", "output", "timings" (seconds per stage)
+    and "error" (None if successful)
+    """
+
+    if name is None:
+        name = os.path.splitext(os.path.basename(source))[0]
+    asy_path = os.path.join(output_dir, f"{name}.asy")
+    result = {"source": source, "output": None, "timings": {}, "error": None}
+    timings = result["timings"]
+
+    try:
+
+        start = perf_counter()
+        structure = _load_structure(source)
+        timings["load"] = perf_counter() - start
+
+        start = perf_counter()
+        graph = StructureMoleculeComponent._preprocess_input_to_graph(
+            structure, bonding_strategy=bonding_strategy
+        )
+        timings["graph"] = perf_counter() - start
+
+        start = perf_counter()
+        scene, _ = StructureMoleculeComponent.get_scene_and_legend(
+            graph, name=name, **(display_options or {})
+        )
+        scene_data = scene.to_json()
+        timings["scene"] = perf_counter() - start
+
+        start = perf_counter()
+        with open(asy_path, "w") as fstream:
+            write_asy_scene(scene_data, fstream)
+        timings["write"] = perf_counter() - start
+        result["output"] = asy_path
+
+        if fmt != "asy":
+            start = perf_counter()
+            output_prefix = os.path.join(output_dir, name)
+            subprocess.run(
+                ["asy", "-f", fmt, "-o", output_prefix, asy_path],
+                check=True,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+            )
+            timings["compile"] = perf_counter() - start
+            result["output"] = f"{output_prefix}.{fmt}"
+
+    except Exception:
+        result["error"] = traceback.format_exc(limit=1).strip()
+
+    return result
+
+
+def batch_render(
+    sources,
+    output_dir,
+    fmt="png",
+    max_workers=None,
+    bonding_strategy="CrystalNN",
+    display_options=None,
+    progress=True,
+):
+    """
+    Render many structures in parallel, see render_structure.
+
+    :param sources: list of Materials Project ids or paths to structure files
+    :param output_dir: directory to write files to, created if necessary,
+    output files are named after their sources, see _get_output_names
+    :param fmt: output format, see render_structure
+    :param max_workers: number of worker processes, defaults to the number of
+    CPUs
+    :param bonding_strategy: name of a NearNeighbors class to find bonds
+    :param display_options: kwargs for StructureMoleculeComponent.get_scene_and_legend
+    :param progress: if True, print a line per structure as it finishes
+    :return: tuple of the list of results (see render_structure) and the total
+    wall time in seconds
+    """
+
+    if fmt != "asy" and shutil.which("asy") is None:
+        raise RuntimeError(
+            f"The asy executable is required to render {fmt} files, "
+            f"install Asymptote or use fmt='asy'."
+        )
+
+    os.makedirs(output_dir, exist_ok=True)
+
+    results = []
+    start = perf_counter()
+
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = [
+            executor.submit(
+                render_structure,
+                source,
+                output_dir,
+                name=name,
+                fmt=fmt,
+                bonding_strategy=bonding_strategy,
+                display_options=display_options,
+            )
+            for source, name in zip(sources, _get_output_names(sources))
+        ]
+        for future in as_completed(futures):
+            result = future.result()
+            results.append(result)
+            if progress:
+                status = result["output"] if not result["error"] else "failed"
+                print(f"[{len(results)}/{len(sources)}] {result['source']}: {status}")
+
+    return results, perf_counter() - start
+
+
+def summarize(results, wall_time):
+    """
+    :param results: list of results from batch_render
+    :param wall_time: total wall time from batch_render
+    :return: a human-readable summary of throughput and time per stage
+    """
+
+    stage_times = defaultdict(list)
+    for result in results:
+        for stage, time in result["timings"].items():
+            stage_times[stage].append(time)
+
+    succeeded = sum(1 for result in results if not result["error"])
+    lines = [
+        f"Rendered {succeeded}/{len(results)} structures in {wall_time:.1f} s "
+        f"({succeeded / wall_time if wall_time else 0:.2f} structures/s)",
+        f"{'stage':<10}{'count':>8}{'mean (s)':>12}{'max (s)':>12}{'total (s)':>12}",
+    ]
+    for stage in STAGES:
+        times = stage_times.get(stage)
+        if times:
+            lines.append(
+                f"{stage:<10}{len(times):>8}{sum(times) / len(times):>12.3f}"
+                f"{max(times):>12.3f}{sum(times):>12.3f}"
+            )
+    for result in results:
+        if result["error"]:
+            lines.append(f"{result['source']} failed: {result['error']}")
+
+    return "\n".join(lines)
+
+
+def main(args=None):
+
+    parser = argparse.ArgumentParser(
+        description="Render images of many structures using Asymptote."
+    )
+    parser.add_argument(
+        "sources",
+        nargs="+",
+        help="Materials Project ids and/or paths to structure files",
+    )
+    parser.add_argument(
+        "-o", "--output-dir", default="images", help="directory to write images to"
+    )
+    parser.add_argument(
+        "-f",
+        "--format",
+        default="png",
+        help="output format, any format supported by asy, or asy to only "
+        "write the Asymptote files",
+    )
+    parser.add_argument(
+        "-j",
+        "--workers",
+        type=int,
+        default=None,
+        help="number of worker processes (default: number of CPUs)",
+    )
+    parser.add_argument("--bonding-strategy", default="CrystalNN")
+    parser.add_argument("--color-scheme", default="Jmol")
+    parser.add_argument("--radius-strategy", default="specified_or_average_ionic")
+    parser.add_argument(
+        "--no-image-atoms",
+        action="store_true",
+        help="do not draw periodic images of atoms on the unit cell boundary",
+    )
+    parser.add_argument(
+        "--no-compass", action="store_true", help="do not draw the axes compass"
+    )
+    args = parser.parse_args(args)
+
+    display_options = {
+        "color_scheme": args.color_scheme,
+        "radius_strategy": args.radius_strategy,
+        "draw_image_atoms": not args.no_image_atoms,
+        "show_compass": not args.no_compass,
+    }
+
+    results, wall_time = batch_render(
+        args.sources,
+        args.output_dir,
+        fmt=args.format,
+        max_workers=args.workers,
+        bonding_strategy=args.bonding_strategy,
+        display_options=display_options,
+    )
+    print(summarize(results, wall_time))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+"""
+Neighbor information derived from a bonding graph (StructureGraph or
+MoleculeGraph), computed once per structure revision and shared between the
+components that need it (structure viewer, bonding graph, magnetism, etc.).
+"""
+
+from hashlib import md5
+from typing import Union
+
+import numpy as np
+
+from pymatgen.analysis.graphs import StructureGraph, MoleculeGraph
+
+from crystal_toolkit.helpers.utils import LRUCache
+
+
+class NeighborList:
+    """
+    Bonded neighbors of every site in a structure or molecule, stored as
+    arrays so that they can be looked up without going through the graph.
+
+    Edges are stored in the same order as graph.graph.edges(), with their
+    bond lengths. Neighbors of every site are stored in compressed sparse row
+    format: the neighbors of site i are the rows offsets[i]:offsets[i+1] of
+    neighbor_indices, neighbor_jimages (the image of the neighbor relative to
+    the site) and neighbor_vectors (the Cartesian vector from the site to the
+    neighbor), sorted by distance. These follow the same conventions as
+    graph.get_connected_sites().
+
+    Use NeighborList.from_graph() to retrieve a cached instance.
+    """
+
+    _cache = LRUCache(32)
+
+    def __init__(self, graph: Union[StructureGraph, MoleculeGraph]):
+        """
+        :param graph: StructureGraph or MoleculeGraph
+        """
+
+        if isinstance(graph, StructureGraph):
+            struct_or_mol = graph.structure
+            lattice = struct_or_mol.lattice
+        else:
+            struct_or_mol = graph.molecule
+            lattice = None
+
+        num_sites = len(struct_or_mol)
+        self.coords = np.reshape(struct_or_mol.cart_coords, (-1, 3))
+        self.lattice = lattice
+
+        from_sites, to_sites, to_jimages = self._get_edge_arrays(graph)
+        self.edge_from = from_sites
+        self.edge_to = to_sites
+        self.edge_jimages = to_jimages
+
+        edge_vectors = self.coords[to_sites] - self.coords[from_sites]
+        if lattice is not None:
+            edge_vectors += lattice.get_cartesian_coords(to_jimages)
+        self.bond_lengths = np.linalg.norm(edge_vectors, axis=1)
+
+        # same definition as graph.get_coordination_of_site(), where a
+        # bond from a site to its own periodic image counts once
+        self.coordination = (
+            np.bincount(from_sites, minlength=num_sites)
+            + np.bincount(to_sites, minlength=num_sites)
+            - np.bincount(from_sites[from_sites == to_sites], minlength=num_sites)
+        )
+
+        # bonds are undirected, so every edge gives a neighbor of both sites,
+        # any duplicates (same neighbor and image) are only counted once
+        sites = np.concatenate([from_sites, to_sites])
+        neighbors = np.concatenate([to_sites, from_sites])
+        jimages = np.concatenate([to_jimages, -to_jimages])
+        vectors = np.concatenate([edge_vectors, -edge_vectors])
+        _, unique = np.unique(
+            np.column_stack([sites, neighbors, jimages]), axis=0, return_index=True
+        )
+        distances = np.linalg.norm(vectors[unique], axis=1)
+        order = unique[np.lexsort((distances, sites[unique]))]
+
+        self.neighbor_indices = neighbors[order]
+        self.neighbor_jimages = jimages[order]
+        self.neighbor_vectors = vectors[order]
+        self.offsets = np.searchsorted(sites[order], np.arange(num_sites + 1))
+
+    @staticmethod
+    def _get_edge_arrays(graph):
+        edges = list(graph.graph.edges(data="to_jimage"))
+        if not edges:
+            return np.zeros(0, dtype=int), np.zeros(0, dtype=int), np.zeros((0, 3), dtype=int)
+        from_sites, to_sites, to_jimages = zip(*edges)
+        to_jimages = [jimage or (0, 0, 0) for jimage in to_jimages]
+        return (
+            np.array(from_sites, dtype=int),
+            np.array(to_sites, dtype=int),
+            np.array(to_jimages, dtype=int).reshape(-1, 3),
+        )
+
+    @staticmethod
+    def get_revision(graph: Union[StructureGraph, MoleculeGraph]) -> str:
+        """
+        A fingerprint of everything the neighbor list depends on: site
+        co-ordinates, lattice and bonds.
+
+        :param graph: StructureGraph or MoleculeGraph
+        :return: hash as a hex string
+        """
+
+        if isinstance(graph, StructureGraph):
+            struct_or_mol = graph.structure
+            lattice_matrix = struct_or_mol.lattice.matrix
+        else:
+            struct_or_mol = graph.molecule
+            lattice_matrix = np.zeros((3, 3))
+
+        fingerprint = md5(np.ascontiguousarray(struct_or_mol.cart_coords).tobytes())
+        fingerprint.update(np.ascontiguousarray(lattice_matrix).tobytes())
+        for edge_array in NeighborList._get_edge_arrays(graph):
+            fingerprint.update(np.ascontiguousarray(edge_array).tobytes())
+
+        return fingerprint.hexdigest()
+
+    @classmethod
+    def from_graph(cls, graph: Union[StructureGraph, MoleculeGraph]):
+        """
+        Retrieve the neighbor list for a graph, only computing it if a
+        neighbor list for the same structure revision isn't cached already.
+
+        :param graph: StructureGraph or MoleculeGraph
+        :return: NeighborList
+        """
+
+        return cls._cache.get_or_compute(cls.get_revision(graph), lambda: cls(graph))
+
+    def get_neighbors(self, idx):
+        """
+        :param idx: site index
+        :return: tuple of arrays of neighbor indices, their images relative to
+        the site and the Cartesian vectors from the site to each neighbor
+        """
+        start, end = self.offsets[idx], self.offsets[idx + 1]
+        return (
+            self.neighbor_indices[start:end],
+            self.neighbor_jimages[start:end],
+            self.neighbor_vectors[start:end],
+        )
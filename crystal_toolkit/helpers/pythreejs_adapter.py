@@ -3,9 +3,10 @@ Link up the StructureMoleculeComponent objects to pythreejs
 Also includes some helper functions for draw addition objects using pythreejs
 """
 
-from pythreejs import MeshLambertMaterial, Mesh, SphereBufferGeometry, CylinderBufferGeometry, Object3D, LineSegments2, LineSegmentsGeometry, LineMaterial, Scene, AmbientLight, PerspectiveCamera, Renderer, OrbitControls
+from pythreejs import MeshLambertMaterial, Mesh, SphereBufferGeometry, CylinderBufferGeometry, BufferGeometry, BufferAttribute, Object3D, LineSegments2, LineSegmentsGeometry, LineMaterial, Scene, AmbientLight, PerspectiveCamera, Renderer, OrbitControls
 from crystal_toolkit.components.structure import StructureMoleculeComponent
 from IPython.display import display
+from scipy.spatial import ConvexHull
 from scipy.spatial.transform import Rotation as R
 import numpy as np
 
@@ -14,30 +15,43 @@ ball = Mesh(
     material=MeshLambertMaterial(color='red'),
     position=[0, 1, 0])
 
-def traverse_scene_object(scene_data, parent=None):
+# sizes to use for instances without a radius (or width), the same as for
+# individual objects, see _get_cylinder_from_vec
+DEFAULT_SCALES = {'spheres': 1., 'cubes': 1., 'cylinders': 0.15, 'arrows': 0.15}
+
+# size of arrow heads without a headLength or headWidth, relative to the
+# arrow radius
+DEFAULT_HEAD_LENGTH = 3.
+DEFAULT_HEAD_WIDTH = 2.
+
+def traverse_scene_object(scene_data, parent=None, tessellation=None):
     """
     Recursivesly populate a scene object with tree of children
-    :param scene_data:
+    :param scene_data: scene dict, in the format given by Scene.to_json() or
+    Scene.to_instanced_json()
     :param parent:
+    :param tessellation: number of segments to use for instanced spheres and
+    cylinders, see _get_tessellation
     :return:
     """
+    if parent is None:
+        parent = Object3D(name=scene_data["name"])
     for sub_object in scene_data["contents"]:
         if "type" in sub_object.keys():
-            parent.add(convert_object_to_pythreejs(sub_object))
+            parent.add(convert_object_to_pythreejs(sub_object, tessellation=tessellation))
         else:
             new_parent = Object3D(name=sub_object["name"])
-            if parent is None:
-                parent = new_parent
-            else:
-                parent.add(new_parent)
-            traverse_scene_object(sub_object, parent)
+            parent.add(new_parent)
+            traverse_scene_object(sub_object, new_parent, tessellation=tessellation)
     return parent
 
-def convert_object_to_pythreejs(object):
+def convert_object_to_pythreejs(object, tessellation=None):
     """
     Cases for the conversion
     :return:
     """
+    if object.get('instanced'):
+        return _convert_batch_to_pythreejs(object, tessellation=tessellation)
     obs = []
     if object['type']=='spheres':
         for ipos in object['positions']:
@@ -57,13 +71,108 @@ def convert_object_to_pythreejs(object):
             obs.append(obj3d)
     return obs
 
+def _convert_batch_to_pythreejs(batch, tessellation=None):
+    """
+    Convert a batch of instances, as given by Scene.to_instanced_json(), to
+    pythreejs objects. Every batch is merged into a single mesh with vertex
+    colors, transformed in a vectorized way, so that the number of widgets
+    does not scale with the number of atoms.
+    :param batch: dict for an instanced batch
+    :param tessellation: number of segments to use for spheres and cylinders,
+    see _get_tessellation
+    :return: list of pythreejs objects
+    """
+    obs = []
+    colors = batch['colors']
+    tessellation = tessellation or _get_tessellation(0)
+
+    if batch['type'] in ('spheres', 'cubes', 'cylinders', 'arrows'):
+
+        default_scale = DEFAULT_SCALES[batch['type']]
+        sizes = np.array(
+            [default_scale if scale is None else scale for scale in batch['scales']],
+            dtype=float)
+        rgb = _colors_to_rgb(colors, '#ffffff')
+        meshes = []
+
+        if batch['type'] in ('spheres', 'cubes'):
+            if batch['type'] == 'spheres':
+                template = _get_unit_sphere(
+                    tessellation['widthSegments'], tessellation['heightSegments'])
+            else:
+                template = _get_unit_cube()
+            positions = np.array(batch['positions'], dtype=float).reshape(-1, 3)
+            scales = np.repeat(sizes[:, None], 3, axis=1)
+            meshes.append((template, positions, scales, None))
+        else:
+            pairs = np.array(batch['positionPairs'], dtype=float).reshape(-1, 2, 3)
+            if batch['type'] == 'arrows':
+                pairs, head_pairs, head_widths = _get_arrow_heads(
+                    pairs, sizes, batch.get('headLength'), batch.get('headWidth'))
+                positions, scales, quaternions = _get_cylinder_transforms(
+                    head_pairs, head_widths)
+                meshes.append((
+                    _get_unit_cone(tessellation['radialSegments']),
+                    positions, scales, _quaternions_to_matrices(quaternions)))
+            positions, scales, quaternions = _get_cylinder_transforms(pairs, sizes)
+            meshes.append((
+                _get_unit_cylinder(tessellation['radialSegments']),
+                positions, scales, _quaternions_to_matrices(quaternions)))
+
+        for template, positions, scales, rotations in meshes:
+            if len(positions):
+                obs.append(Mesh(
+                    geometry=_get_merged_geometry(
+                        template, positions, scales, rotations, rgb),
+                    material=MeshLambertMaterial(vertexColors='VertexColors')))
+
+    elif batch['type'] == 'lines':
+        pairs = np.array(batch['positions'], dtype=float).reshape(-1, 2, 3)
+        vertex_colors = np.repeat(_colors_to_rgb(colors, '#000000')[:, None], 2, axis=1)
+        obs.append(LineSegments2(
+            LineSegmentsGeometry(positions=pairs, colors=vertex_colors),
+            LineMaterial(linewidth=batch.get('lineWidth', 3), vertexColors='VertexColors')))
+
+    elif batch['type'] in ('surface', 'convex'):
+        if batch['type'] == 'surface':
+            triangles = np.array(batch['positions'], dtype=float).reshape(-1, 3, 3)
+            triangle_colors = _colors_to_rgb(colors, '#ffffff')
+        else:
+            hulls = [np.array(points, dtype=float) for points in batch['positions']]
+            hull_triangles = [points[ConvexHull(points).simplices] for points in hulls]
+            triangles = np.concatenate(hull_triangles).reshape(-1, 3, 3)
+            triangle_colors = np.repeat(
+                _colors_to_rgb(colors, '#ffffff'),
+                [len(t) for t in hull_triangles], axis=0)
+        vertex_colors = np.repeat(triangle_colors[:, None], 3, axis=1)
+        attributes = {
+            'position': BufferAttribute(array=triangles.reshape(-1, 3).astype(np.float32)),
+            'color': BufferAttribute(array=vertex_colors.reshape(-1, 3).astype(np.float32)),
+        }
+        if 'normals' in batch:
+            attributes['normal'] = BufferAttribute(
+                array=np.array(batch['normals'], dtype=np.float32).reshape(-1, 3))
+        geometry = BufferGeometry(attributes=attributes)
+        if 'normals' not in batch:
+            geometry.exec_three_obj_method('computeVertexNormals')
+        opacity = batch.get('opacity', 1)
+        obs.append(Mesh(
+            geometry=geometry,
+            material=MeshLambertMaterial(
+                vertexColors='VertexColors', side='DoubleSide',
+                opacity=opacity, transparent=opacity < 1)))
+
+    return obs
+
 def get_scene(structure):
     """
     :param structure:
     """
 
     smc = StructureMoleculeComponent(structure, bonded_sites_outside_unit_cell=False, hide_incomplete_bonds=False)
-    obs = traverse_scene_object(smc.initial_scene_data)
+    obs = traverse_scene_object(
+        smc.initial_scene.to_instanced_json(),
+        tessellation=_get_tessellation(len(structure)))
 
     scene = Scene(children=[
         obs,
@@ -81,6 +190,231 @@ def get_scene(structure):
     display(renderer)
 
 
+def _get_tessellation(num_atoms):
+    """
+    Number of segments to use for spheres and cylinders: coarser for larger
+    structures, so that the size of the merged geometry stays manageable.
+    :param num_atoms: number of atoms in the structure
+    :return: dict of widthSegments, heightSegments (for spheres) and
+    radialSegments (for cylinders)
+    """
+    if num_atoms <= 100:
+        width_segments, height_segments, radial_segments = 32, 16, 12
+    elif num_atoms <= 1000:
+        width_segments, height_segments, radial_segments = 16, 8, 8
+    elif num_atoms <= 10000:
+        width_segments, height_segments, radial_segments = 10, 6, 6
+    else:
+        width_segments, height_segments, radial_segments = 6, 4, 4
+    return {
+        'widthSegments': width_segments,
+        'heightSegments': height_segments,
+        'radialSegments': radial_segments,
+    }
+
+def _get_unit_sphere(width_segments, height_segments):
+    """
+    Vertices, normals and faces of a sphere of radius 1 at the origin, using
+    the same layout as three.js SphereBufferGeometry.
+    :return: tuple of arrays of vertices, normals and faces
+    """
+    theta, phi = np.meshgrid(
+        np.linspace(0, np.pi, height_segments + 1),
+        np.linspace(0, 2 * np.pi, width_segments + 1),
+        indexing='ij')
+    vertices = np.stack([
+        -np.cos(phi) * np.sin(theta),
+        np.cos(theta),
+        np.sin(phi) * np.sin(theta)], axis=-1).reshape(-1, 3)
+    iy, ix = np.meshgrid(
+        np.arange(height_segments), np.arange(width_segments), indexing='ij')
+    b = iy * (width_segments + 1) + ix
+    a = b + 1
+    c = b + width_segments + 1
+    d = c + 1
+    # the top and bottom rows of quads are degenerate, one triangle each
+    faces = np.concatenate([
+        np.stack([a, b, d], axis=-1)[1:].reshape(-1, 3),
+        np.stack([b, c, d], axis=-1)[:-1].reshape(-1, 3)])
+    return vertices, vertices, faces
+
+def _get_unit_cylinder(radial_segments):
+    """
+    Vertices, normals and faces of an open-ended cylinder of radius 1 and
+    height 1, centered at the origin along y.
+    :return: tuple of arrays of vertices, normals and faces
+    """
+    angles = np.linspace(0, 2 * np.pi, radial_segments + 1)
+    normals = np.column_stack(
+        [np.sin(angles), np.zeros(len(angles)), np.cos(angles)])
+    vertices = np.concatenate([normals + [0, 0.5, 0], normals - [0, 0.5, 0]])
+    a = np.arange(radial_segments)
+    b = a + radial_segments + 1
+    faces = np.concatenate([
+        np.column_stack([a, b, a + 1]),
+        np.column_stack([b, b + 1, a + 1])])
+    return vertices, np.concatenate([normals, normals]), faces
+
+def _get_unit_cone(radial_segments):
+    """
+    Vertices, normals and faces of a closed cone of radius 1 and height 1,
+    centered at the origin along y with its tip at y = 0.5, the same as
+    three.js ConeBufferGeometry.
+    :return: tuple of arrays of vertices, normals and faces
+    """
+    angles = np.linspace(0, 2 * np.pi, radial_segments + 1)
+    ring = np.column_stack(
+        [np.sin(angles), np.full(len(angles), -0.5), np.cos(angles)])
+    # every side face has its own tip vertex, with the normal half-way
+    # between those of its base vertices
+    tip_angles = angles + np.pi / radial_segments
+    tip_normals = np.column_stack(
+        [np.sin(tip_angles), np.ones(len(angles)), np.cos(tip_angles)]) / np.sqrt(2)
+    side_normals = np.column_stack(
+        [np.sin(angles), np.ones(len(angles)), np.cos(angles)]) / np.sqrt(2)
+    vertices = np.concatenate([
+        np.tile([0, 0.5, 0], (len(angles), 1)), ring, ring, [[0, -0.5, 0]]])
+    normals = np.concatenate([
+        tip_normals, side_normals, np.tile([0, -1, 0], (len(angles) + 1, 1))])
+    a = np.arange(radial_segments)
+    b = a + radial_segments + 1
+    c = b + radial_segments + 1
+    center = np.full(radial_segments, 3 * (radial_segments + 1))
+    faces = np.concatenate([
+        np.column_stack([a, b, b + 1]),
+        np.column_stack([center, c + 1, c])])
+    return vertices, normals, faces
+
+def _get_unit_cube():
+    """
+    Vertices, normals and faces of a cube of width 1 centered at the origin.
+    :return: tuple of arrays of vertices, normals and faces
+    """
+    vertices, normals, faces = [], [], []
+    for axis in range(3):
+        for sign in (1, -1):
+            normal = sign * np.eye(3)[axis]
+            u, v = np.eye(3)[(axis + 1) % 3], np.eye(3)[(axis + 2) % 3]
+            if sign < 0:
+                u, v = v, u
+            start = len(vertices)
+            vertices += [0.5 * (normal + su * u + sv * v)
+                         for su, sv in ((-1, -1), (1, -1), (1, 1), (-1, 1))]
+            normals += [normal] * 4
+            faces += [[start, start + 1, start + 2], [start, start + 2, start + 3]]
+    return np.array(vertices), np.array(normals), np.array(faces)
+
+def _quaternions_to_matrices(quaternions):
+    """
+    :param quaternions: array of unit quaternions, shape (n, 4, in x, y, z, w
+    order)
+    :return: array of rotation matrices, shape (n, 3, 3)
+    """
+    x, y, z, w = quaternions.T
+    return np.stack([
+        np.stack([1 - 2 * (y * y + z * z), 2 * (x * y - z * w), 2 * (x * z + y * w)], axis=-1),
+        np.stack([2 * (x * y + z * w), 1 - 2 * (x * x + z * z), 2 * (y * z - x * w)], axis=-1),
+        np.stack([2 * (x * z - y * w), 2 * (y * z + x * w), 1 - 2 * (x * x + y * y)], axis=-1),
+    ], axis=1)
+
+def _get_merged_geometry(template, positions, scales, rotations, colors):
+    """
+    Merge many transformed copies of a template mesh into a single indexed
+    BufferGeometry with vertex colors.
+    :param template: tuple of arrays of vertices, normals and faces
+    :param positions: array of positions, shape (n, 3)
+    :param scales: array of scales along x, y and z, shape (n, 3)
+    :param rotations: array of rotation matrices, shape (n, 3, 3), or None
+    :param colors: array of RGB colors, shape (n, 3)
+    :return: BufferGeometry
+    """
+    vertices, normals, faces = template
+    num_vertices = len(vertices)
+
+    instance_vertices = vertices[None, :, :] * scales[:, None, :]
+    # normals transform with the inverse scale
+    instance_normals = normals[None, :, :] / scales[:, None, :]
+    instance_normals /= np.linalg.norm(instance_normals, axis=2)[:, :, None]
+    if rotations is not None:
+        instance_vertices = np.einsum('nij,nvj->nvi', rotations, instance_vertices)
+        instance_normals = np.einsum('nij,nvj->nvi', rotations, instance_normals)
+    instance_vertices += positions[:, None, :]
+
+    index = faces[None, :, :] + (np.arange(len(positions)) * num_vertices)[:, None, None]
+    vertex_colors = np.repeat(colors[:, None, :], num_vertices, axis=1)
+
+    return BufferGeometry(
+        index=BufferAttribute(array=index.reshape(-1).astype(np.uint32)),
+        attributes={
+            'position': BufferAttribute(array=instance_vertices.reshape(-1, 3).astype(np.float32)),
+            'normal': BufferAttribute(array=instance_normals.reshape(-1, 3).astype(np.float32)),
+            'color': BufferAttribute(array=vertex_colors.reshape(-1, 3).astype(np.float32)),
+        })
+
+def _colors_to_rgb(colors, default):
+    """
+    :param colors: list of hexadecimal color strings, or None for the default
+    :param default: default hexadecimal color string
+    :return: array of RGB values between 0 and 1, one row per color
+    """
+    rgb = {}
+    for color in set(colors):
+        hex_color = (color or default).lstrip('#')
+        if len(hex_color) == 3:
+            hex_color = ''.join(c * 2 for c in hex_color)
+        rgb[color] = [int(hex_color[i:i + 2], 16) / 255 for i in (0, 2, 4)]
+    return np.array([rgb[color] for color in colors], dtype=float).reshape(-1, 3)
+
+def _get_cylinder_transforms(position_pairs, radii):
+    """
+    Vectorized transforms to map a unit cylinder (along y, centered at the
+    origin) onto a set of cylinders.
+    :param position_pairs: array of start and end positions, shape (n, 2, 3)
+    :param radii: array of radii, shape (n,)
+    :return: positions (n, 3), scales (n, 3) and quaternions (n, 4, in x, y, z,
+    w order)
+    """
+    vecs = position_pairs[:, 1] - position_pairs[:, 0]
+    lengths = np.linalg.norm(vecs, axis=1)
+    units = vecs / np.where(lengths > 0, lengths, 1)[:, None]
+    # quaternion for the shortest rotation from y onto each unit vector
+    quaternions = np.column_stack([units[:, 2], np.zeros(len(units)), -units[:, 0], 1 + units[:, 1]])
+    # for a rotation by pi (pointing along -y), rotate around x instead
+    antiparallel = quaternions[:, 3] < 1e-8
+    quaternions[antiparallel] = [1., 0., 0., 0.]
+    quaternions /= np.linalg.norm(quaternions, axis=1)[:, None]
+    positions = position_pairs.mean(axis=1)
+    scales = np.column_stack([radii, lengths, radii])
+    return positions, scales, quaternions
+
+def _get_arrow_heads(position_pairs, radii, head_length=None, head_width=None):
+    """
+    Split arrows into their bodies and heads: the head is a cone of length
+    head_length and radius head_width that ends at the end of the arrow, and
+    the body is the cylinder up to the base of the head.
+    :param position_pairs: array of start and end positions, shape (n, 2, 3)
+    :param radii: array of radii of the arrow bodies, shape (n,)
+    :param head_length: length of the heads, or None for a default relative to
+    the radius
+    :param head_width: radius of the heads, or None for a default relative to
+    the radius
+    :return: body start and end positions (n, 2, 3), head base and tip
+    positions (n, 2, 3) and head radii (n,)
+    """
+    head_lengths = radii * DEFAULT_HEAD_LENGTH if head_length is None \
+        else np.full(len(radii), head_length, dtype=float)
+    head_widths = radii * DEFAULT_HEAD_WIDTH if head_width is None \
+        else np.full(len(radii), head_width, dtype=float)
+    vecs = position_pairs[:, 1] - position_pairs[:, 0]
+    lengths = np.linalg.norm(vecs, axis=1)
+    # heads longer than the arrow take up the whole arrow
+    head_fractions = np.minimum(
+        head_lengths / np.where(lengths > 0, lengths, 1), 1)
+    bases = position_pairs[:, 1] - vecs * head_fractions[:, None]
+    body_pairs = np.stack([position_pairs[:, 0], bases], axis=1)
+    head_pairs = np.stack([bases, position_pairs[:, 1]], axis=1)
+    return body_pairs, head_pairs, head_widths
+
 def _get_line_from_vec(v0, v1):
     line = LineSegments2(LineSegmentsGeometry(
         positions=[
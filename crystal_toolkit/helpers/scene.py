@@ -1,8 +1,15 @@
-from dataclasses import dataclass, field, asdict
+from dataclasses import dataclass, field, fields, replace
 from typing import List, Optional, Dict, Any
 from itertools import chain
 from collections import defaultdict
 from warnings import warn
+from hashlib import md5
+
+import base64
+import gzip
+import json
+
+import numpy as np
 
 """
 This module gives a Python interface to generate JSON for the
@@ -10,8 +17,19 @@ Simple3DSceneComponent. To use, create a Scene whose contents can either be a
 a list of any of the geometric primitives defined below (e.g. Spheres,
 Cylinders, etc.) or can be another Scene. Then use scene_to_json() to convert
 the Scene to the JSON format to pass to Simple3DSceneComponent's data attribute.
+
+For large scenes, Scene.to_packed_json() gives a more compact alternative
+format, where arrays of positions are stored as base64-encoded binary buffers.
+
+To update a scene that has already been rendered, diff_scenes() gives a patch
+containing only the sub-scenes that changed, which can be applied to the
+previous scene JSON with apply_scene_patch().
 """
 
+# fields of primitives that contain (nested) lists of vectors, these are
+# stored as binary buffers in the packed scene format
+PACKED_ARRAY_FIELDS = ("positions", "positionPairs", "normals")
+
 
 @dataclass
 class Scene:
@@ -38,120 +56,499 @@ class Scene:
         :return: dict in a format that can be parsed by Simple3DSceneComponent
         """
 
-        merged_scene = Scene(
-            name=self.name, contents=self.merge_primitives(self.contents)
-        )
+        return _to_dict(self, merge=True)
+
+    def to_instanced_json(self):
+        """
+        Convert a Scene into an instancing-oriented format, intended for
+        renderers that can draw many copies of the same geometry at once.
+        This is the same as the format given by to_json() except that, within
+        each (sub-)scene, all primitives of the same type that share the same
+        attributes other than color and size are grouped into a single batch,
+        so that the number of draw calls scales with the number of primitive
+        types rather than with the number of atoms. See INSTANCED_FIELDS.
+
+        Each batch is a dict with "type" and "instanced": True, the
+        concatenated geometry field of its primitives (e.g. "positions"),
+        any shared attributes, a "colors" list with one color per instance
+        (None for the default color) and, for types with a size, a "scales"
+        list with one radius or width per instance (None if not set, for the
+        renderer's default size).
+
+        An instance is a single sphere, cube, cylinder or arrow, a single line
+        segment (pair of positions), a single surface triangle or a single
+        convex hull (list of positions). Spheres with ellipsoids and Labels
+        are not batched.
+
+        :return: dict in instanced scene format
+        """
+
+        return _to_instanced_dict(self)
 
-        def remove_defaults(scene_dict):
-            trimmed_dict = {}
-            for k, v in scene_dict.items():
-                if isinstance(v, dict):
-                    v = remove_defaults(v)
-                elif isinstance(v, list):
-                    trimmed_dict[k] = [
-                        remove_defaults(item) if isinstance(item, dict) else item
-                        for item in v
-                    ]
-                elif v is not None:
-                    trimmed_dict[k] = v
-            return trimmed_dict
-
-        return remove_defaults(asdict(merged_scene))
+    def to_packed_json(self, quantize=False, compress=True):
+        """
+        Convert a Scene into a compact "packed" JSON format, intended for
+        large scenes. This is the same as the format given by to_json() except:
+
+        * array fields ("positions", "positionPairs", "normals") are stored as
+          flat little-endian float32 buffers, base64-encoded, see
+          encode_array()
+        * colors are stored as an integer index into a "palette" list given
+          at the top level of the scene
+
+        The packed scene can be converted back using Scene.unpack_json().
+        Buffers are packed directly from the positions of the (merged)
+        primitives, without going through to_json().
+
+        Simple3DSceneComponent does not read this format yet, so it is only
+        for use from Python for now (e.g. to store or transfer large scenes),
+        and the app itself still uses to_json().
+
+        :param quantize: if True, positions are quantized to 16-bit integers
+        relative to their bounding box, halving their size again (precision
+        is better than 0.01% of the bounding box size)
+        :param compress: if True, buffers are additionally gzip-compressed
+        :return: dict in packed scene format
+        """
+
+        palette = {}
+
+        def pack_primitive(packed):
+            for k in PACKED_ARRAY_FIELDS:
+                if k in packed:
+                    packed[k] = encode_array(
+                        packed[k], quantize=quantize, compress=compress
+                    )
+            if "color" in packed:
+                packed["color"] = palette.setdefault(packed["color"], len(palette))
+            return packed
+
+        def pack_group(group, field, shape):
+            if len(group) == 1 and not getattr(group[0], "ellipsoids", None):
+                return pack_primitive(_to_dict(group[0]))
+            # same as the merged primitive given by merge_primitives
+            packed = _to_dict(group[0])
+            # flatten the nested lists of positions straight into a buffer
+            values = (getattr(primitive, field) for primitive in group)
+            for _ in shape:
+                values = chain.from_iterable(values)
+            packed[field] = np.fromiter(values, dtype=np.float32).reshape(shape)
+            return pack_primitive(packed)
+
+        def pack(scene):
+            sphere_groups, cylinder_groups, remainder = Scene._group_primitives(
+                scene.contents
+            )
+            contents = (
+                [pack_group(group, "positions", (-1, 3)) for group in sphere_groups]
+                + [
+                    pack_group(group, "positionPairs", (-1, 2, 3))
+                    for group in cylinder_groups
+                ]
+                + [
+                    pack(item) if isinstance(item, Scene) else pack_primitive(_to_dict(item))
+                    for item in remainder
+                ]
+            )
+            return {"name": scene.name, "contents": contents}
+
+        packed_scene = pack(self)
+        packed_scene["format"] = "packed"
+        packed_scene["palette"] = list(palette.keys())
+
+        return packed_scene
 
     @staticmethod
-    def merge_primitives(primitives):
+    def unpack_json(packed_scene):
         """
-        If primitives are of the same type but differ only in position, they
-        are merged together. This is a small optimization, has not been benchmarked.
+        Convert a scene in the packed format given by Scene.to_packed_json()
+        back into the format given by Scene.to_json().
+
+        :param packed_scene: dict in packed scene format
+        :return: dict in a format that can be parsed by Simple3DSceneComponent
+        """
+
+        palette = packed_scene["palette"]
+
+        def unpack(packed):
+            scene_dict = dict(packed)
+            if "contents" in scene_dict:
+                scene_dict["contents"] = [unpack(item) for item in scene_dict["contents"]]
+            for k in PACKED_ARRAY_FIELDS:
+                if k in scene_dict:
+                    scene_dict[k] = decode_array(scene_dict[k]).tolist()
+            if "color" in scene_dict:
+                scene_dict["color"] = palette[scene_dict["color"]]
+            return scene_dict
+
+        scene_json = unpack(packed_scene)
+        scene_json.pop("format")
+        scene_json.pop("palette")
+
+        return scene_json
+
+    @staticmethod
+    def _group_primitives(primitives):
+        """
+        Group primitives that can be merged, see merge_primitives.
         :param primitives: list of primitives (Spheres, Cylinders, etc.)
-        :return: list of primitives
+        :return: tuple of a list of groups of Spheres, a list of groups of
+        Cylinders and a list of all other primitives (including Scenes)
         """
         spheres = defaultdict(list)
         cylinders = defaultdict(list)
         remainder = []
 
         for primitive in primitives:
-            if isinstance(primitive, Scene):
-                primitive.contents = Scene.merge_primitives(primitive.contents)
-                remainder.append(primitive)
-            elif isinstance(primitive, Spheres):
-                key = f"{primitive.color}_{primitive.radius}_{primitive.phiStart}_{primitive.phiEnd}"
+            primitive_type = type(primitive)
+            if primitive_type is Spheres:
+                key = (
+                    primitive.color,
+                    primitive.radius,
+                    primitive.phiStart,
+                    primitive.phiEnd,
+                )
                 spheres[key].append(primitive)
-            elif isinstance(primitive, Cylinders):
-                key = f"{primitive.color}_{primitive.radius}"
-                cylinders[key].append(primitive)
+            elif primitive_type is Cylinders:
+                cylinders[(primitive.color, primitive.radius)].append(primitive)
             else:
                 remainder.append(primitive)
 
+        return list(spheres.values()), list(cylinders.values()), remainder
+
+    @staticmethod
+    def merge_primitives(primitives):
+        """
+        If primitives are of the same type but differ only in position, they
+        are merged together. Nested Scenes are merged recursively, and returned
+        as new Scene objects: the input primitives are never modified, and
+        lists of positions are not copied.
+        :param primitives: list of primitives (Spheres, Cylinders, etc.)
+        :return: list of primitives
+        """
+        spheres, cylinders, remainder = Scene._group_primitives(primitives)
+
+        remainder = [
+            replace(primitive, contents=Scene.merge_primitives(primitive.contents))
+            if isinstance(primitive, Scene)
+            else primitive
+            for primitive in remainder
+        ]
+
         new_spheres = []
-        for key, sphere_list in spheres.items():
-            new_positions = list(
-                chain.from_iterable([sphere.positions for sphere in sphere_list])
-            )
-            new_ellipsoids = None
-            has_ellipsoids = any(
-                [
-                    sphere.ellipsoids["rotations"] if sphere.ellipsoids else None
-                    for sphere in sphere_list
-                ]
-            )
-            if has_ellipsoids:
+        for sphere_list in spheres:
+            if len(sphere_list) == 1 and not sphere_list[0].ellipsoids:
+                new_spheres.append(sphere_list[0])
+                continue
+            if any(
+                sphere.ellipsoids and sphere.ellipsoids.get("rotations")
+                for sphere in sphere_list
+            ):
                 warn("Merging of ellipsoids doesn't work yet.")
                 # TODO: should re-think how ellipsoids are stored, dict format is awkward
-            # new_ellipsoids_rotations = list(
-            #    chain.from_iterable(
-            #        [
-            #            sphere.ellipsoids["rotations"] if sphere.ellipsoids else None
-            #            for sphere in sphere_list
-            #        ]
-            #    )
-            # )
-            # new_ellipsoids_scales = list(
-            #    chain.from_iterable(
-            #        [
-            #            sphere.ellipsoids["scales"] if sphere.ellipsoids else None
-            #            for sphere in sphere_list
-            #        ]
-            #    )
-            # )
-            # if any(new_ellipsoids_rotations):
-            #    new_ellipsoids = {
-            #        "rotations": new_ellipsoids_rotations,
-            #        "scales": new_ellipsoids_scales,
-            #    }
-            # else:
-            #    new_ellipsoids = None
+            first = sphere_list[0]
             new_spheres.append(
                 Spheres(
-                    positions=new_positions,
-                    color=sphere_list[0].color,
-                    radius=sphere_list[0].radius,
-                    phiStart=sphere_list[0].phiStart,
-                    phiEnd=sphere_list[0].phiEnd,
-                    ellipsoids=new_ellipsoids,
-                    visible=sphere_list[0].visible,
+                    positions=list(
+                        chain.from_iterable(
+                            sphere.positions for sphere in sphere_list
+                        )
+                    ),
+                    color=first.color,
+                    radius=first.radius,
+                    phiStart=first.phiStart,
+                    phiEnd=first.phiEnd,
+                    visible=first.visible,
                 )
             )
 
         new_cylinders = []
-        for key, cylinder_list in cylinders.items():
-            new_positionPairs = list(
-                chain.from_iterable(
-                    [cylinder.positionPairs for cylinder in cylinder_list]
-                )
-            )
+        for cylinder_list in cylinders:
+            if len(cylinder_list) == 1:
+                new_cylinders.append(cylinder_list[0])
+                continue
+            first = cylinder_list[0]
             new_cylinders.append(
                 Cylinders(
-                    positionPairs=new_positionPairs,
-                    color=cylinder_list[0].color,
-                    radius=cylinder_list[0].radius,
-                    visible=cylinder_list[0].visible,
+                    positionPairs=list(
+                        chain.from_iterable(
+                            cylinder.positionPairs for cylinder in cylinder_list
+                        )
+                    ),
+                    color=first.color,
+                    radius=first.radius,
+                    visible=first.visible,
                 )
             )
 
         return new_spheres + new_cylinders + remainder
 
 
+_field_names = {}
+
+
+def _get_field_names(cls):
+    """
+    Field names of a scene dataclass to include in its JSON, cached per class
+    since dataclasses.fields() is comparatively slow. The private _meta field
+    is for use from Python only and is not included.
+    """
+    try:
+        return _field_names[cls]
+    except KeyError:
+        names = tuple(f.name for f in fields(cls) if f.name != "_meta")
+        _field_names[cls] = names
+        return names
+
+
+def _to_dict(primitive, merge=False):
+    """
+    Convert a Scene or primitive into a dict in a single pass, omitting any
+    None values (which signify that the default value should be used).
+    Unlike dataclasses.asdict, no data is copied: values such as lists of
+    positions are passed through by reference.
+
+    Dict-valued fields are omitted too, as they always have been: in
+    particular Spheres.ellipsoids, which Simple3DSceneComponent does not
+    support yet, and which merge_primitives cannot merge.
+
+    :param primitive: Scene or primitive
+    :param merge: if True, merge the contents of the Scene first
+    :return: dict
+    """
+
+    if isinstance(primitive, Scene):
+        contents = primitive.contents
+        if merge:
+            contents = Scene.merge_primitives(contents)
+        return {
+            "name": primitive.name,
+            "contents": [_to_dict(item) for item in contents],
+        }
+
+    primitive_dict = {}
+    for name in _get_field_names(type(primitive)):
+        value = getattr(primitive, name)
+        if value is not None and not isinstance(value, dict):
+            primitive_dict[name] = value
+    return primitive_dict
+
+
+def _hash_scene_json(scene_json):
+    """
+    Compute content hashes for a scene in the JSON format given by
+    Scene.to_json(), and the keys used to identify its contents in a patch.
+
+    Sub-scenes are identified by name (with a "#n" suffix if the name is
+    repeated within the same parent), primitives by their content hash
+    (prefixed by "~"), so a modified primitive is treated as a removal and an
+    addition.
+
+    :param scene_json: scene dict
+    :return: tuple of the hash of the scene and a list of (key, hash, item,
+    children) tuples for each item in its contents, where children is the
+    equivalent list for sub-scenes and None for primitives
+    """
+
+    scene_hash = md5(json.dumps(scene_json.get("name")).encode())
+    children = []
+    key_counts = defaultdict(int)
+
+    for item in scene_json.get("contents", []):
+        if "type" in item:
+            item_hash = md5(json.dumps(item, sort_keys=True).encode()).hexdigest()
+            item_children = None
+            key = f"~{item_hash}"
+        else:
+            item_hash, item_children = _hash_scene_json(item)
+            key = item["name"]
+        key_counts[key] += 1
+        if key_counts[key] > 1:
+            key = f"{key}#{key_counts[key] - 1}"
+        children.append((key, item_hash, item, item_children))
+        scene_hash.update(f"{key}:{item_hash};".encode())
+
+    return scene_hash.hexdigest(), children
+
+
+def get_scene_hash(scene_json):
+    """
+    :param scene_json: scene dict in the format given by Scene.to_json()
+    :return: a hash of the scene contents, two scenes with the same hash will
+    render identically
+    """
+    return _hash_scene_json(scene_json)[0]
+
+
+def diff_scenes(old_scene_json, new_scene_json):
+    """
+    Compute a patch to transform one scene into another, so that only the
+    parts of the scene that changed have to be sent to, and re-built by, the
+    renderer.
+
+    A patch is a dict with the keys:
+
+    * "order": the keys of the contents of the new scene, in order
+    * "added": a dict of key to scene or primitive dict, for new contents
+    * "removed": a list of the keys of contents no longer present
+    * "modified": a dict of key to patch, for sub-scenes that changed
+    * "name": the new name of the scene, only if it changed
+
+    where keys are as described in _hash_scene_json, and "added", "removed"
+    and "modified" are omitted if empty.
+
+    :param old_scene_json: scene dict in the format given by Scene.to_json()
+    :param new_scene_json: scene dict in the format given by Scene.to_json()
+    :return: patch, or None if the scenes are identical
+    """
+
+    def diff(old_tree, new_tree, old_json, new_json):
+
+        old_hash, old_children = old_tree
+        new_hash, new_children = new_tree
+
+        if old_hash == new_hash:
+            return None
+
+        old_by_key = {
+            key: (item_hash, item, item_children)
+            for key, item_hash, item, item_children in old_children
+        }
+        new_keys = {key for key, _, _, _ in new_children}
+
+        added = {}
+        modified = {}
+        for key, item_hash, item, item_children in new_children:
+            if key not in old_by_key:
+                added[key] = item
+            elif old_by_key[key][0] != item_hash:
+                old_item_hash, old_item, old_item_children = old_by_key[key]
+                modified[key] = diff(
+                    (old_item_hash, old_item_children),
+                    (item_hash, item_children),
+                    old_item,
+                    item,
+                )
+
+        patch = {"order": [key for key, _, _, _ in new_children]}
+        if added:
+            patch["added"] = added
+        removed = [key for key in old_by_key if key not in new_keys]
+        if removed:
+            patch["removed"] = removed
+        if modified:
+            patch["modified"] = modified
+        if old_json.get("name") != new_json.get("name"):
+            patch["name"] = new_json.get("name")
+
+        return patch
+
+    return diff(
+        _hash_scene_json(old_scene_json),
+        _hash_scene_json(new_scene_json),
+        old_scene_json,
+        new_scene_json,
+    )
+
+
+def apply_scene_patch(scene_json, patch):
+    """
+    Apply a patch given by diff_scenes(). The input scene is not modified,
+    unchanged contents are shared with the returned scene.
+
+    :param scene_json: scene dict in the format given by Scene.to_json()
+    :param patch: patch given by diff_scenes(), or None
+    :return: patched scene dict
+    """
+
+    if patch is None:
+        return scene_json
+
+    _, children = _hash_scene_json(scene_json)
+    old_by_key = {key: item for key, _, item, _ in children}
+    added = patch.get("added", {})
+    modified = patch.get("modified", {})
+
+    contents = []
+    for key in patch["order"]:
+        if key in added:
+            contents.append(added[key])
+        elif key in modified:
+            contents.append(apply_scene_patch(old_by_key[key], modified[key]))
+        else:
+            contents.append(old_by_key[key])
+
+    patched_scene = dict(scene_json)
+    patched_scene["contents"] = contents
+    if "name" in patch:
+        patched_scene["name"] = patch["name"]
+
+    return patched_scene
+
+
+def encode_array(array, quantize=False, compress=False):
+    """
+    Encode a (nested) list of floats, or a NumPy array, as a flat binary
+    buffer for the packed scene format.
+
+    :param array: array-like of floats
+    :param quantize: if True, values are stored as 16-bit unsigned integers
+    relative to the bounding box of the array (per component along its last
+    axis), otherwise as 32-bit floats
+    :param compress: if True, buffer is gzip-compressed
+    :return: dict with keys "dtype" ("float32" or "uint16"), "shape" and
+    "data" (the base64-encoded buffer), and "compression" ("gzip"), "offset"
+    and "scale" if applicable, where the decoded value is
+    buffer_value * scale + offset
+    """
+
+    array = np.asarray(array, dtype=np.float32)
+    encoded = {"shape": list(array.shape)}
+
+    if quantize and array.size:
+        components = array.reshape(-1, array.shape[-1])
+        offset = components.min(axis=0)
+        scale = (components.max(axis=0) - offset) / np.iinfo(np.uint16).max
+        scale[scale == 0] = 1.0
+        array = np.around((array - offset) / scale).astype("<u2")
+        encoded.update(
+            {"dtype": "uint16", "offset": offset.tolist(), "scale": scale.tolist()}
+        )
+    else:
+        array = array.astype("<f4")
+        encoded["dtype"] = "float32"
+
+    data = array.tobytes()
+    if compress:
+        data = gzip.compress(data)
+        encoded["compression"] = "gzip"
+
+    encoded["data"] = base64.b64encode(data).decode("ascii")
+
+    return encoded
+
+
+def decode_array(encoded):
+    """
+    Decode an array encoded with encode_array.
+
+    :param encoded: dict given by encode_array
+    :return: NumPy array of floats
+    """
+
+    data = base64.b64decode(encoded["data"])
+    if encoded.get("compression") == "gzip":
+        data = gzip.decompress(data)
+
+    dtype = {"float32": "<f4", "uint16": "<u2"}[encoded["dtype"]]
+    array = np.frombuffer(data, dtype=dtype).reshape(encoded["shape"])
+
+    if "scale" in encoded:
+        array = array * np.array(encoded["scale"]) + np.array(encoded["offset"])
+
+    return array.astype(np.float64)
+
+
 @dataclass
 class Spheres:
     """
@@ -319,3 +716,92 @@ class Labels:
     type: str = field(default="labels", init=False)  # private field
     visible: bool = None
     _meta: Any = None
+
+
+# for each type of primitive that can be batched by Scene.to_instanced_json():
+# the field with its geometry, the field with its size (or None) and the
+# fields that have to be the same for all primitives in a batch
+INSTANCED_FIELDS = {
+    Spheres: ("positions", "radius", ("phiStart", "phiEnd", "visible")),
+    Cubes: ("positions", "width", ("visible",)),
+    Cylinders: ("positionPairs", "radius", ("visible",)),
+    Arrows: ("positionPairs", "radius", ("headLength", "headWidth", "visible")),
+    Lines: (
+        "positions",
+        None,
+        ("lineWidth", "scale", "dashSize", "gapSize", "visible"),
+    ),
+    Surface: ("positions", None, ("opacity", "visible")),
+    Convex: ("positions", None, ("opacity", "visible")),
+}
+
+
+def _to_instanced_dict(scene):
+    """
+    Convert a Scene into a dict with its primitives grouped into instanced
+    batches, see Scene.to_instanced_json.
+
+    :param scene: Scene
+    :return: dict
+    """
+
+    contents = []
+    batches = {}
+
+    for primitive in scene.contents:
+
+        primitive_type = type(primitive)
+
+        if isinstance(primitive, Scene):
+            contents.append(_to_instanced_dict(primitive))
+            continue
+        elif primitive_type not in INSTANCED_FIELDS or getattr(
+            primitive, "ellipsoids", None
+        ):
+            contents.append(_to_dict(primitive))
+            continue
+
+        geometry_field, scale_field, shared_fields = INSTANCED_FIELDS[primitive_type]
+        geometry = getattr(primitive, geometry_field)
+
+        key = (primitive_type,) + tuple(getattr(primitive, f) for f in shared_fields)
+        if primitive_type is Surface:
+            # surfaces with and without normals can't be merged
+            key += (primitive.normals is None,)
+
+        batch = batches.get(key)
+        if batch is None:
+            batch = {"type": primitive.type, "instanced": True, geometry_field: []}
+            for f in shared_fields:
+                value = getattr(primitive, f)
+                if value is not None:
+                    batch[f] = value
+            batch["colors"] = []
+            if scale_field:
+                batch["scales"] = []
+            if primitive_type is Surface and primitive.normals is not None:
+                batch["normals"] = []
+            batches[key] = batch
+            contents.append(batch)
+
+        if primitive_type is Convex:
+            # every convex hull is a separate instance
+            batch[geometry_field].append(geometry)
+            num_instances = 1
+        else:
+            batch[geometry_field].extend(geometry)
+            if primitive_type is Lines:
+                num_instances = len(geometry) // 2
+            elif primitive_type is Surface:
+                num_instances = len(geometry) // 3
+                if "normals" in batch:
+                    batch["normals"].extend(primitive.normals)
+            else:
+                num_instances = len(geometry)
+
+        batch["colors"].extend([primitive.color] * num_instances)
+        if scale_field:
+            scale = getattr(primitive, scale_field)
+            batch["scales"].extend([scale] * num_instances)
+
+    return {"name": scene.name, "contents": contents}
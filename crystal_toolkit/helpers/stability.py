@@ -0,0 +1,359 @@
+"""
+Batched thermodynamic stability analysis for pymatgen PhaseDiagrams.
+
+PhaseDiagram.get_e_above_hull() and related methods search the hull facets
+for every entry separately. The functions here instead locate the facets for
+many compositions at once, by solving for the barycentric co-ordinates of all
+compositions in all facets as a single vectorized operation.
+"""
+
+from collections import defaultdict
+from copy import copy
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from pymatgen.analysis.phase_diagram import PhaseDiagram
+
+# same tolerance as PhaseDiagram uses to find the facet containing a composition
+IN_FACET_TOL = PhaseDiagram.numerical_tol / 10
+
+# maximum number of (composition, facet, vertex) barycentric co-ordinates to
+# hold in memory at once
+CHUNK_SIZE = 2_000_000
+
+
+def get_fractions(pd: PhaseDiagram, compositions) -> np.ndarray:
+    """
+    :param pd: PhaseDiagram
+    :param compositions: list of Compositions
+    :return: array of the atomic fraction of every element of the phase
+    diagram, shape (len(compositions), pd.dim); rows are NaN for compositions
+    containing other elements
+    """
+    element_indices = {el: idx for idx, el in enumerate(pd.elements)}
+    amounts = np.zeros((len(compositions), pd.dim))
+    for row, composition in enumerate(compositions):
+        for el, amount in composition.items():
+            idx = element_indices.get(el)
+            if idx is None:
+                amounts[row] = np.nan
+                break
+            amounts[row, idx] = amount
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return amounts / amounts.sum(axis=1, keepdims=True)
+
+
+def get_facet_matrices(pd: PhaseDiagram) -> np.ndarray:
+    """
+    :param pd: PhaseDiagram
+    :return: for every facet of the convex hull, the matrix that gives the
+    barycentric co-ordinates of a point in the facet from its composition
+    (fractions of pd.elements[1:], followed by 1), shape (num_facets, dim, dim)
+    """
+    vertices = pd.qhull_data[np.array(pd.facets, dtype=int).reshape(-1, pd.dim)]
+    # columns are the vertices, each as fractions of elements[1:] and 1
+    augmented = np.concatenate(
+        [vertices[:, :, :-1], np.ones(vertices.shape[:2] + (1,))], axis=2
+    ).transpose(0, 2, 1)
+    return np.linalg.inv(augmented)
+
+
+def get_decompositions(
+    pd: PhaseDiagram, fractions: np.ndarray, facet_matrices: Optional[np.ndarray] = None
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Find the facet of the convex hull for many compositions at once.
+
+    :param pd: PhaseDiagram
+    :param fractions: atomic fractions of pd.elements, see get_fractions
+    :param facet_matrices: optional, result of get_facet_matrices to re-use
+    :return: a tuple of the index of the facet (into pd.facets) for every
+    composition (-1 if outside the phase diagram), the barycentric
+    co-ordinates of each composition in its facet (i.e. the amounts of each
+    decomposition product, per atom) and the energy per atom of the hull at
+    each composition (NaN if outside the phase diagram)
+    """
+
+    if facet_matrices is None:
+        facet_matrices = get_facet_matrices(pd)
+
+    num_facets, dim = len(facet_matrices), pd.dim
+    points = np.concatenate(
+        [fractions[:, 1:], np.ones((len(fractions), 1))], axis=1
+    )
+    facets = np.array(pd.facets, dtype=int).reshape(-1, dim)
+    facet_energies = pd.qhull_data[facets, -1]
+
+    facet_indices = np.full(len(points), -1, dtype=int)
+    coords = np.zeros((len(points), dim))
+
+    chunk_size = max(1, CHUNK_SIZE // max(1, num_facets * dim))
+    for start in range(0, len(points), chunk_size):
+        chunk = points[start : start + chunk_size]
+        # barycentric co-ordinates of every point in every facet
+        all_coords = np.einsum("fij,pj->pfi", facet_matrices, chunk)
+        in_facet = np.all(all_coords >= -IN_FACET_TOL, axis=2)
+        found = np.any(in_facet, axis=1)
+        # first matching facet, in the same order PhaseDiagram searches them
+        first = np.argmax(in_facet, axis=1)
+        rows = np.arange(len(chunk))
+        facet_indices[start : start + chunk_size] = np.where(found, first, -1)
+        coords[start : start + chunk_size] = all_coords[rows, first]
+
+    found = facet_indices >= 0
+    hull_energies = np.full(len(points), np.nan)
+    hull_energies[found] = np.einsum(
+        "pi,pi->p", coords[found], facet_energies[facet_indices[found]]
+    )
+
+    return facet_indices, coords, hull_energies
+
+
+def get_formation_energies_per_atom(
+    pd: PhaseDiagram, entries: List, fractions: Optional[np.ndarray] = None
+) -> np.ndarray:
+    """
+    :param pd: PhaseDiagram
+    :param entries: list of entries
+    :param fractions: optional, result of get_fractions for these entries
+    :return: formation energy per atom for every entry, equivalent to
+    pd.get_form_energy_per_atom(entry)
+    """
+    if fractions is None:
+        fractions = get_fractions(pd, [entry.composition for entry in entries])
+    energies = np.array([entry.energy_per_atom for entry in entries], dtype=float)
+    ref_energies = np.array([pd.el_refs[el].energy_per_atom for el in pd.elements])
+    return energies - fractions @ ref_energies
+
+
+def get_stability_data(
+    pd: PhaseDiagram, entries: Optional[List] = None
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Formation energies and energies above the hull for many entries at once.
+
+    :param pd: PhaseDiagram
+    :param entries: list of entries, defaults to pd.all_entries
+    :return: a tuple of arrays of formation energy per atom and energy above
+    hull per atom for every entry, equivalent to pd.get_form_energy_per_atom()
+    and pd.get_e_above_hull(); the energy above hull is NaN for entries
+    outside the phase diagram or below the hull (for which
+    pd.get_e_above_hull() raises an error)
+    """
+
+    if entries is None:
+        entries = pd.all_entries
+
+    fractions = get_fractions(pd, [entry.composition for entry in entries])
+    formation_energies = get_formation_energies_per_atom(
+        pd, entries, fractions=fractions
+    )
+
+    _, _, hull_energies = get_decompositions(pd, fractions)
+    energies = np.array([entry.energy_per_atom for entry in entries], dtype=float)
+    e_above_hull = energies - hull_energies
+
+    stable_entries = pd.stable_entries
+    is_stable = np.array([entry in stable_entries for entry in entries], dtype=bool)
+    e_above_hull[is_stable] = 0
+    e_above_hull[e_above_hull < -PhaseDiagram.numerical_tol] = np.nan
+
+    return formation_energies, e_above_hull
+
+
+def get_facet_chempots(pd: PhaseDiagram, referenced: bool = True) -> np.ndarray:
+    """
+    :param pd: PhaseDiagram
+    :param referenced: if True, chemical potentials are relative to the
+    elemental references
+    :return: chemical potentials of pd.elements at which the phases of each
+    facet coexist, shape (num_facets, dim), equivalent to
+    pd._get_facet_chempots() for every facet
+    """
+    facets = np.array(pd.facets, dtype=int).reshape(-1, pd.dim)
+    fractions = get_fractions(pd, [entry.composition for entry in pd.qhull_entries])
+    energies = np.array([entry.energy_per_atom for entry in pd.qhull_entries])
+    chempots = np.linalg.solve(fractions[facets], energies[facets][:, :, None])[:, :, 0]
+    if referenced:
+        chempots -= np.array([pd.el_refs[el].energy_per_atom for el in pd.elements])
+    return chempots
+
+
+def batch_stability_analysis(
+    pd: PhaseDiagram,
+    compositions: List,
+    energies_per_atom: Optional[List[float]] = None,
+    referenced: bool = True,
+) -> dict:
+    """
+    Stability analysis for many (hypothetical) compositions in the chemical
+    system of a phase diagram at once.
+
+    The chemical potential range of a composition is the range of the
+    chemical potential of each element over the facets of the hull that
+    contain all of its decomposition products, i.e. over the vertices of the
+    region of chemical potential space where those phases coexist.
+
+    :param pd: PhaseDiagram
+    :param compositions: list of Compositions
+    :param energies_per_atom: optional, energy per atom of each composition
+    (on the same scale as the entries of the phase diagram), to calculate the
+    energy above hull
+    :param referenced: if True, chemical potentials are relative to the
+    elemental references
+    :return: dict with keys "decompositions" (list of {entry: amount} in the
+    same format as pd.get_decomposition(), None if outside the phase diagram),
+    "hull_energies" (energy per atom of the hull at each composition),
+    "e_above_hull" (None if energies_per_atom isn't given) and
+    "chempot_ranges" (minimum and maximum chemical potential of each of
+    pd.elements, shape (len(compositions), dim, 2)); all arrays are NaN for
+    compositions outside the phase diagram
+    """
+
+    dim = pd.dim
+    qhull_entries = pd.qhull_entries
+    facets = np.array(pd.facets, dtype=int).reshape(-1, dim)
+    num_facets, num_points = len(facets), len(pd.qhull_data)
+
+    fractions = get_fractions(pd, compositions)
+    facet_indices, coords, hull_energies = get_decompositions(pd, fractions)
+    found = facet_indices >= 0
+    # vertices of each composition's facet that it actually decomposes to
+    vertices = facets[np.maximum(facet_indices, 0)]
+    is_product = (coords > IN_FACET_TOL) & found[:, None]
+
+    decompositions = [
+        {
+            qhull_entries[vertex]: amount
+            for vertex, amount, product in zip(row_vertices, row_coords, row_is_product)
+            if product
+        }
+        if row_found
+        else None
+        for row_vertices, row_coords, row_is_product, row_found in zip(
+            vertices.tolist(), coords.tolist(), is_product.tolist(), found.tolist()
+        )
+    ]
+
+    e_above_hull = None
+    if energies_per_atom is not None:
+        e_above_hull = np.array(energies_per_atom, dtype=float) - hull_energies
+
+    # which qhull points are vertices of each facet
+    facet_masks = np.zeros((num_facets, num_points), dtype=int)
+    facet_masks[np.repeat(np.arange(num_facets), dim), facets.ravel()] = 1
+    facet_chempots = get_facet_chempots(pd, referenced=referenced)
+
+    chempot_ranges = np.full((len(fractions), dim, 2), np.nan)
+    chunk_size = max(1, CHUNK_SIZE // max(1, num_facets * dim))
+    for start in range(0, len(fractions), chunk_size):
+        chunk = slice(start, start + chunk_size)
+        chunk_len = len(vertices[chunk])
+        product_masks = np.zeros((chunk_len, num_points), dtype=int)
+        product_masks[
+            np.repeat(np.arange(chunk_len), dim), vertices[chunk].ravel()
+        ] = is_product[chunk].ravel()
+        # facets that contain every decomposition product
+        coexisting = (product_masks @ facet_masks.T) == product_masks.sum(axis=1)[
+            :, None
+        ]
+        coexisting = coexisting[:, :, None]
+        chempot_ranges[chunk, :, 0] = np.where(
+            coexisting, facet_chempots, np.inf
+        ).min(axis=1)
+        chempot_ranges[chunk, :, 1] = np.where(
+            coexisting, facet_chempots, -np.inf
+        ).max(axis=1)
+    chempot_ranges[~found] = np.nan
+
+    return {
+        "decompositions": decompositions,
+        "hull_energies": hull_energies,
+        "e_above_hull": e_above_hull,
+        "chempot_ranges": chempot_ranges,
+    }
+
+
+def get_entry_key(entry) -> Tuple:
+    """
+    :param entry: PDEntry or ComputedEntry
+    :return: a key that identifies an entry after it has been serialized and
+    deserialized, when object identity can no longer be used
+    """
+    label = getattr(entry, "entry_id", None) or getattr(entry, "attribute", None)
+    return entry.composition.formula, entry.energy, str(label)
+
+
+def update_phase_diagram(pd: PhaseDiagram, entries: List) -> PhaseDiagram:
+    """
+    Construct the phase diagram for a new list of entries, re-using the convex
+    hull of an existing phase diagram if the hull is unchanged. This is the
+    case when every added entry lies above the hull and every removed entry
+    was not used to construct it. Otherwise, falls back to constructing a new
+    PhaseDiagram from scratch.
+
+    Entries in the new list that are also in the existing phase diagram (see
+    get_entry_key) are replaced by the entry objects used to construct its
+    hull, so that they can still be found in pd.stable_entries. Entries are
+    matched by key rather than identity since, in a deserialized phase
+    diagram, pd.qhull_entries can be copies of the entries in pd.all_entries.
+
+    :param pd: existing PhaseDiagram
+    :param entries: complete list of entries for the new phase diagram
+    :return: PhaseDiagram
+    """
+
+    hull_entries = defaultdict(list)
+    unique_hull_entries = {
+        id(entry): entry
+        for entry in list(pd.qhull_entries) + list(pd.el_refs.values())
+    }
+    for entry in unique_hull_entries.values():
+        hull_entries[get_entry_key(entry)].append(entry)
+    qhull_keys = {get_entry_key(entry) for entry in pd.qhull_entries}
+
+    old_entries = defaultdict(list)
+    for entry in pd.all_entries:
+        key = get_entry_key(entry)
+        matches = hull_entries.get(key)
+        old_entries[key].append(matches.pop() if matches else entry)
+
+    new_entries = []
+    added_entries = []
+    for entry in entries:
+        matches = old_entries.get(get_entry_key(entry))
+        if matches:
+            new_entries.append(matches.pop())
+        else:
+            new_entries.append(entry)
+            added_entries.append(entry)
+    removed_entries = [entry for matches in old_entries.values() for entry in matches]
+
+    if not added_entries and not removed_entries:
+        return pd
+
+    # removing an entry used to construct the hull (stable or not) changes it
+    if any(get_entry_key(entry) in qhull_keys for entry in removed_entries):
+        return PhaseDiagram(entries)
+
+    # adding an entry on or below the hull, or outside the chemical system,
+    # changes it
+    if added_entries:
+        elements = set(pd.elements)
+        if any(not elements.issuperset(entry.composition.elements) for entry in added_entries):
+            return PhaseDiagram(entries)
+        fractions = get_fractions(pd, [entry.composition for entry in added_entries])
+        _, _, hull_energies = get_decompositions(pd, fractions)
+        energies = np.array([entry.energy_per_atom for entry in added_entries])
+        if not np.all(energies - hull_energies > PhaseDiagram.numerical_tol):
+            return PhaseDiagram(entries)
+
+    updated_pd = copy(pd)
+    updated_pd.all_entries = new_entries
+    # newer versions of pymatgen also keep the entries in computed_data
+    if hasattr(pd, "computed_data"):
+        updated_pd.computed_data = dict(pd.computed_data, all_entries=new_entries)
+        updated_pd.entries = new_entries
+
+    return updated_pd
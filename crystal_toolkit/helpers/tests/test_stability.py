@@ -0,0 +1,67 @@
+import unittest
+
+from pymatgen.core.composition import Composition
+from pymatgen.analysis.phase_diagram import PhaseDiagram, PDEntry
+
+from crystal_toolkit.helpers.stability import get_entry_key, update_phase_diagram
+
+
+class UpdatePhaseDiagramTest(unittest.TestCase):
+    def setUp(self):
+        entries = [
+            ("Mn", -9.0),
+            ("O", -5.0),
+            ("Y", -6.5),
+            ("MnO", -22.0),
+            ("MnO2", -27.0),
+            ("Mn2O3", -47.0),
+            ("Y2O3", -60.0),
+            ("YMnO3", -65.0),
+            ("YMn2O5", -90.0),
+            ("Mn3O4", -60.0),
+            ("YO", -10.0),
+        ]
+        self.entries = [
+            PDEntry(Composition(formula), energy, attribute=f"entry-{idx}")
+            for idx, (formula, energy) in enumerate(entries)
+        ]
+        # as decoded by PhaseDiagramComponent.pd_from_data, the entries of
+        # this phase diagram are not the same objects as self.entries
+        self.pd = PhaseDiagram.from_dict(PhaseDiagram(self.entries).as_dict())
+
+    def assertSamePhaseDiagram(self, pd, reference):
+        self.assertEqual(
+            {get_entry_key(entry) for entry in pd.stable_entries},
+            {get_entry_key(entry) for entry in reference.stable_entries},
+        )
+        self.assertEqual(
+            sorted(get_entry_key(entry) for entry in pd.all_entries),
+            sorted(get_entry_key(entry) for entry in reference.all_entries),
+        )
+        # stable entries have to be found in all_entries to serialize
+        PhaseDiagram.from_dict(pd.as_dict())
+
+    def test_remove_stable_entry(self):
+        stable_keys = {get_entry_key(entry) for entry in self.pd.stable_entries}
+        removed = get_entry_key(PDEntry(Composition("MnO"), -22.0, attribute="entry-3"))
+        self.assertIn(removed, stable_keys)
+
+        entries = [entry for entry in self.entries if get_entry_key(entry) != removed]
+        pd = update_phase_diagram(self.pd, entries)
+
+        self.assertNotIn(removed, {get_entry_key(entry) for entry in pd.stable_entries})
+        self.assertSamePhaseDiagram(pd, PhaseDiagram(entries))
+
+    def test_add_unstable_entry(self):
+        entries = self.entries + [
+            PDEntry(Composition("YMnO3"), -40.0, attribute="unstable")
+        ]
+        pd = update_phase_diagram(self.pd, entries)
+
+        # the convex hull is re-used
+        self.assertIs(pd.facets, self.pd.facets)
+        self.assertSamePhaseDiagram(pd, PhaseDiagram(entries))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,6 +1,8 @@
 import numpy as np
 
+from collections import OrderedDict
 from fractions import Fraction
+from threading import Lock
 
 
 def pretty_frac_format(x):
@@ -14,3 +16,74 @@ def pretty_frac_format(x):
     else:
         x_str = str(fraction)
     return x_str
+
+
+_MISSING = object()
+
+
+class LRUCache:
+    """
+    A bounded, thread-safe, least-recently-used cache of in-process objects
+    (e.g. decoded phase diagrams or bonding graphs), which can be shared
+    between callbacks running in different threads.
+    """
+
+    def __init__(self, maxsize):
+        """
+        :param maxsize: maximum number of items, the least recently used item
+        is evicted when this is exceeded
+        """
+        self.maxsize = maxsize
+        self._items = OrderedDict()
+        self._lock = Lock()
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._items
+
+    def __len__(self):
+        with self._lock:
+            return len(self._items)
+
+    def get(self, key, default=None):
+        """
+        :param key: key
+        :param default: value to return if key is not in the cache
+        :return: cached value, or default
+        """
+        with self._lock:
+            value = self._items.get(key, _MISSING)
+            if value is _MISSING:
+                return default
+            self._items.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        """
+        :param key: key
+        :param value: value to cache
+        :return: value
+        """
+        with self._lock:
+            self._items[key] = value
+            self._items.move_to_end(key)
+            if len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+        return value
+
+    def get_or_compute(self, key, func):
+        """
+        :param key: key
+        :param func: function without arguments to compute the value if key
+        is not in the cache (called without holding the lock, so the same
+        value may occasionally be computed by two threads at once)
+        :return: cached or computed value
+        """
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            value = self.set(key, func())
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()